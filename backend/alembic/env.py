@@ -12,9 +12,14 @@ from app.database import Base
 from app.models.task import Task
 from app.models.note import Note
 from app.models.file import File
+from app.models.file_content import FileContent
 from app.models.task_link import TaskLink
 from app.models.note_link import NoteLink
 from app.models.event_log import EventLog
+from app.models.canvas import Canvas
+from app.models.change_version import ChangeVersion
+from app.models.sync_operation import SyncOperation
+from app.models.tombstone import Tombstone
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,68 @@
+"""Add canvases and scope all entities by canvas
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+# Таблицы, которые получают canvas_id
+CANVAS_TABLES = ['tasks', 'notes', 'task_links', 'note_links', 'files', 'event_logs']
+
+
+def upgrade() -> None:
+    # Создаем таблицу холстов и основной холст для уже существующих данных
+    op.create_table('canvases',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_canvases_id', 'canvases', ['id'])
+    op.execute("INSERT INTO canvases (id, title) VALUES ('default', 'Основной холст')")
+
+    # Все существующие записи попадают на основной холст через server_default
+    for table in CANVAS_TABLES:
+        op.add_column(table, sa.Column('canvas_id', sa.String(), server_default='default', nullable=False))
+        op.create_foreign_key(f'{table}_canvas_id_fkey', table, 'canvases', ['canvas_id'], ['id'], ondelete='CASCADE')
+
+    # Составные индексы с canvas_id в качестве ведущей колонки
+    op.create_index('ix_tasks_canvas_id_z_index', 'tasks', ['canvas_id', 'z_index'])
+    op.create_index('ix_notes_canvas_id_z_index', 'notes', ['canvas_id', 'z_index'])
+    op.create_index('ix_task_links_canvas_id', 'task_links', ['canvas_id'])
+    op.create_index('ix_task_links_canvas_id_source_id', 'task_links', ['canvas_id', 'source_id'])
+    op.create_index('ix_task_links_canvas_id_target_id', 'task_links', ['canvas_id', 'target_id'])
+    op.create_index('ix_note_links_canvas_id', 'note_links', ['canvas_id'])
+    op.create_index('ix_note_links_canvas_id_source_id', 'note_links', ['canvas_id', 'source_id'])
+    op.create_index('ix_note_links_canvas_id_target_id', 'note_links', ['canvas_id', 'target_id'])
+    op.create_index('ix_files_canvas_id', 'files', ['canvas_id'])
+    op.create_index('ix_event_logs_canvas_id_timestamp', 'event_logs', ['canvas_id', 'timestamp'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_event_logs_canvas_id_timestamp', table_name='event_logs')
+    op.drop_index('ix_files_canvas_id', table_name='files')
+    op.drop_index('ix_note_links_canvas_id_target_id', table_name='note_links')
+    op.drop_index('ix_note_links_canvas_id_source_id', table_name='note_links')
+    op.drop_index('ix_note_links_canvas_id', table_name='note_links')
+    op.drop_index('ix_task_links_canvas_id_target_id', table_name='task_links')
+    op.drop_index('ix_task_links_canvas_id_source_id', table_name='task_links')
+    op.drop_index('ix_task_links_canvas_id', table_name='task_links')
+    op.drop_index('ix_notes_canvas_id_z_index', table_name='notes')
+    op.drop_index('ix_tasks_canvas_id_z_index', table_name='tasks')
+
+    for table in reversed(CANVAS_TABLES):
+        op.drop_constraint(f'{table}_canvas_id_fkey', table, type_='foreignkey')
+        op.drop_column(table, 'canvas_id')
+
+    op.drop_index('ix_canvases_id', table_name='canvases')
+    op.drop_table('canvases')
@@ -0,0 +1,31 @@
+"""Store card content as JSONB
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # JSONB хранится в разобранном бинарном виде и сжимается TOAST, в отличие от текстового JSON
+    for table in ('tasks', 'notes'):
+        op.alter_column(table, 'content',
+                        type_=postgresql.JSONB(astext_type=sa.Text()),
+                        postgresql_using='content::jsonb')
+
+
+def downgrade() -> None:
+    for table in ('tasks', 'notes'):
+        op.alter_column(table, 'content',
+                        type_=postgresql.JSON(astext_type=sa.Text()),
+                        postgresql_using='content::json')
@@ -0,0 +1,30 @@
+"""Add change_versions for HTTP caching
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Счетчики изменений по (таблица, холст) для ETag/Last-Modified
+    op.create_table('change_versions',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('canvas_id', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('table_name', 'canvas_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('change_versions')
@@ -0,0 +1,84 @@
+"""Cascade link deletes and check polymorphic link targets
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+# (таблица, колонка, таблица цели) внешних ключей связей
+LINK_FOREIGN_KEYS = [
+    ('task_links', 'source_id', 'tasks'),
+    ('note_links', 'source_id', 'notes'),
+    ('note_links', 'target_id', 'notes'),
+]
+
+
+def upgrade() -> None:
+    # Связи удаляются вместе с карточкой, а не обнуляются ORM
+    for table, column, target in LINK_FOREIGN_KEYS:
+        op.drop_constraint(f'{table}_{column}_fkey', table, type_='foreignkey')
+        op.create_foreign_key(f'{table}_{column}_fkey', table, target, [column], ['id'], ondelete='CASCADE')
+
+    # У task_links.target_id нет внешнего ключа (задача или заметка): то же самое триггерами
+    op.execute("""
+        CREATE OR REPLACE FUNCTION task_links_drop_targets() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM task_links l USING deleted d
+            WHERE l.target_id = d.id AND l.link_target_type = TG_ARGV[0];
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER tasks_drop_link_targets AFTER DELETE ON tasks
+        REFERENCING OLD TABLE AS deleted FOR EACH STATEMENT EXECUTE FUNCTION task_links_drop_targets('task')
+    """)
+    op.execute("""
+        CREATE TRIGGER notes_drop_link_targets AFTER DELETE ON notes
+        REFERENCING OLD TABLE AS deleted FOR EACH STATEMENT EXECUTE FUNCTION task_links_drop_targets('note')
+    """)
+    # Проверка цели откладывается до коммита: импорт может вставить связь раньше карточки
+    op.execute("""
+        CREATE OR REPLACE FUNCTION task_links_check_target() RETURNS trigger AS $$
+        BEGIN
+            PERFORM 1 FROM task_links WHERE id = NEW.id;
+            IF NOT FOUND THEN
+                RETURN NULL;
+            END IF;
+            IF NEW.link_target_type = 'note' THEN
+                PERFORM 1 FROM notes WHERE id = NEW.target_id AND canvas_id = NEW.canvas_id;
+            ELSE
+                PERFORM 1 FROM tasks WHERE id = NEW.target_id AND canvas_id = NEW.canvas_id;
+            END IF;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+                    MESSAGE = 'Цель связи не найдена: ' || coalesce(NEW.link_target_type, '') || ' ' || coalesce(NEW.target_id, '');
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE CONSTRAINT TRIGGER task_links_target_exists
+        AFTER INSERT OR UPDATE OF target_id, link_target_type ON task_links
+        DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION task_links_check_target()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS task_links_target_exists ON task_links")
+    op.execute("DROP TRIGGER IF EXISTS notes_drop_link_targets ON notes")
+    op.execute("DROP TRIGGER IF EXISTS tasks_drop_link_targets ON tasks")
+    op.execute("DROP FUNCTION IF EXISTS task_links_check_target()")
+    op.execute("DROP FUNCTION IF EXISTS task_links_drop_targets()")
+    for table, column, target in LINK_FOREIGN_KEYS:
+        op.drop_constraint(f'{table}_{column}_fkey', table, type_='foreignkey')
+        op.create_foreign_key(f'{table}_{column}_fkey', table, target, [column], ['id'])
@@ -0,0 +1,44 @@
+"""Add file_contents for attachment search
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Текст вложений; заполняется фоновым индексатором для уже загруженных файлов тоже
+    op.create_table('file_contents',
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('canvas_id', sa.String(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('indexed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['canvas_id'], ['canvases.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('file_id')
+    )
+    op.create_index('ix_file_contents_canvas_id', 'file_contents', ['canvas_id'])
+    # Готовый tsvector: поиск и ранжирование не разбирают текст заново
+    op.execute("""
+        ALTER TABLE file_contents ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('russian', coalesce(text, ''))) STORED
+    """)
+    op.execute("CREATE INDEX ix_file_contents_search_vector ON file_contents USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_file_contents_search_vector', table_name='file_contents')
+    op.drop_index('ix_file_contents_canvas_id', table_name='file_contents')
+    op.drop_table('file_contents')
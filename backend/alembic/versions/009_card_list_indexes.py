@@ -0,0 +1,42 @@
+"""Indexes for keyset pagination and filters of card lists
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+# Колонки фильтров, свои у каждой таблицы (models: __filter_columns__)
+FILTER_COLUMNS = {
+    'tasks': ('task_type', 'parent_id'),
+    'notes': ('note_type', 'task_id'),
+}
+
+
+def _indexes(table):
+    yield f'ix_{table}_canvas_id_z_order', ['canvas_id', sa.text('coalesce(z_index, 0)'), 'id']
+    yield f'ix_{table}_canvas_id_changed', ['canvas_id', sa.text('coalesce(updated_at, created_at)'), 'id']
+    yield f'ix_{table}_canvas_id_created_at', ['canvas_id', 'created_at']
+    yield f'ix_{table}_canvas_id_x_y', ['canvas_id', 'x', 'y']
+    for column in FILTER_COLUMNS[table]:
+        yield f'ix_{table}_canvas_id_{column}', ['canvas_id', column]
+
+
+def upgrade() -> None:
+    for table in FILTER_COLUMNS:
+        for name, columns in _indexes(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for table in FILTER_COLUMNS:
+        for name, _ in _indexes(table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,62 @@
+"""Add sync_operations and tombstones for offline sync
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Примененные операции офлайн-клиентов: повтор операции отдает сохраненный результат
+    op.create_table('sync_operations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('canvas_id', sa.String(), nullable=False),
+        sa.Column('client_id', sa.String(), nullable=False),
+        sa.Column('op_id', sa.String(), nullable=False),
+        sa.Column('entity_type', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.String(), nullable=True),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('result', sa.JSON(), nullable=False),
+        sa.Column('client_ts', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('applied_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['canvas_id'], ['canvases.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('client_id', 'op_id', name='uq_sync_operations_client_id_op_id')
+    )
+    op.create_index('ix_sync_operations_applied_at', 'sync_operations', ['applied_at'])
+
+    # Удаленные карточки и связи - их строк в таблицах больше нет
+    op.create_table('tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('canvas_id', sa.String(), nullable=False),
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.String(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['canvas_id'], ['canvases.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_canvas_id_deleted_at', 'tombstones', ['canvas_id', 'deleted_at'])
+    op.create_index('ix_tombstones_deleted_at', 'tombstones', ['deleted_at'])
+
+    op.create_index('ix_task_links_canvas_id_created_at', 'task_links', ['canvas_id', 'created_at'])
+    op.create_index('ix_note_links_canvas_id_created_at', 'note_links', ['canvas_id', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_note_links_canvas_id_created_at', table_name='note_links')
+    op.drop_index('ix_task_links_canvas_id_created_at', table_name='task_links')
+    op.drop_index('ix_tombstones_deleted_at', table_name='tombstones')
+    op.drop_index('ix_tombstones_canvas_id_deleted_at', table_name='tombstones')
+    op.drop_table('tombstones')
+    op.drop_index('ix_sync_operations_applied_at', table_name='sync_operations')
+    op.drop_table('sync_operations')
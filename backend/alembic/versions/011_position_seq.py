@@ -0,0 +1,28 @@
+"""Add pos_seq to tasks and notes for ordered position writes
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+TABLES = ('tasks', 'notes')
+
+
+def upgrade() -> None:
+    # Номер изменения положения: сброс буфера перетаскивания не затирает более новое
+    for table in TABLES:
+        op.add_column(table, sa.Column('pos_seq', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_column(table, 'pos_seq')
@@ -1,15 +1,3 @@
-from .task import (
-    get_task,
-    get_tasks,
-    create_task,
-    update_task,
-    delete_task
-)
-
-from .note import (
-    get_note,
-    get_notes,
-    create_note,
-    update_note,
-    delete_note
-)
\ No newline at end of file
+from .base import BaseCRUD, get_next_z_index
+from .task import TaskCRUD, task_crud
+from .note import NoteCRUD, note_crud
@@ -1,49 +1,332 @@
-from typing import List, Optional, Type, Generic, TypeVar
+"""
+Общий сервис карточек.
+
+Задачи и заметки устроены одинаково (BaseCard), поэтому обработчики /api/cards и
+/api/notes - одни и те же и работают через BaseCRUD; подклассы задают только
+различия: поле привязки, название по умолчанию, тексты ответов и схемы.
+
+Чтения списков идут проекцией по колонкам схемы с условиями в SQL; страницы
+(page) - keyset-пагинацией по (ключ сортировки, id) без OFFSET, под каждый
+ключ и фильтр есть индекс (models/base_card.py). Одиночные чтения - через
+entity_cache.
+Массовые операции выполняются одной транзакцией и сами сбрасывают кэши и
+версии change_versions, если пишут в обход flush.
+"""
+import base64
+import binascii
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Generic, Iterable, List, Optional, Sequence, Tuple, Type, TypeVar
+
 from fastapi import HTTPException
+from sqlalchemy import String, func, literal_column, select, tuple_, type_coerce, union_all, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+
+from ..models import Note, Task
 from ..models.base_card import BaseCard
+from ..services import entity_cache, http_cache, integrity, placement, serialization
+from ..services.serialization import JSONSerializer
+from ..services.write_coalescer import coalescer, stamp
 
 ModelType = TypeVar("ModelType", bound=BaseCard)
 
+# Колонки, которые клиент не меняет
+READONLY_FIELDS = {"id", "canvas_id", "created_at", "updated_at", "pos_seq"}
+
+# Размер страницы по умолчанию и наибольший
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+
+def get_next_z_index(db: Session, canvas_id: str) -> int:
+    """Следующий z_index холста: максимум по задачам и заметкам одним запросом"""
+    # Каждая ветка обслуживается индексом (canvas_id, z_index)
+    top = union_all(
+        select(func.max(Task.z_index).label("z_index")).where(Task.canvas_id == canvas_id),
+        select(func.max(Note.z_index).label("z_index")).where(Note.canvas_id == canvas_id),
+    ).subquery()
+    top_z_index = db.execute(select(func.max(top.c.z_index))).scalar() or 0
+    # Поднятые наверх при перетаскивании карточки могут быть еще в буфере
+    return max(top_z_index, coalescer.max_z_index(canvas_id) or 0) + 1
+
+
+def encode_cursor(order: str, key: Any, id: str) -> str:
+    """Курсор следующей страницы: порядок и ключ последней строки"""
+    payload = json.dumps([order, key, id], default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, order: str) -> Tuple[Any, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        cursor_order, key, id = payload
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    if cursor_order != order:
+        raise HTTPException(status_code=400, detail="Курсор получен для другого порядка сортировки")
+    return key, id
+
+
+def range_params(created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                 updated_after: Optional[datetime] = None, updated_before: Optional[datetime] = None,
+                 x0: Optional[int] = None, y0: Optional[int] = None,
+                 x1: Optional[int] = None, y1: Optional[int] = None) -> Dict[str, Any]:
+    """Общие фильтры списков: даты и прямоугольник x0..y1, с которым карточка пересекается"""
+    return {
+        "created": (created_after, created_before),
+        "updated": (updated_after, updated_before),
+        "bbox": (x0, y0, x1, y1) if None not in (x0, y0, x1, y1) else None,
+    }
+
 
 class BaseCRUD(Generic[ModelType]):
-    def __init__(self, model: Type[ModelType]):
+    """Операции с карточками одного типа в пределах холста"""
+
+    def __init__(self, model: Type[ModelType], schema, summary_schema, *, anchor_field: str,
+                 default_title: str, not_found: str, deleted: str):
         self.model = model
+        self.anchor_field = anchor_field
+        self.default_title = default_title
+        self.not_found = not_found
+        self.deleted = deleted
+        self.writable = {column.key for column in model.__table__.columns} - READONLY_FIELDS
+        # Проекции и сериализаторы собираются один раз
+        self.columns = serialization.columns(model, schema)
+        self.summary_columns = serialization.columns(model, summary_schema)
+        self.serializer = JSONSerializer(List[schema])
+        self.summary_serializer = JSONSerializer(List[summary_schema])
+        # updated_at пуст, пока карточку не меняли
+        self.changed = func.coalesce(model.updated_at, model.created_at)
+        # Ключи page; выражения совпадают с индексами ix_*_z_order и ix_*_changed
+        self.sort_keys = {
+            "z_index": func.coalesce(model.z_index, literal_column("0")),
+            # В курсоре время остается в том виде, в каком хранится (в SQLite - строка без микросекунд)
+            "updated_at": type_coerce(self.changed, String),
+        }
 
-    def get(self, db: Session, id: str) -> Optional[ModelType]:
-        return db.query(self.model).filter(self.model.id == id).first()
+    # Чтение
 
-    def get_multi(self, db: Session, skip: int = 0, limit: int = 100) -> List[ModelType]:
-        return db.query(self.model).offset(skip).limit(limit).all()
+    def get(self, db: Session, id: str, canvas_id: str) -> Optional[ModelType]:
+        return db.query(self.model).filter(self.model.id == id, self.model.canvas_id == canvas_id).first()
 
-    def create(self, db: Session, obj_in) -> ModelType:
-        db_obj = self.model(**obj_in.model_dump())
-        db.add(db_obj)
-        db.commit()
-        db.refresh(db_obj)
-        return db_obj
+    def get_or_404(self, db: Session, id: str, canvas_id: str) -> ModelType:
+        obj = self.get(db, id, canvas_id)
+        if obj is None:
+            raise HTTPException(status_code=404, detail=self.not_found)
+        return obj
 
-    def update(self, db: Session, db_obj: ModelType, obj_in) -> ModelType:
-        for field, value in obj_in.model_dump(exclude_unset=True).items():
-            setattr(db_obj, field, value)
-        db.commit()
-        db.refresh(db_obj)
-        return db_obj
+    def get_cached(self, db: Session, id: str, canvas_id: str) -> Dict[str, Any]:
+        """Снимок колонок из entity_cache; 404, если на холсте такой нет"""
+        snapshot = entity_cache.get_entity(db, self.model, id, canvas_id)
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail=self.not_found)
+        # Положение, еще не записанное из буфера слияния
+        snapshot.update(coalescer.pending(self.model, id) or {})
+        return snapshot
+
+    def exists(self, db: Session, id: str, canvas_id: str) -> bool:
+        return entity_cache.entity_exists(db, self.model, id, canvas_id)
+
+    def get_multi(self, db: Session, canvas_id: str, *, include_content: bool = False,
+                  filters: Sequence = (), order_by: Sequence = (), after: Optional[Sequence] = None,
+                  descending: bool = False, limit: Optional[int] = None,
+                  columns: Optional[Sequence] = None) -> List[Row]:
+        """
+        Строки холста проекцией по колонкам схемы (краткой или с содержимым).
 
-    def remove(self, db: Session, id: str) -> ModelType:
-        obj = db.query(self.model).get(id)
-        if not obj:
-            raise HTTPException(status_code=404, detail=f"{self.model.__name__} not found")
+        filters - условия SQLAlchemy; after - значения order_by последней строки
+        предыдущей страницы (keyset: сравнение кортежей, без OFFSET).
+        """
+        if columns is None:
+            columns = self.columns if include_content else self.summary_columns
+        query = select(*columns).where(self.model.canvas_id == canvas_id, *filters)
+        if after is not None:
+            position, lead = tuple_(*order_by), order_by[0]
+            # Условие на первый ключ отдельно: по сравнению кортежей с выражением SQLite индекс не сужает
+            if descending:
+                query = query.where(lead <= after[0], position < tuple_(*after))
+            else:
+                query = query.where(lead >= after[0], position > tuple_(*after))
+        if order_by:
+            query = query.order_by(*(column.desc() for column in order_by) if descending else order_by)
+        if limit is not None:
+            query = query.limit(limit)
+        return db.execute(query).all()
+
+    def page(self, db: Session, canvas_id: str, *, order: str = "z_index", cursor: Optional[str] = None,
+             limit: int = PAGE_SIZE, include_content: bool = False,
+             filters: Sequence = ()) -> Tuple[List[Row], Optional[str]]:
+        """Страница по ключу order ("-" в начале - по убыванию) и курсор следующей (None - страница последняя)"""
+        key = self.sort_keys.get(order.removeprefix("-"))
+        if key is None:
+            raise HTTPException(status_code=400, detail="Неизвестный порядок сортировки")
+        columns = [*(self.columns if include_content else self.summary_columns), key.label("sort_key")]
+        rows = self.get_multi(db, canvas_id, columns=columns, filters=filters, order_by=(key, self.model.id),
+                              after=decode_cursor(cursor, order) if cursor else None,
+                              descending=order.startswith("-"), limit=limit)
+        next_cursor = encode_cursor(order, rows[-1].sort_key, rows[-1].id) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def filter_params(self) -> Dict[str, Any]:
+        """Зависимость FastAPI: значения колонок __filter_columns__ из запроса (подклассы)"""
+        return {}
+
+    def filters(self, fields: Dict[str, Any], ranges: Dict[str, Any]) -> List:
+        """Условия списка из filter_params и range_params"""
+        model = self.model
+        conditions = [getattr(model, field) == value for field, value in fields.items() if value is not None]
+        for expression, (start, end) in ((model.created_at, ranges["created"]), (self.changed, ranges["updated"])):
+            if start is not None:
+                conditions.append(expression >= start)
+            if end is not None:
+                conditions.append(expression < end)
+        if ranges["bbox"] is not None:
+            x0, y0, x1, y1 = ranges["bbox"]
+            # Правая граница - по индексу (canvas_id, x, y), остальные проверяются у найденных строк
+            conditions += [model.x <= x1, model.y <= y1,
+                           model.x + func.coalesce(model.width, 0) >= x0,
+                           model.y + func.coalesce(model.height, 0) >= y0]
+        return conditions
+
+    def list_response(self, rows: List[Row], include_content: bool = False):
+        serializer = self.serializer if include_content else self.summary_serializer
+        return serializer.response(rows)
+
+    # Запись
+
+    def anchor(self, data: Dict[str, Any]) -> Optional[str]:
+        """Карточка, к которой привязана новая (родитель задачи, задача заметки)"""
+        return data.get(self.anchor_field)
+
+    def create(self, db: Session, canvas_id: str, data: Dict[str, Any], *, id: Optional[str] = None,
+               commit: bool = True) -> ModelType:
+        """Создать карточку; id задает офлайн-клиент (/api/sync), commit=False оставляет транзакцию открытой"""
+        z_index = data.get("z_index")
+        if z_index is None:
+            z_index = get_next_z_index(db, canvas_id)
+
+        anchor = self.anchor(data)
+        id = id or str(uuid.uuid4())
+        width = data.get("width", 300)
+        height = data.get("height", 200)
+        x, y = data.get("x"), data.get("y")
+        reserved = x is None or y is None
+        if reserved:
+            # Без координат - рядом с опорной карточкой (привязанной или последней созданной), без наложений;
+            # слот занят за этой карточкой, пока она не записана
+            x, y = placement.find_slot(db, canvas_id, width, height, anchor_id=data.get("anchor_id") or anchor,
+                                       reserve_id=id, z_index=z_index)
+
+        obj = self.model(
+            id=id,
+            canvas_id=canvas_id,
+            title=data.get("title", self.default_title),
+            content=data.get("content", []),
+            x=x,
+            y=y,
+            z_index=z_index,
+            width=width,
+            height=height,
+            **{self.anchor_field: anchor},
+        )
+        try:
+            db.add(obj)
+            if commit:
+                db.commit()
+            else:
+                db.flush()
+        except Exception:
+            if reserved:
+                placement.release(canvas_id, id)
+            raise
+        if commit:
+            placement.apply_changes(db, canvas_id, 1, placed={id: ((x, y, width, height), z_index)})
+            db.refresh(obj)
+        elif reserved:
+            placement.release(canvas_id, id, keep=True)
+        return obj
+
+    def update(self, db: Session, id: str, canvas_id: str, data: Dict[str, Any], *, commit: bool = True):
+        """
+        Изменить карточку. Только x/y/z_index (перетаскивание) откладываются в
+        буфер слияния и возвращаются поверх снимка без записи в БД.
+        """
+        if commit and coalescer.accepts(data):
+            snapshot = self.get_cached(db, id, canvas_id)
+            snapshot.update(coalescer.offer(self.model, canvas_id, id, data))
+            return snapshot
+        data = {**coalescer.take(self.model, [id]).get(id, {}), **data}
+        obj = self.get_or_404(db, id, canvas_id)
+        data = stamp({field: value for field, value in data.items() if field in self.writable})
+        for field, value in data.items():
+            setattr(obj, field, value)
+        if commit:
+            bumped = int(obj in db.dirty)  # flush увеличит версию, только если есть что писать
+            db.commit()
+            placement.apply_changes(db, canvas_id, bumped, moved={id: data})
+            db.refresh(obj)
+        else:
+            db.flush()
+        return obj
+
+    def remove(self, db: Session, id: str, canvas_id: str, *, commit: bool = True) -> None:
+        coalescer.take(self.model, [id])
+        obj = self.get_or_404(db, id, canvas_id)
+        integrity.delete_links(db, self.model, [id], canvas_id)
         db.delete(obj)
+        if commit:
+            db.commit()
+            placement.apply_changes(db, canvas_id, 1, removed=[id])
+        else:
+            db.flush()
+
+    # Массовые операции
+
+    def _check_ids(self, db: Session, canvas_id: str, ids: Iterable[str]) -> List[str]:
+        ids = list(dict.fromkeys(ids))
+        found = set(db.execute(
+            select(self.model.id).where(self.model.canvas_id == canvas_id, self.model.id.in_(ids))
+        ).scalars())
+        if len(found) != len(ids):
+            raise HTTPException(status_code=404, detail=self.not_found)
+        return ids
+
+    def bulk_update(self, db: Session, canvas_id: str, items: List[Dict[str, Any]]) -> int:
+        """
+        Изменить несколько карточек одним executemany (например, перенос выделения).
+
+        Все id должны быть на холсте, иначе ничего не меняется.
+        """
+        # Отложенные положения этих карточек пишутся здесь же, под новыми значениями
+        pending = coalescer.take(self.model, (item["id"] for item in items))
+        rows = [{"id": item["id"], **stamp({**pending.get(item["id"], {}),
+                                            **{field: value for field, value in item.items() if field in self.writable}})}
+                for item in items]
+        rows = [row for row in rows if len(row) > 1]
+        if not rows:
+            return 0
+        self._check_ids(db, canvas_id, (row["id"] for row in rows))
+        # ORM bulk UPDATE по первичному ключу: flush не вызывается, кэши и версии сбрасываются здесь
+        db.execute(update(self.model).where(self.model.canvas_id == canvas_id), rows,
+                   execution_options={"synchronize_session": None})
+        table = self.model.__tablename__
+        http_cache.bump_versions(db.connection(), [(table, canvas_id)])
+        entity_cache.mark_changed(db, [(table, row["id"]) for row in rows])
         db.commit()
-        return obj
+        return len(rows)
 
-    def get_by_position(self, db: Session, x: int, y: int) -> Optional[ModelType]:
-        """Получить объект по координатам"""
-        return db.query(self.model).filter(self.model.x == x, self.model.y == y).first()
-    
-    def get_next_z_index(self, db: Session) -> int:
-        """Получить следующий z_index"""
-        max_z = db.query(func.max(self.model.z_index)).scalar()
-        return (max_z or 0) + 1
\ No newline at end of file
+    def bulk_delete(self, db: Session, canvas_id: str, ids: Iterable[str]) -> int:
+        """Удалить несколько карточек и их связи одной транзакцией"""
+        ids = list(ids)
+        coalescer.take(self.model, ids)
+        ids = self._check_ids(db, canvas_id, ids)
+        if not ids:
+            return 0
+        integrity.delete_links(db, self.model, ids, canvas_id)
+        # Через ORM: он обнуляет ссылки вложений и дочерних карточек одним executemany на flush
+        for obj in db.query(self.model).filter(self.model.canvas_id == canvas_id, self.model.id.in_(ids)):
+            db.delete(obj)
+        db.commit()
+        return len(ids)
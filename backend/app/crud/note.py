@@ -1,58 +1,22 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+
 from .base import BaseCRUD
 from ..models.note import Note
-from ..schemas.note import NoteCreate, NoteUpdate
+from ..schemas.note import Note as NoteSchema, NoteSummary
 
 
 class NoteCRUD(BaseCRUD[Note]):
     def __init__(self):
-        super().__init__(Note)
-
-    def create_note(self, db: Session, note: NoteCreate) -> Note:
-        return self.create(db, note)
+        super().__init__(Note, NoteSchema, NoteSummary, anchor_field="task_id",
+                         default_title="Новая заметка", not_found="Заметка не найдена", deleted="Заметка удалена")
 
-    def update_note(self, db: Session, note_id: str, note_update: NoteUpdate) -> Optional[Note]:
-        db_note = self.get(db, note_id)
-        if db_note:
-            return self.update(db, db_note, note_update)
-        return None
+    def anchor(self, data: Dict[str, Any]) -> Optional[str]:
+        # card_id - прежнее название task_id
+        return data.get("task_id", data.get("card_id"))
 
-    def delete_note(self, db: Session, note_id: str) -> bool:
-        try:
-            self.remove(db, note_id)
-            return True
-        except:
-            return False
-
-    def get_note_by_position(self, db: Session, x: int, y: int) -> Optional[Note]:
-        """Получить заметку по координатам"""
-        return self.get_by_position(db, x, y)
+    def filter_params(self, note_type: Optional[str] = None, task_id: Optional[str] = None) -> Dict[str, Any]:
+        return {"note_type": note_type, "task_id": task_id}
 
 
 # Экземпляр для использования в других частях приложения
 note_crud = NoteCRUD()
-
-# Функции для совместимости с существующим кодом
-def get_note(db: Session, note_id: str) -> Optional[Note]:
-    return note_crud.get(db, note_id)
-
-
-def get_notes(db: Session, skip: int = 0, limit: int = 100) -> List[Note]:
-    return note_crud.get_multi(db, skip, limit)
-
-
-def create_note(db: Session, note: NoteCreate) -> Note:
-    return note_crud.create_note(db, note)
-
-
-def update_note(db: Session, note_id: str, note_update: NoteUpdate) -> Optional[Note]:
-    return note_crud.update_note(db, note_id, note_update)
-
-
-def delete_note(db: Session, note_id: str) -> bool:
-    return note_crud.delete_note(db, note_id)
-
-
-def get_note_by_position(db: Session, x: int, y: int) -> Optional[Note]:
-    return note_crud.get_note_by_position(db, x, y)
\ No newline at end of file
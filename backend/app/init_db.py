@@ -0,0 +1,85 @@
+"""
+Разовая подготовка базы перед запуском воркеров.
+
+    python -m app.init_db
+
+Раньше таблицы создавались при импорте app.main в каждом воркере. Теперь
+схема готовится один раз (сервис migrate в docker-compose):
+
+- пустая база - создаются все таблицы, ревизия alembic отмечается как head;
+- база, созданная старой версией приложения без alembic - отмечается ревизией
+  003 (ее схема) и доводится миграциями до head;
+- база под управлением alembic - alembic upgrade head.
+
+В конце создается основной холст, если его нет.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+
+from .database import Base, DATABASE_URL, SessionLocal, engine
+from .models import DEFAULT_CANVAS_ID, Canvas
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Ревизия, которой соответствует схема, создававшаяся при импорте до появления холстов
+LEGACY_REVISION = "003"
+
+
+def wait_for_db(timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with engine.connect():
+                return
+        except OperationalError as e:
+            if time.monotonic() > deadline:
+                raise
+            print(f"Waiting for database: {e.orig}")
+            time.sleep(1)
+
+
+def _alembic_config():
+    from alembic.config import Config
+
+    config = Config(str(BACKEND_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(BACKEND_DIR / "alembic"))
+    config.set_main_option("sqlalchemy.url", DATABASE_URL)
+    return config
+
+
+def migrate() -> None:
+    from alembic import command
+
+    config = _alembic_config()
+    tables = set(inspect(engine).get_table_names())
+    if "alembic_version" in tables:
+        command.upgrade(config, "head")
+    elif "tasks" in tables:
+        command.stamp(config, LEGACY_REVISION)
+        command.upgrade(config, "head")
+    else:
+        Base.metadata.create_all(bind=engine)
+        command.stamp(config, "head")
+
+
+def ensure_default_canvas() -> None:
+    with SessionLocal() as db:
+        if not db.get(Canvas, DEFAULT_CANVAS_ID):
+            db.add(Canvas(id=DEFAULT_CANVAS_ID, title="Основной холст"))
+            db.commit()
+
+
+def init_db() -> None:
+    wait_for_db(float(os.getenv("DB_WAIT_TIMEOUT", "60")))
+    migrate()
+    ensure_default_canvas()
+
+
+if __name__ == "__main__":
+    init_db()
+    sys.exit(0)
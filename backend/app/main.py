@@ -4,34 +4,39 @@ import uuid
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy import literal
 from sqlalchemy.orm import Session
 
-from .database import engine, get_db
-from .models import Task, EventLog, File, Note, NoteLink, TaskLink
-
-# Create tables
-try:
-    Task.__table__.create(bind=engine, checkfirst=True)
-    Note.__table__.create(bind=engine, checkfirst=True)
-    File.__table__.create(bind=engine, checkfirst=True)
-    TaskLink.__table__.create(bind=engine, checkfirst=True)
-    NoteLink.__table__.create(bind=engine, checkfirst=True)
-    EventLog.__table__.create(bind=engine, checkfirst=True)
-except Exception as e:
-    print(f"Error creating tables: {e}")
-    import time
-    time.sleep(5)  # Wait for DB to be ready
-    Task.__table__.create(bind=engine, checkfirst=True)
-    Note.__table__.create(bind=engine, checkfirst=True)
-    File.__table__.create(bind=engine, checkfirst=True)
-    TaskLink.__table__.create(bind=engine, checkfirst=True)
-    NoteLink.__table__.create(bind=engine, checkfirst=True)
-    EventLog.__table__.create(bind=engine, checkfirst=True)
+from . import schemas
+from .crud import BaseCRUD, get_next_z_index, note_crud, task_crud
+from .crud.base import MAX_PAGE_SIZE, PAGE_SIZE, range_params
+from .database import SessionLocal, engine, get_db
+from .models import DEFAULT_CANVAS_ID, Canvas, Task, EventLog, File, Note, NoteLink, TaskLink
+from .services import (attachment_index, entity_cache, event_bus, http_cache, instrumentation, integrity, lod, placement,
+                       profiler, rate_limit, serialization, sync, tracing, voice, write_coalescer)
+from .services.serialization import JSONSerializer
+
+# Count SQL statements per request and log slow ones
+instrumentation.instrument_engine(engine)
+
+# Bump per-table change versions on every write (used for ETags)
+http_cache.track_changes(SessionLocal)
+# Drop cached card/note snapshots on write, here and (via the event bus) in other workers
+entity_cache.track_changes(SessionLocal)
+# Tombstones for deleted cards, notes and links, read by offline clients in /api/sync
+sync.track_deletions(SessionLocal)
+
+# Tables and the default canvas are created once by `python -m app.init_db`,
+# not here: importing the app must stay cheap for every worker.
 
 app = FastAPI(title="Холст API", version="1.0.0")
+# Routes time the handler and the response encoding separately
+app.router.route_class = instrumentation.InstrumentedRoute
 
 # CORS
 app.add_middleware(
@@ -40,169 +45,345 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],
 )
 
-# Static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/media", StaticFiles(directory="media"), name="media")
+# Compress JSON responses (large boards, card content)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# ETag/Last-Modified for read endpoints; conditional GETs get 304 without running the handler
+app.add_middleware(http_cache.HTTPCacheMiddleware, engine=engine)
+
+# Per-client-address token bucket for writes (WRITE_RATE_LIMIT=0 turns it off);
+# drag PUTs absorbed by the coalescer get their own POSITION_RATE_LIMIT budget
+if rate_limit.WRITE_RATE_LIMIT > 0:
+    app.add_middleware(rate_limit.RateLimitMiddleware, limiter=rate_limit.write_limiter,
+                       position_limiter=rate_limit.position_limiter)
+
+# Per-route query counts and timings, exposed at /metrics; request IDs,
+# spans (TRACE_FILE / TRACE_COLLECTOR_URL) and JSON access log lines
+app.add_middleware(instrumentation.InstrumentationMiddleware)
+tracing.configure_access_log()
+instrumentation.metrics.add_counters("holst_trace", tracing.exporter.stats, {
+    "spans_exported": "counter", "spans_dropped": "counter"})
+instrumentation.metrics.add_counters("holst_entity_cache", entity_cache.entity_cache.stats, {
+    "hits": "counter", "misses": "counter", "evictions": "counter", "invalidations": "counter", "size": "gauge"})
+instrumentation.metrics.add_counters("holst_event_bus", event_bus.bus.stats, {
+    "connected": "gauge", "connects": "counter", "published": "counter", "received": "counter"})
+instrumentation.metrics.add_counters("holst_coalesced", write_coalescer.coalescer.stats, {
+    "received": "counter", "flushes": "counter", "rows_written": "counter", "failures": "counter", "pending": "gauge"})
+instrumentation.metrics.add_counters("holst_rate_limit", rate_limit.write_limiter.stats, {
+    "allowed": "counter", "rejected": "counter", "clients": "gauge"})
+instrumentation.metrics.add_counters("holst_stt", voice.stt.stats, {
+    "requests": "counter", "failures": "counter", "connections": "counter",
+    "connections_reused": "counter", "connections_idle": "gauge"})
+
+# Per-request profiling (X-Profile: 1); not installed at all unless ADMIN_TOKEN is set
+if profiler.ADMIN_TOKEN:
+    app.add_middleware(profiler.ProfileRequestMiddleware)
+
+# One LISTEN connection per worker: cache invalidations and version changes from other workers
+@app.on_event("startup")
+def start_event_bus():
+    event_bus.bus.start(engine)
+
+@app.on_event("shutdown")
+def stop_event_bus():
+    event_bus.bus.stop()
+
+# Drag updates (x/y/z_index only) are buffered and written once per window
+@app.on_event("startup")
+def start_write_coalescer():
+    write_coalescer.coalescer.start(SessionLocal)
+
+@app.on_event("shutdown")
+def stop_write_coalescer():
+    write_coalescer.coalescer.stop()
+
+# Pooled keep-alive connections to voice-stt
+@app.on_event("shutdown")
+def close_stt_connections():
+    voice.stt.close()
 
 # Create media directory
 MEDIA_DIR = Path("media")
 MEDIA_DIR.mkdir(exist_ok=True)
 
+# Periodic orphan sweep (off unless INTEGRITY_SWEEP_INTERVAL is set); one worker at a time
+integrity_sweeper = integrity.IntegritySweeper(engine, MEDIA_DIR)
+
+@app.on_event("startup")
+def start_integrity_sweeper():
+    integrity_sweeper.start()
+
+@app.on_event("shutdown")
+def stop_integrity_sweeper():
+    integrity_sweeper.stop()
+
+# Attachment text is extracted in a process pool in the background; uploads only wake it
+attachment_indexer = attachment_index.AttachmentIndexer(engine, MEDIA_DIR)
+
+@app.on_event("startup")
+def start_attachment_indexer():
+    attachment_indexer.start()
+
+@app.on_event("shutdown")
+def stop_attachment_indexer():
+    attachment_indexer.stop()
+
+# Static files
+app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/media", StaticFiles(directory="media"), name="media")
+
 # API Routes
 
-@app.get("/api/health")
+@app.get("/api/health", response_model=schemas.Health)
 def health_check():
     return {"status": "ok", "message": "Холст API работает"}
 
-# Helper function to get next z_index
-def get_next_z_index(db: Session):
-    max_task_z = db.query(Task).order_by(Task.z_index.desc()).first()
-    max_note_z = db.query(Note).order_by(Note.z_index.desc()).first()
-    
-    max_z = 0
-    if max_card_z and max_card_z.z_index:
-        max_z = max(max_z, max_card_z.z_index)
-    if max_note_z and max_note_z.z_index:
-        max_z = max(max_z, max_note_z.z_index)
-    
-    return max_z + 1
-
-# Cards CRUD
-@app.post("/api/cards")
-def create_card(card_data: dict, db: Session = Depends(get_db)):
-    card_id = str(uuid.uuid4())
-    z_index = card_data.get("z_index", get_next_z_index(db))
-    
-    card = Task(
-        id=card_id,
-        title=card_data.get("title", "Новая задача"),
-        content=card_data.get("content", []),
-        x=card_data.get("x", 100),
-        y=card_data.get("y", 100),
-        z_index=z_index,
-        width=card_data.get("width", 300),
-        height=card_data.get("height", 200),
-        parent_id=card_data.get("parent_id")
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(instrumentation.metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Admin
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not profiler.is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+def profile_worker(seconds: float = 10, interval_ms: float = 5, format: str = "json"):
+    """Sample this worker's stacks for a bounded window"""
+    try:
+        report = profiler.profile_window(seconds, interval_ms / 1000)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "folded":
+        return PlainTextResponse(report["folded"])
+    return report
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_request_profile(profile_id: str, format: str = "json"):
+    report = profiler.get_recent(profile_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    if format == "folded":
+        return PlainTextResponse(report["folded"])
+    return report
+
+@app.post("/api/admin/integrity/sweep", dependencies=[Depends(require_admin)])
+def sweep_orphans(dry_run: bool = False, canvas_id: Optional[str] = None):
+    """Repair link target types and delete dangling links, attachments and events"""
+    if dry_run:
+        return integrity.scan(engine, canvas_id)
+    return integrity.sweep(engine, MEDIA_DIR, canvas_id)
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return {
+        "entities": entity_cache.entity_cache.stats(),
+        "versions": http_cache.versions_memo.stats(),
+        "bus": event_bus.bus.stats(),
+        "coalescer": write_coalescer.coalescer.stats(),
+    }
+
+# Every board-level query is scoped by canvas; clients that don't know
+# about canvases keep working on the default one
+def get_canvas_id(canvas_id: str = Query(DEFAULT_CANVAS_ID)) -> str:
+    return canvas_id
+
+# List endpoints select only the schema's columns and encode the rows
+# with precompiled serializers instead of FastAPI's generic ORM path
+# (cards and notes: see crud.BaseCRUD)
+TASK_LINK_COLUMNS = serialization.columns(TaskLink, schemas.TaskLink)
+NOTE_LINK_COLUMNS = serialization.columns(NoteLink, schemas.NoteLink)
+GRAPH_CARD_COLUMNS = serialization.columns(Task, schemas.GraphNode, label=Task.title, type=literal("card"))
+GRAPH_NOTE_COLUMNS = serialization.columns(Note, schemas.GraphNode, label=Note.title, type=literal("note"))
+# Note links have no target_type: the field stays unset and is left out of the edge
+GRAPH_TASK_LINK_COLUMNS = [TaskLink.source_id.label("source"), TaskLink.target_id.label("target"),
+                           TaskLink.link_type.label("type"), TaskLink.link_target_type.label("target_type")]
+GRAPH_NOTE_LINK_COLUMNS = [NoteLink.source_id.label("source"), NoteLink.target_id.label("target"),
+                           NoteLink.link_type.label("type")]
+
+task_link_serializer = JSONSerializer(List[schemas.TaskLink])
+note_link_serializer = JSONSerializer(List[schemas.NoteLink])
+graph_serializer = JSONSerializer(schemas.Graph, exclude_unset=True)
+search_serializer = JSONSerializer(schemas.SearchResult)
+layout_serializer = JSONSerializer(schemas.LayoutResult)
+
+# Canvases
+@app.post("/api/canvases", response_model=schemas.Canvas)
+def create_canvas(canvas_data: dict, db: Session = Depends(get_db)):
+    canvas = Canvas(
+        id=canvas_data.get("id") or str(uuid.uuid4()),
+        title=canvas_data.get("title", "Новый холст")
     )
-    db.add(card)
+    db.add(canvas)
     db.commit()
-    db.refresh(card)
-    return card
+    db.refresh(canvas)
+    return canvas
 
-@app.get("/api/cards")
-def get_cards(db: Session = Depends(get_db)):
-    return db.query(Task).all()
+@app.get("/api/canvases", response_model=List[schemas.Canvas])
+def get_canvases(db: Session = Depends(get_db)):
+    return db.query(Canvas).order_by(Canvas.created_at).all()
 
-@app.get("/api/cards/{card_id}")
-def get_card(card_id: str, db: Session = Depends(get_db)):
-    card = db.query(Task).filter(Task.id == card_id).first()
-    if not card:
-        raise HTTPException(status_code=404, detail="Карточка не найдена")
-    return card
+@app.get("/api/canvases/{canvas_id}", response_model=schemas.Canvas)
+def get_canvas(canvas_id: str, db: Session = Depends(get_db)):
+    canvas = db.get(Canvas, canvas_id)
+    if not canvas:
+        raise HTTPException(status_code=404, detail="Холст не найден")
+    return canvas
 
-@app.put("/api/cards/{card_id}")
-def update_card(card_id: str, card_data: dict, db: Session = Depends(get_db)):
-    card = db.query(Task).filter(Task.id == card_id).first()
-    if not card:
-        raise HTTPException(status_code=404, detail="Карточка не найдена")
+@app.put("/api/canvases/{canvas_id}", response_model=schemas.Canvas)
+def update_canvas(canvas_id: str, canvas_data: dict, db: Session = Depends(get_db)):
+    canvas = db.get(Canvas, canvas_id)
+    if not canvas:
+        raise HTTPException(status_code=404, detail="Холст не найден")
 
-    for key, value in card_data.items():
-        if hasattr(card, key):
-            setattr(card, key, value)
+    if "title" in canvas_data:
+        canvas.title = canvas_data["title"]
 
     db.commit()
-    db.refresh(card)
-    return card
-
-@app.delete("/api/cards/{card_id}")
-def delete_card(card_id: str, db: Session = Depends(get_db)):
-    card = db.query(Task).filter(Task.id == card_id).first()
-    if not card:
-        raise HTTPException(status_code=404, detail="Карточка не найдена")
-
-    db.delete(card)
+    db.refresh(canvas)
+    return canvas
+
+@app.delete("/api/canvases/{canvas_id}", response_model=schemas.Message)
+def delete_canvas(canvas_id: str, db: Session = Depends(get_db)):
+    if canvas_id == DEFAULT_CANVAS_ID:
+        raise HTTPException(status_code=400, detail="Нельзя удалить основной холст")
+    canvas = db.get(Canvas, canvas_id)
+    if not canvas:
+        raise HTTPException(status_code=404, detail="Холст не найден")
+
+    # Child rows go away with the ON DELETE CASCADE foreign keys
+    db.delete(canvas)
     db.commit()
-    return {"message": "Карточка удалена"}
+    return {"message": "Холст удален"}
 
-# Notes CRUD
-@app.post("/api/notes")
-def create_note(note_data: dict, db: Session = Depends(get_db)):
-    note_id = str(uuid.uuid4())
-    z_index = note_data.get("z_index", get_next_z_index(db))
-    
-    note = Note(
-        id=note_id,
-        title=note_data.get("title", "Новая заметка"),
-        content=note_data.get("content", []),
-        x=note_data.get("x", 100),
-        y=note_data.get("y", 100),
-        z_index=z_index,
-        width=note_data.get("width", 300),
-        height=note_data.get("height", 200),
-        card_id=note_data.get("card_id")
-    )
-    db.add(note)
-    db.commit()
-    db.refresh(note)
-    return note
-
-@app.get("/api/notes")
-def get_notes(db: Session = Depends(get_db)):
-    return db.query(Note).all()
-
-@app.get("/api/notes/{note_id}")
-def get_note(note_id: str, db: Session = Depends(get_db)):
-    note = db.query(Note).filter(Note.id == note_id).first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
-    return note
-
-@app.put("/api/notes/{note_id}")
-def update_note(note_id: str, note_data: dict, db: Session = Depends(get_db)):
-    note = db.query(Note).filter(Note.id == note_id).first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
-
-    for key, value in note_data.items():
-        if hasattr(note, key):
-            setattr(note, key, value)
+# Canvas export/import
+@app.get("/api/canvas/export")
+def export_canvas(db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    if not db.get(Canvas, canvas_id):
+        raise HTTPException(status_code=404, detail="Холст не найден")
 
-    db.commit()
-    db.refresh(note)
-    return note
+    # Export/import is rarely used, so it's loaded on first use, not at worker start
+    from .services import canvas_archive
 
-@app.delete("/api/notes/{note_id}")
-def delete_note(note_id: str, db: Session = Depends(get_db)):
-    note = db.query(Note).filter(Note.id == note_id).first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
+    return StreamingResponse(
+        canvas_archive.stream_export(SessionLocal, canvas_id, MEDIA_DIR),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="canvas-{canvas_id}.tar.gz"'}
+    )
 
-    db.delete(note)
+@app.post("/api/canvas/import", response_model=schemas.CanvasImport)
+def import_canvas(file: UploadFile = File(), title: Optional[str] = Form(None)):
+    from .services import canvas_archive
+
+    # The upload is spooled to disk by Starlette and parsed as a tar stream
+    try:
+        result = canvas_archive.import_archive(SessionLocal, file.file, MEDIA_DIR, title=title)
+    except canvas_archive.ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    attachment_indexer.notify()
+    return result
+
+# Auto-layout
+@app.post("/api/canvas/layout", response_model=schemas.LayoutResult)
+def layout_canvas(layout_data: schemas.LayoutRequest, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    # numpy is only needed here, so it isn't imported at worker start
+    from .services import layout
+
+    algorithm, root_id = layout_data.algorithm, layout_data.root_id
+    if algorithm in layout.MODELS and root_id:
+        crud = task_crud if layout.MODELS[algorithm] is Task else note_crud
+        if not crud.exists(db, root_id, canvas_id):
+            raise HTTPException(status_code=404, detail=crud.not_found)
+
+    try:
+        result = layout.layout_canvas(
+            db, canvas_id, algorithm,
+            root_id=root_id,
+            direction=layout_data.direction,
+            iterations=layout_data.iterations,
+            dry_run=layout_data.dry_run
+        )
+    except layout.LayoutError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db.commit()
-    return {"message": "Заметка удалена"}
+    return layout_serializer.response(result)
+
+# Cards and notes CRUD: one set of handlers, the differences live in crud.task_crud/crud.note_crud
+def add_card_routes(path: str, crud: BaseCRUD, schema):
+    @app.post(path, response_model=schema)
+    def create_entity(data: dict, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        return crud.create(db, canvas_id, data)
+
+    @app.get(path, response_model=List[schema])
+    def get_entities(include_content: bool = False, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                     cursor: Optional[str] = None, order: str = "z_index",
+                     fields: dict = Depends(crud.filter_params), ranges: dict = Depends(range_params),
+                     db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        """Without limit/cursor the whole list; otherwise a page sorted by `order`, the next one is in X-Next-Cursor"""
+        # Only metadata unless asked; content is fetched per card via /content
+        filters = crud.filters(fields, ranges)
+        if limit is None and cursor is None:
+            return crud.list_response(crud.get_multi(db, canvas_id, include_content=include_content, filters=filters),
+                                      include_content)
+        rows, next_cursor = crud.page(db, canvas_id, order=order, cursor=cursor, limit=limit or PAGE_SIZE,
+                                      include_content=include_content, filters=filters)
+        response = crud.list_response(rows, include_content)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
+
+    @app.patch(path, response_model=schemas.BulkResult)
+    def update_entities(items: List[dict], db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        """Update several cards in one statement, e.g. after moving a selection"""
+        if any("id" not in item for item in items):
+            raise HTTPException(status_code=400, detail="У каждого элемента должен быть id")
+        return {"count": crud.bulk_update(db, canvas_id, items)}
+
+    @app.post(f"{path}/delete", response_model=schemas.BulkResult)
+    def delete_entities(data: dict, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        """Delete several cards and their links in one transaction"""
+        return {"count": crud.bulk_delete(db, canvas_id, data.get("ids", []))}
+
+    @app.get(path + "/{entity_id}", response_model=schema)
+    def get_entity(entity_id: str, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        return crud.get_cached(db, entity_id, canvas_id)
+
+    @app.get(path + "/{entity_id}/content", response_model=schemas.BaseCardContent)
+    def get_entity_content(entity_id: str, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        return {"id": entity_id, "content": crud.get_cached(db, entity_id, canvas_id)["content"] or []}
+
+    @app.put(path + "/{entity_id}", response_model=schema)
+    def update_entity(entity_id: str, data: dict, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        return crud.update(db, entity_id, canvas_id, data)
+
+    @app.delete(path + "/{entity_id}", response_model=schemas.Message)
+    def delete_entity(entity_id: str, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+        crud.remove(db, entity_id, canvas_id)
+        return {"message": crud.deleted}
+
+add_card_routes("/api/cards", task_crud, schemas.Task)
+add_card_routes("/api/notes", note_crud, schemas.Note)
 
 # Task Links
-@app.post("/api/task-links")
-def create_task_link(link_data: dict, db: Session = Depends(get_db)):
+@app.post("/api/task-links", response_model=schemas.TaskLink)
+def create_task_link(link_data: dict, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
     # TODO: Add cycle detection logic
     source_id = link_data["source_id"]
     target_id = link_data["target_id"]
     link_target_type = link_data.get("link_target_type", "card")
     
-    # Validate that source and target exist
-    source_card = db.query(Task).filter(Task.id == source_id).first()
-    if not source_card:
+    # Validate that source and target exist on the same canvas
+    if not task_crud.exists(db, source_id, canvas_id):
         raise HTTPException(status_code=404, detail="Source card not found")
     
     if link_target_type == "task":
-        target_card = db.query(Task).filter(Task.id == target_id).first()
-        if not target_card:
+        if not task_crud.exists(db, target_id, canvas_id):
             raise HTTPException(status_code=404, detail="Target card not found")
     elif link_target_type == "note":
-        target_note = db.query(Note).filter(Note.id == target_id).first()
-        if not target_note:
+        if not note_crud.exists(db, target_id, canvas_id):
             raise HTTPException(status_code=404, detail="Target note not found")
     else:
         raise HTTPException(status_code=400, detail="Invalid link_target_type")
@@ -210,6 +391,7 @@ def create_task_link(link_data: dict, db: Session = Depends(get_db)):
     # For note links, we don't enforce the foreign key constraint
     # so we need to handle this differently in the database
     link = TaskLink(
+        canvas_id=canvas_id,
         source_id=source_id,
         target_id=target_id,
         link_type=link_data.get("link_type", "depends_on"),
@@ -220,13 +402,13 @@ def create_task_link(link_data: dict, db: Session = Depends(get_db)):
     db.refresh(link)
     return link
 
-@app.get("/api/task-links")
-def get_task_links(db: Session = Depends(get_db)):
-    return db.query(TaskLink).all()
+@app.get("/api/task-links", response_model=List[schemas.TaskLink])
+def get_task_links(db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    return task_link_serializer.response(db.query(*TASK_LINK_COLUMNS).filter(TaskLink.canvas_id == canvas_id).all())
 
-@app.delete("/api/task-links/{link_id}")
-def delete_task_link(link_id: int, db: Session = Depends(get_db)):
-    link = db.query(TaskLink).filter(TaskLink.id == link_id).first()
+@app.delete("/api/task-links/{link_id}", response_model=schemas.Message)
+def delete_task_link(link_id: int, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    link = db.query(TaskLink).filter(TaskLink.id == link_id, TaskLink.canvas_id == canvas_id).first()
     if not link:
         raise HTTPException(status_code=404, detail="Связь не найдена")
 
@@ -235,11 +417,20 @@ def delete_task_link(link_id: int, db: Session = Depends(get_db)):
     return {"message": "Связь удалена"}
 
 # Note Links
-@app.post("/api/note-links")
-def create_note_link(link_data: dict, db: Session = Depends(get_db)):
+@app.post("/api/note-links", response_model=schemas.NoteLink)
+def create_note_link(link_data: dict, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    source_id = link_data["source_id"]
+    target_id = link_data["target_id"]
+
+    # Both notes must belong to the same canvas
+    for note_id in (source_id, target_id):
+        if not note_crud.exists(db, note_id, canvas_id):
+            raise HTTPException(status_code=404, detail="Заметка не найдена")
+
     link = NoteLink(
-        source_id=link_data["source_id"],
-        target_id=link_data["target_id"],
+        canvas_id=canvas_id,
+        source_id=source_id,
+        target_id=target_id,
         link_type=link_data.get("link_type", "linked_to")
     )
     db.add(link)
@@ -247,13 +438,13 @@ def create_note_link(link_data: dict, db: Session = Depends(get_db)):
     db.refresh(link)
     return link
 
-@app.get("/api/note-links")
-def get_note_links(db: Session = Depends(get_db)):
-    return db.query(NoteLink).all()
+@app.get("/api/note-links", response_model=List[schemas.NoteLink])
+def get_note_links(db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    return note_link_serializer.response(db.query(*NOTE_LINK_COLUMNS).filter(NoteLink.canvas_id == canvas_id).all())
 
-@app.delete("/api/note-links/{link_id}")
-def delete_note_link(link_id: int, db: Session = Depends(get_db)):
-    link = db.query(NoteLink).filter(NoteLink.id == link_id).first()
+@app.delete("/api/note-links/{link_id}", response_model=schemas.Message)
+def delete_note_link(link_id: int, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    link = db.query(NoteLink).filter(NoteLink.id == link_id, NoteLink.canvas_id == canvas_id).first()
     if not link:
         raise HTTPException(status_code=404, detail="Связь не найдена")
 
@@ -261,12 +452,28 @@ def delete_note_link(link_id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "Связь удалена"}
 
+# Offline sync: apply the client's queued operations, return changes since its cursor
+@app.post("/api/sync", response_model=schemas.SyncResponse)
+def sync_canvas(request: schemas.SyncRequest, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    return sync.synchronize(db, canvas_id, request)
+
+# Dictation: the audio goes to voice-stt and the text lands in a new or existing card/note in one request
+@app.post("/api/voice", response_model=schemas.VoiceResult)
+def dictate(audio: UploadFile, kind: str = Form("note"), entity_id: Optional[str] = Form(None),
+            anchor_id: Optional[str] = Form(None), title: Optional[str] = Form(None), model: Optional[str] = Form(None),
+            db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    crud = {"card": task_crud, "note": note_crud}.get(kind)
+    if crud is None:
+        raise HTTPException(status_code=400, detail="kind должен быть card или note")
+    text, obj, created = voice.dictate(db, canvas_id, crud, audio.file, audio.content_type,
+                                       entity_id=entity_id, anchor_id=anchor_id, title=title, model=model)
+    return {"text": text, "created": created, "task" if crud is task_crud else "note": obj}
+
 # Files
-@app.post("/api/cards/{card_id}/files")
-def upload_card_file(card_id: str, file: UploadFile = File(), db: Session = Depends(get_db)):
+@app.post("/api/cards/{card_id}/files", response_model=schemas.FileRecord)
+def upload_card_file(card_id: str, file: UploadFile = File(), db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
     # Check if card exists
-    card = db.query(Task).filter(Task.id == card_id).first()
-    if not card:
+    if not task_crud.exists(db, card_id, canvas_id):
         raise HTTPException(status_code=404, detail="Карточка не найдена")
 
     # Save file
@@ -276,85 +483,108 @@ def upload_card_file(card_id: str, file: UploadFile = File(), db: Session = Depe
 
     # Create file record
     file_record = File(
+        canvas_id=canvas_id,
         filename=file.filename,
         filepath=str(file_path),
         file_size=file_path.stat().st_size,
-        mime_type=file.content_type,
-        card_id=card_id
+        mime_type=file.content_type or "application/octet-stream",
+        task_id=card_id
     )
     db.add(file_record)
     db.commit()
     db.refresh(file_record)
+    attachment_indexer.notify()
     return file_record
 
-@app.get("/api/files/{file_id}/download")
-def download_file(file_id: int, db: Session = Depends(get_db)):
-    file_record = db.query(File).filter(File.id == file_id).first()
+@app.get("/api/files/{file_id}/download", response_model=schemas.FileDownload)
+def download_file(file_id: int, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    file_record = db.query(File).filter(File.id == file_id, File.canvas_id == canvas_id).first()
     if not file_record:
         raise HTTPException(status_code=404, detail="Файл не найден")
 
     return {"url": f"/media/{Path(file_record.filepath).name}"}
 
 # Z-index management
-@app.get("/api/max-z-index")
-def get_max_z_index(db: Session = Depends(get_db)):
-    """Get the maximum z_index across all cards and notes"""
-    return {"max_z_index": get_next_z_index(db) - 1}
+@app.get("/api/max-z-index", response_model=schemas.MaxZIndex)
+def get_max_z_index(db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    """Get the maximum z_index across all cards and notes of the canvas"""
+    return {"max_z_index": get_next_z_index(db, canvas_id) - 1}
+
+# Placement
+@app.get("/api/placement", response_model=schemas.Placement)
+def get_placement(anchor_id: Optional[str] = None, width: int = 300, height: int = 200, count: int = Query(1, ge=1, le=500),
+                  db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    """Free non-overlapping slots next to the anchor card, e.g. for creating several cards at once"""
+    slots = placement.find_slots(db, canvas_id, [(width, height)] * count, anchor_id=anchor_id)
+    return {"slots": [{"x": x, "y": y} for x, y in slots]}
+
+# Level of detail
+@app.get("/api/canvas/clusters", response_model=schemas.Clusters, response_model_exclude_unset=True)
+def get_clusters(scale: float = Query(..., gt=0), x0: Optional[float] = None, y0: Optional[float] = None,
+                 x1: Optional[float] = None, y1: Optional[float] = None,
+                 db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    """Cards and notes aggregated into tiles for the given zoom; x0..y1 limit the result to the viewport"""
+    viewport = (x0, y0, x1, y1) if None not in (x0, y0, x1, y1) else None
+    return lod.get_clusters(db, canvas_id, scale, viewport)
 
 # Search
-@app.get("/api/search")
-def search(q: str, db: Session = Depends(get_db)):
+@app.get("/api/search", response_model=schemas.SearchResult)
+def search(q: str, db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
     # Simple search implementation
-    cards = db.query(Task).filter(Task.title.ilike(f"%{q}%")).all()
-    notes = db.query(Note).filter(Note.title.ilike(f"%{q}%")).all()
-    return {"cards": cards, "notes": notes}
+    cards = task_crud.get_multi(db, canvas_id, filters=[Task.title.ilike(f"%{q}%")])
+    notes = note_crud.get_multi(db, canvas_id, filters=[Note.title.ilike(f"%{q}%")])
+
+    # Attachments whose text matches; their cards and notes are part of the result too
+    attachments = attachment_index.search(db, canvas_id, q)
+    found = {item.id for item in (*cards, *notes)}
+    for crud, key, results in ((task_crud, "task_id", cards), (note_crud, "note_id", notes)):
+        owner_ids = {a[key] for a in attachments if a[key] and a[key] not in found}
+        if owner_ids:
+            results.extend(crud.get_multi(db, canvas_id, filters=[crud.model.id.in_(owner_ids)]))
+    return search_serializer.response({"cards": cards, "notes": notes, "attachments": attachments})
 
 # Graph
-@app.get("/api/graph")
-def get_graph(db: Session = Depends(get_db)):
-    cards = db.query(Task).all()
-    notes = db.query(Note).all()
-    task_links = db.query(TaskLink).all()
-    note_links = db.query(NoteLink).all()
-
-    nodes = []
-    edges = []
-
-    # Add cards as nodes
-    for card in cards:
-        nodes.append({
-            "id": card.id,
-            "label": card.title,
-            "type": "card",
-            "x": card.x,
-            "y": card.y
-        })
-
-    # Add notes as nodes
-    for note in notes:
-        nodes.append({
-            "id": note.id,
-            "label": note.title,
-            "type": "note",
-            "x": note.x,
-            "y": note.y
-        })
-
-    # Add task links as edges
-    for link in task_links:
-        edges.append({
-            "source": link.source_id,
-            "target": link.target_id,
-            "type": link.link_type,
-            "target_type": link.link_target_type
-        })
-
-    # Add note links as edges
-    for link in note_links:
-        edges.append({
-            "source": link.source_id,
-            "target": link.target_id,
-            "type": link.link_type
-        })
-
-    return {"nodes": nodes, "edges": edges}
\ No newline at end of file
+@app.get("/api/graph", response_model=schemas.Graph, response_model_exclude_unset=True)
+def get_graph(db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    # The graph only needs positions and labels, not card content;
+    # rows already have the node/edge field names and go straight to the encoder
+    nodes = db.query(*GRAPH_CARD_COLUMNS).filter(Task.canvas_id == canvas_id).all()
+    nodes += db.query(*GRAPH_NOTE_COLUMNS).filter(Note.canvas_id == canvas_id).all()
+    edges = db.query(*GRAPH_TASK_LINK_COLUMNS).filter(TaskLink.canvas_id == canvas_id).all()
+    edges += db.query(*GRAPH_NOTE_LINK_COLUMNS).filter(NoteLink.canvas_id == canvas_id).all()
+    return graph_serializer.response({"nodes": nodes, "edges": edges})
+
+@app.get("/api/graph/neighbourhood", response_model=schemas.GraphNeighbourhood, response_model_exclude_unset=True)
+def get_graph_neighbourhood(node_id: str, depth: int = Query(1, ge=0, le=6), direction: str = "both",
+                            db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    """Cards and notes within `depth` links of the node, in the /api/graph format"""
+    from .services import graph_index
+
+    if not (task_crud.exists(db, node_id, canvas_id) or note_crud.exists(db, node_id, canvas_id)):
+        raise HTTPException(status_code=404, detail="Карточка не найдена")
+    try:
+        return graph_index.neighbourhood(db, canvas_id, node_id, depth=depth, direction=direction)
+    except graph_index.GraphQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/graph/path", response_model=schemas.GraphPath, response_model_exclude_unset=True)
+def get_graph_path(source_id: str, target_id: str, direction: str = "both", max_depth: int = Query(50, ge=1, le=1000),
+                   db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    """Shortest chain of links between two cards/notes"""
+    from .services import graph_index
+
+    try:
+        path = graph_index.shortest_path(db, canvas_id, source_id, target_id, direction=direction, max_depth=max_depth)
+    except graph_index.GraphQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if path is None or not path["nodes"]:
+        raise HTTPException(status_code=404, detail="Путь не найден")
+    return path
+
+@app.get("/api/graph/components", response_model=schemas.GraphComponents)
+def get_graph_components(min_size: int = Query(2, ge=1), limit: int = Query(100, ge=1, le=1000),
+                         db: Session = Depends(get_db), canvas_id: str = Depends(get_canvas_id)):
+    """Connected components of the link graph, largest first"""
+    from .services import graph_index
+
+    return graph_index.components(db, canvas_id, min_size=min_size, limit=limit)
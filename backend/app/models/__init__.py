@@ -1,6 +1,11 @@
+from .canvas import Canvas, DEFAULT_CANVAS_ID
 from .task import Task
 from .note import Note
 from .file import File
+from .file_content import FileContent
 from .task_link import TaskLink
 from .note_link import NoteLink
-from .event_log import EventLog
\ No newline at end of file
+from .event_log import EventLog
+from .change_version import ChangeVersion
+from .sync_operation import SyncOperation
+from .tombstone import Tombstone
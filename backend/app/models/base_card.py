@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, JSON, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, Integer, String, Text, JSON, DateTime, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declared_attr, relationship
 from sqlalchemy.sql import func
 from ..database import Base
+from .canvas import DEFAULT_CANVAS_ID
 
 
 class BaseCard(Base):
@@ -11,8 +13,12 @@ class BaseCard(Base):
     __abstract__ = True
 
     id = Column(String, primary_key=True, index=True)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False,
+                       default=DEFAULT_CANVAS_ID, server_default=DEFAULT_CANVAS_ID)
     title = Column(String, nullable=False)
-    content = Column(JSON, default=list)  # Rich text content
+    # Rich text content. В Postgres хранится как JSONB (бинарно, без повторного разбора текста);
+    # списки и граф его не загружают - содержимое отдается через /content
+    content = Column(JSON().with_variant(JSONB(), "postgresql"), default=list)
     x = Column(Integer, default=0)
     y = Column(Integer, default=0)
     z_index = Column(Integer, default=0)  # Z-index for layering
@@ -20,6 +26,23 @@ class BaseCard(Base):
     height = Column(Integer, default=200)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Номер последнего изменения положения (services/write_coalescer.position_seq):
+    # отложенная запись из другого воркера не перезаписывает более новое положение
+    pos_seq = Column(BigInteger)
 
-    # Общие связи
-    files = relationship("File", back_populates="base_card")
\ No newline at end of file
+    # Колонки, по которым фильтруются списки (у каждой свой индекс)
+    __filter_columns__ = ()
+
+    @declared_attr
+    def __table_args__(cls):
+        # Все выборки идут в пределах одного холста, поэтому canvas_id - ведущая колонка индексов
+        table = cls.__tablename__
+        return (
+            Index(f"ix_{table}_canvas_id_z_index", "canvas_id", "z_index"),
+            # Keyset-пагинация списков (crud.BaseCRUD.page): ключ сортировки и id
+            Index(f"ix_{table}_canvas_id_z_order", "canvas_id", text("coalesce(z_index, 0)"), "id"),
+            Index(f"ix_{table}_canvas_id_changed", "canvas_id", text("coalesce(updated_at, created_at)"), "id"),
+            Index(f"ix_{table}_canvas_id_created_at", "canvas_id", "created_at"),
+            Index(f"ix_{table}_canvas_id_x_y", "canvas_id", "x", "y"),
+            *(Index(f"ix_{table}_canvas_id_{column}", "canvas_id", column) for column in cls.__filter_columns__),
+        )
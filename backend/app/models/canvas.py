@@ -0,0 +1,19 @@
+from sqlalchemy import Column, DateTime, String
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+# Холст, к которому относятся записи, созданные до появления холстов
+DEFAULT_CANVAS_ID = "default"
+
+
+class Canvas(Base):
+    """
+    Холст (рабочее пространство), в рамках которого живут все карточки и связи
+    """
+    __tablename__ = "canvases"
+
+    id = Column(String, primary_key=True, index=True)
+    title = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -0,0 +1,16 @@
+from sqlalchemy import BigInteger, Column, DateTime, String
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class ChangeVersion(Base):
+    """
+    Счетчик изменений таблицы в пределах холста; используется для ETag/Last-Modified
+    """
+    __tablename__ = "change_versions"
+
+    table_name = Column(String, primary_key=True)
+    canvas_id = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    changed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
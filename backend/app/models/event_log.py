@@ -1,11 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, JSON, DateTime
+from sqlalchemy import Column, Integer, String, Text, JSON, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from ..database import Base
+from .canvas import DEFAULT_CANVAS_ID
 
 class EventLog(Base):
     __tablename__ = "event_logs"
 
     id = Column(Integer, primary_key=True, index=True)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False,
+                       default=DEFAULT_CANVAS_ID, server_default=DEFAULT_CANVAS_ID)
     action = Column(String, nullable=False)  # create, update, delete, link, unlink
     entity_type = Column(String, nullable=False)  # card, note, file, link
     entity_id = Column(String, nullable=False)
@@ -13,4 +16,8 @@ class EventLog(Base):
     old_data = Column(JSON, nullable=True)
     new_data = Column(JSON, nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    details = Column(Text, nullable=True)  # Additional context
\ No newline at end of file
+    details = Column(Text, nullable=True)  # Additional context
+
+    __table_args__ = (
+        Index("ix_event_logs_canvas_id_timestamp", "canvas_id", "timestamp"),
+    )
@@ -2,11 +2,14 @@ from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
+from .canvas import DEFAULT_CANVAS_ID
 
 class File(Base):
     __tablename__ = "files"
 
     id = Column(Integer, primary_key=True, index=True)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False,
+                       default=DEFAULT_CANVAS_ID, server_default=DEFAULT_CANVAS_ID, index=True)
     filename = Column(String, nullable=False)
     filepath = Column(String, nullable=False)  # Path relative to media root
     file_size = Column(Integer, nullable=False)
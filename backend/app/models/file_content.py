@@ -0,0 +1,40 @@
+from sqlalchemy import DDL, Column, DateTime, ForeignKey, Index, Integer, String, Text, event
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+# Конфигурация полнотекстового поиска: русская морфология, латиница - английский стеммер
+SEARCH_CONFIG = "russian"
+
+
+class FileContent(Base):
+    """
+    Извлеченный текст вложения для поиска по содержимому
+    """
+    __tablename__ = "file_contents"
+
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False)
+    content_hash = Column(String, nullable=True)  # sha256 файла; при совпадении текст не извлекается заново
+    status = Column(String, nullable=False)  # indexed, unsupported, missing, error
+    text = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    indexed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_file_contents_canvas_id", "canvas_id"),
+    )
+
+
+# В Postgres рядом с текстом хранится готовый tsvector (генерируемая колонка) с GIN-индексом:
+# поиск и ранжирование не разбирают текст заново. В модели колонки нет - ORM ее не пишет.
+SEARCH_VECTOR_DDL = [
+    f"""
+    ALTER TABLE file_contents ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(text, ''))) STORED
+    """,
+    "CREATE INDEX ix_file_contents_search_vector ON file_contents USING gin (search_vector)",
+]
+
+for _statement in SEARCH_VECTOR_DDL:
+    event.listen(FileContent.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
@@ -8,9 +8,14 @@ class Note(BaseCard):
 
     task_id = Column(String, ForeignKey("tasks.id"), nullable=True)  # Changed from card_id to task_id
     note_type = Column(String, default="note")  # To distinguish different types of notes
+
+    __filter_columns__ = ("note_type", "task_id")
     
     # Relationships
     task = relationship("Task", back_populates="notes")
     files = relationship("File", back_populates="note")
-    outgoing_links = relationship("NoteLink", foreign_keys="NoteLink.source_id", back_populates="source_note")
-    incoming_links = relationship("NoteLink", foreign_keys="NoteLink.target_id", back_populates="target_note")
\ No newline at end of file
+    # Связи удаляет БД (ON DELETE CASCADE) или integrity.delete_links, ORM их не обнуляет
+    outgoing_links = relationship("NoteLink", foreign_keys="NoteLink.source_id", back_populates="source_note",
+                                  passive_deletes=True)
+    incoming_links = relationship("NoteLink", foreign_keys="NoteLink.target_id", back_populates="target_note",
+                                  passive_deletes=True)
\ No newline at end of file
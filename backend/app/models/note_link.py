@@ -1,17 +1,27 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
+from .canvas import DEFAULT_CANVAS_ID
 
 class NoteLink(Base):
     __tablename__ = "note_links"
 
     id = Column(Integer, primary_key=True, index=True)
-    source_id = Column(String, ForeignKey("notes.id"), nullable=False)
-    target_id = Column(String, ForeignKey("notes.id"), nullable=False)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False,
+                       default=DEFAULT_CANVAS_ID, server_default=DEFAULT_CANVAS_ID, index=True)
+    source_id = Column(String, ForeignKey("notes.id", ondelete="CASCADE"), nullable=False)
+    target_id = Column(String, ForeignKey("notes.id", ondelete="CASCADE"), nullable=False)
     link_type = Column(String, default="linked_to")  # Always bidirectional
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
     source_note = relationship("Note", foreign_keys=[source_id], back_populates="outgoing_links")
-    target_note = relationship("Note", foreign_keys=[target_id], back_populates="incoming_links")
\ No newline at end of file
+    target_note = relationship("Note", foreign_keys=[target_id], back_populates="incoming_links")
+
+    __table_args__ = (
+        Index("ix_note_links_canvas_id_source_id", "canvas_id", "source_id"),
+        Index("ix_note_links_canvas_id_target_id", "canvas_id", "target_id"),
+        # Новые связи для /api/sync
+        Index("ix_note_links_canvas_id_created_at", "canvas_id", "created_at"),
+    )
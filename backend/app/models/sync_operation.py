@@ -0,0 +1,28 @@
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Index, Integer, String, UniqueConstraint
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class SyncOperation(Base):
+    """
+    Операция офлайн-клиента, уже примененная сервером (журнал для идемпотентности)
+    """
+    __tablename__ = "sync_operations"
+
+    id = Column(Integer, primary_key=True)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False)
+    client_id = Column(String, nullable=False)
+    op_id = Column(String, nullable=False)  # уникален в пределах клиента
+    entity_type = Column(String, nullable=False)  # task, note, task_link, note_link
+    entity_id = Column(String, nullable=True)
+    action = Column(String, nullable=False)  # create, update, delete
+    status = Column(String, nullable=False)  # applied, merged, deleted, rejected
+    result = Column(JSON, nullable=False)  # ответ на операцию; повтор получает его же
+    client_ts = Column(DateTime(timezone=True), nullable=True)
+    applied_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("client_id", "op_id", name="uq_sync_operations_client_id_op_id"),
+        Index("ix_sync_operations_applied_at", "applied_at"),
+    )
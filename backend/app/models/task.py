@@ -11,9 +11,20 @@ class Task(BaseCard):
 
     parent_id = Column(String, ForeignKey("tasks.id"), nullable=True)  # For subtasks
     task_type = Column(String, default="task") # To distinguish different types of tasks
+
+    __filter_columns__ = ("task_type", "parent_id")
     
     # Relationships
-    subtasks = relationship("Task", backref="parent", remote_side=[id])
+    subtasks = relationship("Task", backref="parent", remote_side="Task.id")
     notes = relationship("Note", back_populates="task")
-    outgoing_links = relationship("TaskLink", foreign_keys="TaskLink.source_id", back_populates="source_task")
-    incoming_links = relationship("TaskLink", foreign_keys="TaskLink.target_id", back_populates="target_task")
\ No newline at end of file
+    files = relationship("File", back_populates="task")
+    # Связи удаляет БД (ON DELETE CASCADE) или integrity.delete_links, ORM их не обнуляет
+    outgoing_links = relationship("TaskLink", foreign_keys="TaskLink.source_id", back_populates="source_task",
+                                  passive_deletes=True)
+    # target_id не имеет внешнего ключа (может ссылаться и на заметку), поэтому связь только для чтения
+    incoming_links = relationship(
+        "TaskLink",
+        primaryjoin="and_(Task.id == foreign(TaskLink.target_id), TaskLink.link_target_type == 'task')",
+        back_populates="target_task",
+        viewonly=True,
+    )
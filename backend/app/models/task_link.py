@@ -1,15 +1,18 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import DDL, Column, DateTime, ForeignKey, Index, Integer, String, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 from ..database import Base
+from .canvas import DEFAULT_CANVAS_ID
 
 
 class TaskLink(Base):
     __tablename__ = "task_links"
 
     id = Column(Integer, primary_key=True, index=True)
-    source_id = Column(String, ForeignKey("tasks.id"), nullable=False)  # Changed from cards.id
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False,
+                       default=DEFAULT_CANVAS_ID, server_default=DEFAULT_CANVAS_ID, index=True)
+    source_id = Column(String, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False)  # Changed from cards.id
     target_id = Column(String, nullable=True) # Can reference both tasks and notes
     link_type = Column(String, nullable=False)  # depends_on, blocks, follows, related_to
     link_target_type = Column(String, default="task")  # "task" or "note"
@@ -19,4 +22,71 @@ class TaskLink(Base):
     source_task = relationship("Task", foreign_keys=[source_id], back_populates="outgoing_links")
     # Note: target relationship will be determined dynamically based on link_target_type
     # For now, we'll keep a generic relationship that can point to either Task or Note
-    target_task = relationship("Task", foreign_keys=[target_id], remote_side="Task.id", back_populates="incoming_links")
\ No newline at end of file
+    target_task = relationship(
+        "Task",
+        primaryjoin="and_(Task.id == foreign(TaskLink.target_id), TaskLink.link_target_type == 'task')",
+        back_populates="incoming_links",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        Index("ix_task_links_canvas_id_source_id", "canvas_id", "source_id"),
+        Index("ix_task_links_canvas_id_target_id", "canvas_id", "target_id"),
+        # Новые связи для /api/sync
+        Index("ix_task_links_canvas_id_created_at", "canvas_id", "created_at"),
+    )
+
+
+# У target_id нет внешнего ключа, поэтому в Postgres его заменяют триггеры:
+# удаление задач/заметок удаляет связи, где они цель (одним запросом на оператор),
+# а отложенный до коммита constraint trigger не дает сохранить связь с несуществующей целью.
+# Миграция 007 создает то же самое в существующих базах.
+TARGET_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION task_links_drop_targets() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM task_links l USING deleted d
+        WHERE l.target_id = d.id AND l.link_target_type = TG_ARGV[0];
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER tasks_drop_link_targets AFTER DELETE ON tasks
+    REFERENCING OLD TABLE AS deleted FOR EACH STATEMENT EXECUTE FUNCTION task_links_drop_targets('task')
+    """,
+    """
+    CREATE TRIGGER notes_drop_link_targets AFTER DELETE ON notes
+    REFERENCING OLD TABLE AS deleted FOR EACH STATEMENT EXECUTE FUNCTION task_links_drop_targets('note')
+    """,
+    """
+    CREATE OR REPLACE FUNCTION task_links_check_target() RETURNS trigger AS $$
+    BEGIN
+        -- Связь могли удалить до коммита (вместе с целью)
+        PERFORM 1 FROM task_links WHERE id = NEW.id;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+        IF NEW.link_target_type = 'note' THEN
+            PERFORM 1 FROM notes WHERE id = NEW.target_id AND canvas_id = NEW.canvas_id;
+        ELSE
+            PERFORM 1 FROM tasks WHERE id = NEW.target_id AND canvas_id = NEW.canvas_id;
+        END IF;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+                MESSAGE = 'Цель связи не найдена: ' || coalesce(NEW.link_target_type, '') || ' ' || coalesce(NEW.target_id, '');
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE CONSTRAINT TRIGGER task_links_target_exists
+    AFTER INSERT OR UPDATE OF target_id, link_target_type ON task_links
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION task_links_check_target()
+    """,
+]
+
+for _statement in TARGET_TRIGGERS:
+    # После создания всех таблиц: триггеры на tasks/notes ссылаются на task_links
+    event.listen(Base.metadata, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
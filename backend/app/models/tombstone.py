@@ -0,0 +1,22 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class Tombstone(Base):
+    """
+    Удаленная карточка, заметка или связь; по ним клиент узнает об удалениях при синхронизации
+    """
+    __tablename__ = "tombstones"
+
+    id = Column(Integer, primary_key=True)
+    canvas_id = Column(String, ForeignKey("canvases.id", ondelete="CASCADE"), nullable=False)
+    table_name = Column(String, nullable=False)  # tasks, notes, task_links, note_links
+    entity_id = Column(String, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_tombstones_canvas_id_deleted_at", "canvas_id", "deleted_at"),
+        Index("ix_tombstones_deleted_at", "deleted_at"),
+    )
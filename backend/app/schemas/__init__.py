@@ -1,3 +1,12 @@
-from .base_card import BaseCardSchema
-from .task import Task, TaskCreate, TaskUpdate, TaskInDB
-from .note import Note, NoteCreate, NoteUpdate, NoteInDB
\ No newline at end of file
+from .base_card import BaseCardSchema, BaseCardSummary, BaseCardContent
+from .task import Task, TaskSummary, TaskCreate, TaskUpdate, TaskInDB
+from .note import Note, NoteSummary, NoteCreate, NoteUpdate, NoteInDB
+from .link import TaskLink, NoteLink
+from .file import FileRecord, FileDownload, AttachmentMatch
+from .canvas import Canvas, CanvasImport, Position, LayoutRequest, LayoutResult, Slot, Placement, Cluster, Clusters, MaxZIndex
+from .graph import (GraphNode, GraphEdge, Graph, GraphNeighbourhood, GraphPath,
+                    GraphComponent, GraphComponents)
+from .common import Message, BulkResult, Health, SearchResult
+from .sync import (SyncOperation, SyncRequest, SyncOperationResult, SyncDeleted, SyncChanges,
+                   SyncResponse)
+from .voice import VoiceResult
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Any, List, Optional
 from datetime import datetime
 
 
@@ -8,6 +8,7 @@ class BaseCardSchema(BaseModel):
     Базовая схема для карточек (задач и примечаний)
     """
     id: Optional[str] = None
+    canvas_id: Optional[str] = None
     title: str
     content: List = []
     x: int = 0
@@ -16,4 +17,30 @@ class BaseCardSchema(BaseModel):
     width: int = 300
     height: int = 200
     created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
\ No newline at end of file
+    updated_at: Optional[datetime] = None
+
+
+class BaseCardSummary(BaseModel):
+    """
+    Карточка в списках: все колонки, кроме содержимого
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    canvas_id: str
+    title: str
+    x: Optional[int] = None
+    y: Optional[int] = None
+    z_index: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class BaseCardContent(BaseModel):
+    """
+    Только содержимое карточки (/content)
+    """
+    id: str
+    content: List[Any] = []
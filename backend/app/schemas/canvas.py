@@ -0,0 +1,73 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional
+from datetime import datetime
+
+
+class Canvas(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    title: str
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class CanvasImport(BaseModel):
+    canvas_id: str
+    counts: Dict[str, int]
+
+
+class Position(BaseModel):
+    id: str
+    x: int
+    y: int
+
+
+class LayoutRequest(BaseModel):
+    algorithm: str = "layered"
+    root_id: Optional[str] = None
+    direction: Optional[str] = None
+    iterations: Optional[int] = Field(None, ge=1, le=1000)  # только для force
+    dry_run: bool = False
+
+
+class LayoutResult(BaseModel):
+    algorithm: str
+    count: int
+    positions: List[Position]
+
+
+class Slot(BaseModel):
+    x: int
+    y: int
+
+
+class Placement(BaseModel):
+    slots: List[Slot]
+
+
+class Cluster(BaseModel):
+    """
+    Тайл обзора; id и type есть только у тайла из одного элемента
+    """
+    tile: List[int]
+    count: int
+    tasks: int
+    notes: int
+    x: int
+    y: int
+    width: int
+    height: int
+    titles: List[str]
+    id: Optional[str] = None
+    type: Optional[str] = None
+
+
+class Clusters(BaseModel):
+    level: int
+    cell_size: int
+    clusters: List[Cluster]
+
+
+class MaxZIndex(BaseModel):
+    max_z_index: int
@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import List
+
+from .file import AttachmentMatch
+from .note import NoteSummary
+from .task import TaskSummary
+
+
+class Message(BaseModel):
+    message: str
+
+
+class BulkResult(BaseModel):
+    count: int
+
+
+class Health(BaseModel):
+    status: str
+    message: str
+
+
+class SearchResult(BaseModel):
+    cards: List[TaskSummary]
+    notes: List[NoteSummary]
+    attachments: List[AttachmentMatch]
@@ -0,0 +1,33 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
+from datetime import datetime
+
+
+class FileRecord(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    canvas_id: str
+    filename: str
+    filepath: str
+    file_size: int
+    mime_type: str
+    base_card_id: Optional[str] = None
+    task_id: Optional[str] = None
+    note_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+class FileDownload(BaseModel):
+    url: str
+
+
+class AttachmentMatch(BaseModel):
+    """
+    Вложение, найденное по содержимому
+    """
+    file_id: int
+    filename: str
+    task_id: Optional[str] = None
+    note_id: Optional[str] = None
+    snippet: str
@@ -0,0 +1,48 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class GraphNode(BaseModel):
+    id: str
+    label: str
+    type: str  # "card" или "note"
+    x: Optional[int] = None
+    y: Optional[int] = None
+
+
+class GraphEdge(BaseModel):
+    """
+    Ребро графа. target_type есть только у связей задач, id и kind - только в
+    ответах запросов к графу; отсутствующие поля не сериализуются (exclude_unset)
+    """
+    source: str
+    target: Optional[str] = None
+    type: Optional[str] = None
+    target_type: Optional[str] = None
+    id: Optional[int] = None
+    kind: Optional[str] = None  # "task_link" или "note_link"
+
+
+class Graph(BaseModel):
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
+
+
+class GraphNeighbourhood(Graph):
+    truncated: bool
+
+
+class GraphPath(Graph):
+    length: int
+
+
+class GraphComponent(BaseModel):
+    size: int
+    node_ids: List[str]
+    edge_count: int
+
+
+class GraphComponents(BaseModel):
+    total: int
+    linked_nodes: int
+    components: List[GraphComponent]
@@ -0,0 +1,26 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
+from datetime import datetime
+
+
+class TaskLink(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    canvas_id: str
+    source_id: str
+    target_id: Optional[str] = None
+    link_type: str
+    link_target_type: Optional[str] = None  # "task" или "note"
+    created_at: Optional[datetime] = None
+
+
+class NoteLink(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    canvas_id: str
+    source_id: str
+    target_id: str
+    link_type: Optional[str] = None
+    created_at: Optional[datetime] = None
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, List, Optional
 from datetime import datetime
-from .base_card import BaseCardSchema
+from .base_card import BaseCardSchema, BaseCardSummary
 
 
 class NoteCreate(BaseCardSchema):
@@ -20,13 +20,14 @@ class NoteUpdate(BaseModel):
     task_id: Optional[str] = None
 
 
-class Note(BaseCardSchema):
+class NoteSummary(BaseCardSummary):
     task_id: Optional[str] = None
-    note_type: str = "note"
-    
-    class Config:
-        from_attributes = True
+    note_type: Optional[str] = None
+
+
+class Note(NoteSummary):
+    content: Optional[List[Any]] = None
 
 
 class NoteInDB(Note):
-    pass
\ No newline at end of file
+    pass
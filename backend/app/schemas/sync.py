@@ -0,0 +1,54 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
+from datetime import datetime
+
+from .link import NoteLink, TaskLink
+from .note import Note
+from .task import Task
+
+
+class SyncOperation(BaseModel):
+    op_id: str = Field(min_length=1, max_length=128)
+    ts: Optional[datetime] = None  # время изменения на клиенте
+    type: Literal["task", "note", "task_link", "note_link"]
+    action: Literal["create", "update", "delete"]
+    # У create связи - временный id клиента. Набор символов ограничен: id попадают в ключи кэшей и события шины
+    id: Optional[str] = Field(None, min_length=1, max_length=128, pattern=r"^[A-Za-z0-9_-]+$")
+    fields: Dict[str, Any] = {}
+    prev: Optional[Dict[str, Any]] = None  # значения fields, которые клиент видел до изменения
+
+
+class SyncRequest(BaseModel):
+    client_id: str = Field(min_length=1, max_length=128)
+    cursor: Optional[str] = None
+    ops: List[SyncOperation] = []
+
+
+class SyncOperationResult(BaseModel):
+    op_id: str
+    status: str  # applied, merged, deleted, rejected
+    id: Optional[str] = None
+    conflicts: List[str] = []  # поля, где победило значение сервера
+    error: Optional[str] = None
+
+
+class SyncDeleted(BaseModel):
+    tasks: List[str] = []
+    notes: List[str] = []
+    task_links: List[str] = []
+    note_links: List[str] = []
+
+
+class SyncChanges(BaseModel):
+    tasks: List[Task] = []
+    notes: List[Note] = []
+    task_links: List[TaskLink] = []
+    note_links: List[NoteLink] = []
+    deleted: SyncDeleted = SyncDeleted()
+
+
+class SyncResponse(BaseModel):
+    results: List[SyncOperationResult]
+    changes: SyncChanges
+    cursor: str
+    reset: bool = False  # курсор пуст или устарел - клиенту нужна полная загрузка
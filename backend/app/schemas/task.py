@@ -1,23 +1,7 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, List, Optional
 from datetime import datetime
-from .base_card import BaseCardSchema
-
-
-class BaseCardSchema(BaseModel):
-    """
-    Базовая схема для карточек (задач и примечаний)
-    """
-    id: Optional[str] = None
-    title: str
-    content: List = []
-    x: int = 0
-    y: int = 0
-    z_index: int = 0
-    width: int = 300
-    height: int = 200
-    created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
+from .base_card import BaseCardSchema, BaseCardSummary
 
 
 class TaskCreate(BaseCardSchema):
@@ -36,13 +20,14 @@ class TaskUpdate(BaseModel):
     parent_id: Optional[str] = None
 
 
-class Task(BaseCardSchema):
+class TaskSummary(BaseCardSummary):
     parent_id: Optional[str] = None
-    task_type: str = "task"
-    
-    class Config:
-        from_attributes = True
+    task_type: Optional[str] = None
+
+
+class Task(TaskSummary):
+    content: Optional[List[Any]] = None
 
 
 class TaskInDB(Task):
-    pass
\ No newline at end of file
+    pass
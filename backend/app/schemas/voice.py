@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from typing import Optional
+
+from .note import Note
+from .task import Task
+
+
+class VoiceResult(BaseModel):
+    text: str
+    created: bool  # false - текст дописан в существующий элемент
+    task: Optional[Task] = None
+    note: Optional[Note] = None
@@ -0,0 +1,259 @@
+"""
+Индексация содержимого вложений для поиска.
+
+Текст PDF, текстовых и Markdown-файлов извлекается в пуле процессов
+(attachment_text) и хранится в file_contents рядом с хэшем файла; в Postgres по
+нему строится tsvector с GIN-индексом, в SQLite поиск идет по ILIKE.
+
+Фоновый поток воркера ищет вложения без записи в file_contents (anti-join) и
+индексирует их пачками; загрузка файла и импорт холста только будят его.
+reindex проверяет уже проиндексированные файлы: дочерний процесс сначала
+считает хэш и не извлекает текст, если он не изменился.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import exists, func, literal_column, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from ..models import File, FileContent
+from ..models.file_content import SEARCH_CONFIG
+from . import http_cache
+from .attachment_text import extract
+
+logger = logging.getLogger(__name__)
+
+# Процессов в пуле извлечения; 0 - воркер не индексирует (например, если это делает отдельный процесс)
+INDEX_WORKERS = int(os.getenv("ATTACHMENT_INDEX_WORKERS", "2"))
+# Период повторной проверки на случай, если воркер, принявший файл, перезапустился
+RESCAN_INTERVAL = 300.0
+BATCH_SIZE = 50
+ADVISORY_LOCK_ID = 0x686F6C7375
+# Фрагмент для подсветки берется из начала текста: ts_headline разбирает его целиком
+HEADLINE_CHARS = 100_000
+SNIPPET_CHARS = 160
+
+files, contents = File.__table__, FileContent.__table__
+
+
+def _upsert(connection: Connection, rows: List[Dict]) -> None:
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(contents).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[contents.c.file_id],
+        set_={column: stmt.excluded[column] for column in ("content_hash", "status", "text", "error")}
+        | {"indexed_at": func.now()},
+    )
+    connection.execute(stmt)
+
+
+def _index_rows(engine: Engine, media_dir: Path, executor, rows) -> Dict[str, int]:
+    """Извлечь текст файлов rows в пуле и записать результат одной транзакцией"""
+    futures = [
+        (row, executor.submit(extract, str(media_dir / Path(row.filepath).name), row.mime_type,
+                              getattr(row, "content_hash", None)))
+        for row in rows
+    ]
+    counts: Dict[str, int] = {}
+    changed = []
+    for row, future in futures:
+        result = future.result()
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        if result["status"] == "unchanged":
+            continue
+        changed.append({"file_id": row.id, "canvas_id": row.canvas_id, "content_hash": result["hash"],
+                        "status": result["status"], "text": result["text"], "error": result["error"]})
+    if changed:
+        with engine.begin() as connection:
+            _upsert(connection, changed)
+            # Поиск кэшируется по версии files: новые результаты должны сбросить ETag
+            http_cache.bump_versions(connection, [("files", row["canvas_id"]) for row in changed])
+    return counts
+
+
+def _merge(total: Dict[str, int], counts: Dict[str, int]) -> None:
+    for status, count in counts.items():
+        total[status] = total.get(status, 0) + count
+
+
+def index_pending(engine: Engine, media_dir: Path, executor, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Проиндексировать вложения, для которых еще нет записи в file_contents"""
+    total: Dict[str, int] = {}
+    last_id = 0
+    pending = ~exists().where(contents.c.file_id == files.c.id)
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(files.c.id, files.c.canvas_id, files.c.filepath, files.c.mime_type)
+                .where(pending, files.c.id > last_id).order_by(files.c.id).limit(batch_size)
+            ).all()
+        if not rows:
+            return total
+        last_id = rows[-1].id
+        _merge(total, _index_rows(engine, media_dir, executor, rows))
+
+
+def reindex(engine: Engine, media_dir: Path, executor, canvas_id: Optional[str] = None,
+            batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Перепроверить все вложения; текст извлекается заново только у изменившихся файлов"""
+    total: Dict[str, int] = {}
+    last_id = 0
+    while True:
+        query = select(files.c.id, files.c.canvas_id, files.c.filepath, files.c.mime_type, contents.c.content_hash) \
+            .select_from(files.outerjoin(contents, contents.c.file_id == files.c.id)) \
+            .where(files.c.id > last_id)
+        if canvas_id:
+            query = query.where(files.c.canvas_id == canvas_id)
+        with engine.connect() as connection:
+            rows = connection.execute(query.order_by(files.c.id).limit(batch_size)).all()
+        if not rows:
+            return total
+        last_id = rows[-1].id
+        _merge(total, _index_rows(engine, media_dir, executor, rows))
+
+
+def _executor(workers: int) -> ProcessPoolExecutor:
+    # spawn: fork процесса с потоками uvicorn и открытыми соединениями небезопасен
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class AttachmentIndexer:
+    """Фоновый поток воркера, индексирующий новые вложения"""
+
+    def __init__(self, engine: Engine, media_dir: Path, workers: int = INDEX_WORKERS,
+                 interval: float = RESCAN_INTERVAL):
+        self.engine = engine
+        self.media_dir = media_dir
+        self.workers = workers
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.workers <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="attachment-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def notify(self) -> None:
+        """Есть новые вложения"""
+        self._wake.set()
+
+    def _run(self) -> None:
+        # Первый проход сразу: файлы, загруженные до перезапуска или до появления индекса
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                counts = self.run_once()
+                if counts:
+                    logger.info("Attachments indexed: %s", counts)
+            except Exception as e:
+                logger.warning("Attachment indexing failed: %s", e)
+            self._wake.wait(self.interval)
+
+    def run_once(self) -> Optional[Dict[str, int]]:
+        """Один проход по неиндексированным вложениям; None, если его выполняет другой воркер"""
+        with self.engine.connect() as connection:
+            if not self._pending(connection):
+                return {}
+        if self.engine.dialect.name != "postgresql":
+            return self._index()
+        with self.engine.connect() as connection:
+            if not connection.execute(select(func.pg_try_advisory_lock(ADVISORY_LOCK_ID))).scalar():
+                return None
+            connection.commit()  # блокировка сессионная, транзакцию открытой не держим
+            try:
+                return self._index()
+            finally:
+                connection.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_ID)))
+                connection.commit()
+
+    def _index(self) -> Dict[str, int]:
+        # Пул создается на проход: между загрузками процессы не держат память
+        with _executor(self.workers) as executor:
+            return index_pending(self.engine, self.media_dir, executor)
+
+    @staticmethod
+    def _pending(connection: Connection) -> bool:
+        pending = ~exists().where(contents.c.file_id == files.c.id)
+        return connection.execute(select(files.c.id).where(pending).limit(1)).first() is not None
+
+
+def _snippet(content: str, query: str) -> str:
+    position = content.lower().find(query.lower())
+    start = max(0, position - SNIPPET_CHARS // 2)
+    snippet = " ".join(content[start:start + SNIPPET_CHARS].split())
+    return ("…" if start else "") + snippet
+
+
+def search(db: Session, canvas_id: str, q: str, limit: int = 20) -> List[Dict]:
+    """Вложения холста, в тексте которых встречается запрос, с фрагментом вокруг совпадения"""
+    columns = (File.id, File.filename, File.task_id, File.note_id)
+    if db.get_bind().dialect.name == "postgresql":
+        config = literal_column(f"'{SEARCH_CONFIG}'")
+        query = func.websearch_to_tsquery(config, q)
+        vector = literal_column("file_contents.search_vector")
+        # Ранжирование по готовому tsvector, подсветка - только для отобранных строк
+        top = db.query(*columns, FileContent.text) \
+            .join(FileContent, FileContent.file_id == File.id) \
+            .filter(FileContent.canvas_id == canvas_id, vector.op("@@")(query)) \
+            .order_by(func.ts_rank(vector, query).desc()).limit(limit).subquery()
+        rows = db.query(
+            top.c.id, top.c.filename, top.c.task_id, top.c.note_id,
+            func.ts_headline(config, func.left(top.c.text, HEADLINE_CHARS), query,
+                             "MaxFragments=1, MinWords=5, MaxWords=25").label("snippet"),
+        ).all()
+    else:
+        rows = [
+            (*row[:4], _snippet(row.text, q))
+            for row in db.query(*columns, FileContent.text)
+            .join(FileContent, FileContent.file_id == File.id)
+            .filter(FileContent.canvas_id == canvas_id, FileContent.text.ilike(f"%{q}%"))
+            .limit(limit).all()
+        ]
+    return [{"file_id": file_id, "filename": filename, "task_id": task_id, "note_id": note_id, "snippet": snippet}
+            for file_id, filename, task_id, note_id, snippet in rows]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="app.services.attachment_index", description="Индексация вложений")
+    parser.add_argument("--canvas", help="только этот холст (с --all)")
+    parser.add_argument("--all", action="store_true", help="перепроверить и уже проиндексированные файлы")
+    parser.add_argument("--media-dir", default="media")
+    parser.add_argument("--workers", type=int, default=max(INDEX_WORKERS, 1))
+    args = parser.parse_args(argv)
+
+    from ..database import engine
+
+    with _executor(args.workers) as executor:
+        if args.all:
+            report = reindex(engine, Path(args.media_dir), executor, args.canvas)
+        else:
+            report = index_pending(engine, Path(args.media_dir), executor)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
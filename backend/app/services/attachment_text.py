@@ -0,0 +1,85 @@
+"""
+Извлечение текста из вложений для поиска.
+
+Выполняется в процессах пула индексатора (attachment_index), поэтому модуль не
+импортирует ни БД, ни FastAPI - дочерний процесс стартует быстро.
+"""
+import hashlib
+from pathlib import Path
+from typing import Dict, Optional
+
+# Ограничение текста: tsvector в Postgres не больше 1 МБ
+MAX_TEXT_CHARS = 500_000
+# Файлы больше этого не разбираются
+MAX_FILE_SIZE = 50 * 1024 * 1024
+
+TEXT_EXTENSIONS = {".txt", ".md", ".markdown", ".csv", ".tsv", ".json", ".log", ".xml", ".html", ".htm"}
+TEXT_MIME_TYPES = {"application/json", "application/xml", "application/x-markdown"}
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _kind(path: Path, mime_type: str) -> Optional[str]:
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    if mime_type == "application/pdf" or path.suffix.lower() == ".pdf":
+        return "pdf"
+    if mime_type.startswith("text/") or mime_type in TEXT_MIME_TYPES or path.suffix.lower() in TEXT_EXTENSIONS:
+        return "text"
+    return None
+
+
+def _decode(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1251"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def _pdf_text(path: Path) -> str:
+    from pypdf import PdfReader
+
+    parts, size = [], 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ""
+        parts.append(text)
+        size += len(text)
+        if size >= MAX_TEXT_CHARS:
+            break
+    return "\n".join(parts)
+
+
+def extract(path: str, mime_type: str, known_hash: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """
+    Текст файла и его хэш. status: indexed, unchanged (хэш совпал с known_hash,
+    текст не извлекался), unsupported, missing, error.
+    """
+    path = Path(path)
+    result: Dict[str, Optional[str]] = {"hash": None, "status": "error", "text": None, "error": None}
+    try:
+        if not path.is_file():
+            result["status"] = "missing"
+            return result
+        result["hash"] = file_hash(path)
+        if known_hash and result["hash"] == known_hash:
+            result["status"] = "unchanged"
+            return result
+        kind = _kind(path, mime_type)
+        if kind is None or path.stat().st_size > MAX_FILE_SIZE:
+            result["status"] = "unsupported"
+            return result
+        text = _pdf_text(path) if kind == "pdf" else _decode(path.read_bytes())
+        # NUL не допускается в text Postgres
+        result["text"] = text[:MAX_TEXT_CHARS].replace("\x00", "")
+        result["status"] = "indexed"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"[:1000]
+    return result
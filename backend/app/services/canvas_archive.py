@@ -0,0 +1,410 @@
+"""
+Экспорт и импорт холста целиком в потоковом архиве.
+
+Архив - tar.gz со следующими записями (именно в этом порядке):
+
+    manifest.json         версия формата и исходный canvas_id
+    canvas.json           сам холст
+    tasks.ndjson          задачи, родители раньше подзадач
+    notes.ndjson
+    task_links.ndjson
+    note_links.ndjson
+    files.ndjson
+    event_logs.ndjson
+    media/<имя файла>     содержимое вложений
+
+Задача, родитель которой на другом холсте, выгружается корнем; задачи, до
+которых обход от корней не доходит (цепочка родителей замкнута в цикл),
+выгружаются в конце секции без родителя.
+
+И экспорт, и импорт работают потоково: архив пишется в ограниченную очередь
+по мере чтения строк из БД (если клиент отключился, запись прекращается), а при импорте строки читаются из tar-потока и
+загружаются пачками (COPY в Postgres, executemany в остальных СУБД).
+Новые идентификаторы получаются как uuid5 от старых в пространстве имен,
+уникальном для каждого импорта, поэтому таблица соответствия не хранится
+и расход памяти не зависит от размера архива.
+"""
+import io
+import json
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+from sqlalchemy import Table, literal, or_, select
+from sqlalchemy.orm import aliased
+
+from ..models import Canvas, EventLog, File, Note, NoteLink, Task, TaskLink
+from . import http_cache
+
+FORMAT_VERSION = 1
+
+# Порядок секций важен: ссылки должны идти после того, на что они ссылаются
+SECTIONS = [
+    ("tasks", Task),
+    ("notes", Note),
+    ("task_links", TaskLink),
+    ("note_links", NoteLink),
+    ("files", File),
+    ("event_logs", EventLog),
+]
+
+# Размер пачки строк при загрузке
+BATCH_SIZE = 5000
+
+# Сколько сжатых фрагментов может ждать отправки клиенту
+_QUEUE_SIZE = 64
+# Как часто поток записи, ждущий места в очереди, проверяет отключение клиента
+_PUT_TIMEOUT = 1.0
+_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+# Export
+
+class _ExportCancelled(Exception):
+    """Клиент перестал читать архив"""
+
+
+def _put(chunks: "queue.Queue", item: Any, cancelled: threading.Event) -> None:
+    """Положить в очередь, пока клиент читает; иначе - _ExportCancelled"""
+    while not cancelled.is_set():
+        try:
+            chunks.put(item, timeout=_PUT_TIMEOUT)
+            return
+        except queue.Full:
+            continue
+    raise _ExportCancelled()
+
+
+class _QueueWriter(io.RawIOBase):
+    """Файлоподобный объект, отдающий записанные байты в ограниченную очередь"""
+
+    def __init__(self, chunks: "queue.Queue", cancelled: threading.Event):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if data:
+            _put(self.chunks, bytes(data), self.cancelled)
+        return len(data)
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _row_dict(table: Table, row) -> Dict[str, Any]:
+    return {column.name: _to_json(row._mapping[column]) for column in table.columns}
+
+
+def _section_query(model, canvas_id: str):
+    if model is not Task:
+        return select(model.__table__).where(model.__table__.c.canvas_id == canvas_id)
+
+    # Родители раньше подзадач, чтобы внешний ключ parent_id проверялся при пачечной загрузке.
+    # Корни - задачи без родителя на этом холсте
+    tasks = Task.__table__
+    local_ids = select(tasks.c.id).where(tasks.c.canvas_id == canvas_id)
+    tree = (
+        select(tasks.c.id, literal(0).label("depth"))
+        .where(tasks.c.canvas_id == canvas_id,
+               or_(tasks.c.parent_id.is_(None), tasks.c.parent_id.not_in(local_ids)))
+        .cte("tree", recursive=True)
+    )
+    parent = aliased(tree, name="parent")
+    tree = tree.union_all(
+        select(tasks.c.id, (parent.c.depth + 1).label("depth"))
+        .join(parent, tasks.c.parent_id == parent.c.id)
+        .where(tasks.c.canvas_id == canvas_id)
+    )
+    # Не достижимые от корней (depth NULL) - в конце
+    return (
+        select(tasks, tree.c.depth)
+        .outerjoin(tree, tree.c.id == tasks.c.id)
+        .where(tasks.c.canvas_id == canvas_id)
+        .order_by(tree.c.depth.is_(None), tree.c.depth, tasks.c.id)
+    )
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(datetime.now().timestamp())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _write_archive(session_factory, canvas_id: str, media_dir: Path, chunks: "queue.Queue",
+                   cancelled: threading.Event) -> None:
+    writer = _QueueWriter(chunks, cancelled)
+    try:
+        try:
+            _write_sections(session_factory, canvas_id, media_dir, writer)
+        except _ExportCancelled:
+            raise
+        except Exception as e:
+            _put(chunks, e, cancelled)
+        _put(chunks, None, cancelled)
+    except _ExportCancelled:
+        pass  # клиент отключился; сессия уже закрыта выходом из with
+
+
+def _write_sections(session_factory, canvas_id: str, media_dir: Path, writer: _QueueWriter) -> None:
+    with session_factory() as db, tarfile.open(fileobj=writer, mode="w|gz") as tar:
+        canvas = _canvas_row(db, canvas_id)
+        if canvas is None:
+            # Холст удалили после проверки в обработчике
+            raise ArchiveError("Холст не найден")
+        manifest = {"format": "holst-canvas", "version": FORMAT_VERSION, "canvas_id": canvas_id}
+        _add_bytes(tar, "manifest.json", json.dumps(manifest).encode())
+        _add_bytes(tar, "canvas.json", json.dumps(_row_dict(Canvas.__table__, canvas)).encode())
+
+        media_files: List[str] = []
+        for name, model in SECTIONS:
+            table = model.__table__
+            # Секция копится во временном файле: tar должен знать размер записи заранее
+            with tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE) as spool:
+                result = db.execute(_section_query(model, canvas_id).execution_options(yield_per=1000))
+                for row in result:
+                    record = _row_dict(table, row)
+                    if model is Task and not row.depth:
+                        # Родитель на другом холсте или в цикле: в архиве ссылаться не на что
+                        record["parent_id"] = None
+                    if model is File:
+                        media_files.append(record["filepath"])
+                    spool.write(json.dumps(record, ensure_ascii=False).encode())
+                    spool.write(b"\n")
+                info = tarfile.TarInfo(f"{name}.ndjson")
+                info.size = spool.tell()
+                info.mtime = int(datetime.now().timestamp())
+                spool.seek(0)
+                tar.addfile(info, spool)
+
+        for filepath in media_files:
+            path = Path(filepath)
+            if not path.is_absolute() and not path.exists():
+                path = media_dir / path.name
+            if path.is_file():
+                tar.add(str(path), arcname=f"media/{path.name}", recursive=False)
+
+
+def _canvas_row(db, canvas_id: str):
+    return db.execute(select(Canvas.__table__).where(Canvas.__table__.c.id == canvas_id)).first()
+
+
+def stream_export(session_factory, canvas_id: str, media_dir: Path) -> Iterator[bytes]:
+    """Генератор сжатого архива холста; архив пишется в отдельном потоке"""
+    chunks: "queue.Queue" = queue.Queue(maxsize=_QUEUE_SIZE)
+    cancelled = threading.Event()
+    worker = threading.Thread(
+        target=_write_archive, args=(session_factory, canvas_id, media_dir, chunks, cancelled),
+        name=f"canvas-export-{canvas_id}", daemon=True,
+    )
+    worker.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+        worker.join()
+    finally:
+        # Клиент отключился или ошибка: поток записи бросает работу и освобождает сессию
+        cancelled.set()
+
+
+# Import
+
+class _IdMapper:
+    """Детерминированная замена идентификаторов без таблицы соответствия"""
+
+    def __init__(self):
+        self.namespace = uuid.uuid4()
+
+    def __call__(self, old_id: Optional[str]) -> Optional[str]:
+        if old_id is None:
+            return None
+        return str(uuid.uuid5(self.namespace, str(old_id)))
+
+    def media_name(self, old_path: str) -> str:
+        old_name = Path(old_path).name
+        original = old_name.split("_", 1)[1] if "_" in old_name else old_name
+        return f"{self(old_name)}_{original}"
+
+
+def _parse_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _remap(name: str, record: Dict[str, Any], new_id: _IdMapper, canvas_id: str) -> Dict[str, Any]:
+    record = dict(record)
+    record["canvas_id"] = canvas_id
+    if name in ("tasks", "notes"):
+        record["id"] = new_id(record["id"])
+        if name == "tasks":
+            record["parent_id"] = new_id(record.get("parent_id"))
+        else:
+            record["task_id"] = new_id(record.get("task_id"))
+    else:
+        # Целочисленные ключи выдает последовательность целевой БД
+        record.pop("id", None)
+        if name in ("task_links", "note_links"):
+            record["source_id"] = new_id(record["source_id"])
+            record["target_id"] = new_id(record.get("target_id"))
+        elif name == "files":
+            record["task_id"] = new_id(record.get("task_id"))
+            record["note_id"] = new_id(record.get("note_id"))
+            record["base_card_id"] = new_id(record.get("base_card_id"))
+            record["filepath"] = str(Path("media") / new_id.media_name(record["filepath"]))
+        elif name == "event_logs" and record.get("entity_type") in ("card", "task", "note"):
+            record["entity_id"] = new_id(record["entity_id"])
+    return record
+
+
+def _csv_value(value: Any) -> str:
+    if value is None:
+        return ""  # в CSV-режиме COPY пустое значение без кавычек - это NULL
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, bool):
+        value = "true" if value else "false"
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class _BatchLoader:
+    def __init__(self, connection, table: Table):
+        self.connection = connection
+        self.table = table
+        self.columns = [column.name for column in table.columns if column.name in self._loaded_columns(table)]
+        self.rows: List[Dict[str, Any]] = []
+        self.count = 0
+
+    @staticmethod
+    def _loaded_columns(table: Table):
+        pk = list(table.primary_key.columns)
+        if len(pk) == 1 and pk[0].autoincrement in (True, "auto") and pk[0].type.python_type is int:
+            return {column.name for column in table.columns} - {pk[0].name}
+        return {column.name for column in table.columns}
+
+    def add(self, record: Dict[str, Any]) -> None:
+        self.rows.append(record)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        if self.connection.dialect.name == "postgresql":
+            self._copy()
+        else:
+            rows = [
+                {name: _parse_datetime(row.get(name)) if name in ("created_at", "updated_at", "timestamp", "changed_at")
+                 else row.get(name) for name in self.columns}
+                for row in self.rows
+            ]
+            self.connection.execute(self.table.insert(), rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def _copy(self) -> None:
+        buffer = io.StringIO()
+        for row in self.rows:
+            buffer.write(",".join(_csv_value(row.get(name)) for name in self.columns))
+            buffer.write("\n")
+        buffer.seek(0)
+        columns = ", ".join(f'"{name}"' for name in self.columns)
+        cursor = self.connection.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY {self.table.name} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+
+
+def import_archive(session_factory, archive: BinaryIO, media_dir: Path, title: Optional[str] = None) -> Dict[str, Any]:
+    """Загрузить архив в новый холст и вернуть его id и количество строк по секциям"""
+    new_id = _IdMapper()
+    canvas_id = str(uuid.uuid4())
+    counts: Dict[str, int] = {}
+    written_media: List[Path] = []
+    seen_manifest = seen_canvas = False
+    expected = [name for name, _ in SECTIONS]
+
+    try:
+        with session_factory() as db:
+            connection = db.connection()
+            with tarfile.open(fileobj=archive, mode="r|gz") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    source = tar.extractfile(member)
+                    if member.name == "manifest.json":
+                        manifest = json.load(source)
+                        if manifest.get("format") != "holst-canvas" or manifest.get("version") != FORMAT_VERSION:
+                            raise ArchiveError("Неподдерживаемый формат архива")
+                        seen_manifest = True
+                    elif not seen_manifest:
+                        raise ArchiveError("Архив должен начинаться с manifest.json")
+                    elif member.name == "canvas.json":
+                        if seen_canvas:
+                            raise ArchiveError("В архиве два canvas.json")
+                        seen_canvas = True
+                        canvas = json.load(source)
+                        connection.execute(Canvas.__table__.insert().values(
+                            id=canvas_id, title=title or canvas.get("title") or "Импортированный холст"
+                        ))
+                    elif member.name.endswith(".ndjson"):
+                        if not seen_canvas:
+                            raise ArchiveError("В архиве нет canvas.json перед секциями")
+                        name = member.name[:-len(".ndjson")]
+                        if name not in expected:
+                            raise ArchiveError(f"Неизвестная секция архива: {member.name}")
+                        # Секции идут строго по порядку, ссылки - после своих целей
+                        expected = expected[expected.index(name) + 1:]
+                        model = dict(SECTIONS)[name]
+                        loader = _BatchLoader(connection, model.__table__)
+                        for line in source:
+                            if line.strip():
+                                loader.add(_remap(name, json.loads(line), new_id, canvas_id))
+                        loader.flush()
+                        counts[name] = loader.count
+                    elif member.name.startswith("media/"):
+                        target = media_dir / new_id.media_name(member.name)
+                        with open(target, "wb") as buffer:
+                            shutil.copyfileobj(source, buffer)
+                        written_media.append(target)
+
+            if not seen_manifest:
+                raise ArchiveError("Пустой архив")
+            if not seen_canvas:
+                raise ArchiveError("В архиве нет canvas.json")
+            http_cache.bump_versions(connection, [(table_name, canvas_id) for table_name in http_cache.TRACKED_TABLES])
+            db.commit()
+    except (tarfile.TarError, EOFError, json.JSONDecodeError, KeyError) as e:
+        for path in written_media:
+            path.unlink(missing_ok=True)
+        raise ArchiveError(f"Поврежденный архив: {e}") from e
+    except Exception:
+        for path in written_media:
+            path.unlink(missing_ok=True)
+        raise
+
+    return {"canvas_id": canvas_id, "counts": counts}
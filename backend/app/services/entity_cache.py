@@ -0,0 +1,202 @@
+"""
+Внутрипроцессный read-through кэш задач и заметок.
+
+Хранит снимки строк (словари колонок) в ограниченном LRU с TTL. Записи
+сбрасываются при локальном flush/commit, а другим воркерам рассылаются
+событием шины (event_bus, тема entities) в той же транзакции - оно уходит
+только при коммите.
+
+Сброс увеличивает поколение кэша: снимок, прочитанный из БД до сброса, не
+запоминается. Пока шина запущена, но не подключена, о чужих записях не узнать -
+кэш не используется.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ..models import Canvas, Note, Task
+from .event_bus import bus
+
+TOPIC = "entities"
+
+CACHED_MODELS = {model.__tablename__: model for model in (Task, Note)}
+
+Key = Tuple[str, str]
+
+
+class EntityCache:
+    """Потокобезопасный LRU с TTL, поколением сбросов и счетчиками попаданий"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Key, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Key) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Key, value: Dict[str, Any], generation: Optional[int] = None) -> None:
+        """Запомнить value; с generation - только если с начала чтения не было сбросов"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys: Iterable[Key]) -> None:
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+entity_cache = EntityCache(
+    maxsize=int(os.getenv("ENTITY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("ENTITY_CACHE_TTL", "30")),
+)
+
+
+def _snapshot(obj) -> Dict[str, Any]:
+    return {attr.key: getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs}
+
+
+def get_entity(db: Session, model, entity_id: str, canvas_id: str) -> Optional[Dict[str, Any]]:
+    """Вернуть снимок задачи/заметки холста из кэша или из БД"""
+    key = (model.__tablename__, entity_id)
+    # Шина запущена, но отключена: сбросы из других воркеров сейчас не приходят
+    cached = bus.connected or not bus.running
+    snapshot = entity_cache.get(key) if cached else None
+    if snapshot is None:
+        generation = entity_cache.generation
+        obj = db.get(model, entity_id)
+        if obj is None:
+            return None
+        snapshot = _snapshot(obj)
+        if cached:
+            entity_cache.set(key, snapshot, generation)
+    if snapshot["canvas_id"] != canvas_id:
+        return None
+    return dict(snapshot)
+
+
+def entity_exists(db: Session, model, entity_id: str, canvas_id: str) -> bool:
+    return get_entity(db, model, entity_id, canvas_id) is not None
+
+
+def _changed_keys(session: Session) -> Tuple[Set[Key], bool]:
+    keys = set()
+    clear_all = False
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Canvas) and obj in session.deleted:
+            # Каскадное удаление в БД не проходит через ORM
+            clear_all = True
+        table_name = getattr(obj, "__tablename__", None)
+        if table_name in CACHED_MODELS:
+            keys.add((table_name, obj.id))
+    return keys, clear_all
+
+
+def _apply_items(items: List[str]) -> None:
+    if "*" in items:
+        entity_cache.clear()
+        return
+    keys = []
+    for item in items:
+        table_name, _, entity_id = item.partition(":")
+        keys.append((table_name, entity_id))
+    entity_cache.invalidate(keys)
+
+
+# Сброс из других воркеров; после переподключения шины пропущенные события неизвестны
+bus.subscribe(TOPIC, _apply_items)
+bus.on_resync(entity_cache.clear)
+
+
+def mark_changed(session: Session, keys: Iterable[Key], clear_all: bool = False) -> None:
+    """
+    Сбросить записи здесь и в других воркерах в транзакции сессии.
+
+    flush вызывает это сам; массовые UPDATE и Core-запросы в обход ORM должны
+    вызывать явно.
+    """
+    keys = set(keys)
+    if not keys and not clear_all:
+        return
+    pending = session.info.setdefault("entity_cache_keys", set())
+    pending.update(keys)
+    if clear_all:
+        session.info["entity_cache_clear"] = True
+    entity_cache.invalidate(keys)
+
+    items = ["*"] if clear_all else [f"{table_name}:{entity_id}" for table_name, entity_id in sorted(keys)]
+    bus.publish(session.connection(), TOPIC, items)
+
+
+def track_changes(session_factory) -> None:
+    """Сбрасывать кэш при записи и рассылать сброс другим воркерам"""
+
+    @event.listens_for(session_factory, "after_flush")
+    def _invalidate_after_flush(session, flush_context):
+        keys, clear_all = _changed_keys(session)
+        mark_changed(session, keys, clear_all)
+
+    @event.listens_for(session_factory, "after_commit")
+    def _invalidate_after_commit(session):
+        # Повторный сброс: между flush и commit другой запрос мог прочитать старую строку
+        keys = session.info.pop("entity_cache_keys", None)
+        if session.info.pop("entity_cache_clear", False):
+            entity_cache.clear()
+        elif keys:
+            entity_cache.invalidate(keys)
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _forget_after_rollback(session):
+        session.info.pop("entity_cache_keys", None)
+        session.info.pop("entity_cache_clear", None)
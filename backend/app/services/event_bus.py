@@ -0,0 +1,177 @@
+"""
+Шина событий между воркерами на Postgres LISTEN/NOTIFY.
+
+Запись публикует событие (publish) в своей транзакции: pg_notify доставляется
+только после коммита и только если коммит состоялся. Каждый воркер держит
+одно соединение LISTEN в фоновом потоке и раздает события подписчикам темы
+(subscribe); свои уведомления воркер тоже получает.
+
+Пока соединения нет, события теряются. Поэтому после каждого подключения
+вызываются обработчики on_resync - подписчики сбрасывают состояние целиком, а
+connected показывает, можно ли сейчас полагаться на то, что об изменениях
+придет событие (в SQLite шина не работает никогда).
+"""
+import json
+import logging
+import select
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "holst_events"
+
+# Максимальная длина payload у pg_notify - 8000 байт
+PAYLOAD_LIMIT = 7900
+
+Handler = Callable[[List[str]], None]
+
+
+def _encode(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _payloads(topic: str, items: Iterable[str]) -> Iterator[str]:
+    """JSON [topic, [item, ...]] пачками не длиннее PAYLOAD_LIMIT"""
+    # JSON, а не разделители: элементы (id из /api/sync) могут содержать любые символы
+    base = len(_encode([topic, []]))
+    chunk: List[str] = []
+    size = base
+    for item in items:
+        length = len(_encode(item)) + 1  # ensure_ascii: длина в символах равна длине в байтах
+        if chunk and size + length > PAYLOAD_LIMIT:
+            yield _encode([topic, chunk])
+            chunk, size = [], base
+        chunk.append(item)
+        size += length
+    if chunk:
+        yield _encode([topic, chunk])
+
+
+class EventBus:
+    """Одно соединение LISTEN на воркер и подписчики по темам"""
+
+    def __init__(self, channel: str = CHANNEL, poll_timeout: float = 5.0):
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._resync: List[Callable[[], None]] = []
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._engine: Optional[Engine] = None
+        self.published = 0
+        self.received = 0
+        self.connects = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    @property
+    def running(self) -> bool:
+        """Поток шины запущен (Postgres); в SQLite шины нет и другие воркеры не пишут"""
+        return self._thread is not None
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """handler(items) вызывается в потоке шины на каждое событие темы"""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def on_resync(self, handler: Callable[[], None]) -> None:
+        """handler() вызывается после подключения и переподключения"""
+        self._resync.append(handler)
+
+    def publish(self, connection: Connection, topic: str, items: Iterable[str]) -> None:
+        """Отправить событие при коммите транзакции connection"""
+        if connection.dialect.name != "postgresql":
+            return
+        for payload in _payloads(topic, items):
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {"channel": self.channel, "payload": payload})
+            self.published += 1
+
+    def start(self, engine: Engine) -> None:
+        if engine.dialect.name != "postgresql" or self._thread is not None:
+            return
+        self._engine = engine
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_timeout + 1)
+            self._thread = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "published": self.published,
+            "received": self.received,
+            "topics": sorted(self._handlers),
+        }
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as e:
+                logger.warning("Event bus disconnected: %s", e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                self._connected.clear()
+
+    def _listen(self) -> None:
+        raw = self._engine.raw_connection()
+        raw.detach()  # соединение не возвращается в пул
+        connection = raw.driver_connection
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            # Пока соединения не было, события могли потеряться
+            self.connects += 1
+            self._connected.set()
+            self._call_resync()
+            while not self._stop.is_set():
+                if select.select([connection], [], [], self.poll_timeout) == ([], [], []):
+                    # Тишина: проверить, что соединение живо, иначе обрыв заметен только по таймауту TCP
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    self._dispatch(connection.notifies.pop(0).payload)
+        finally:
+            raw.close()
+
+    def _call_resync(self) -> None:
+        for handler in self._resync:
+            try:
+                handler()
+            except Exception as e:
+                logger.warning("Event bus resync handler failed: %s", e)
+
+    def _dispatch(self, payload: str) -> None:
+        self.received += 1
+        try:
+            topic, items = json.loads(payload)
+        except ValueError:
+            logger.warning("Event bus payload is not valid JSON: %.100s", payload)
+            return
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(items)
+            except Exception as e:
+                logger.warning("Event bus handler for %s failed: %s", topic, e)
+
+
+bus = EventBus()
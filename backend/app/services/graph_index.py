@@ -0,0 +1,318 @@
+"""
+Запросы к графу связей холста без выгрузки всего графа.
+
+Граф - задачи и заметки (узлы) и связи TaskLink/NoteLink (ребра). На каждый
+холст в памяти воркера лениво строится индекс: узлы пронумерованы, ребра лежат
+массивами numpy, смежность - в CSR отдельно для исходящих и входящих ребер.
+Индекс зависит только от таблиц связей и перестраивается при смене их версии в
+change_versions, поэтому перетаскивание карточек его не сбрасывает. Заголовки
+и координаты узлов ответа дочитываются по первичному ключу.
+
+Обход идет волнами по всему фронту сразу, поэтому окрестность узла стоит
+O(размер окрестности), а не O(размер графа).
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import Note, NoteLink, Task, TaskLink
+from . import http_cache
+
+LINK_TABLES = ("task_links", "note_links")
+DIRECTIONS = ("both", "out", "in")
+
+MAX_DEPTH = 6
+# Предел узлов в ответе окрестности: у хабов окрестность в 2-3 шага - почти весь граф
+MAX_NODES = 5000
+MAX_CANVASES = 32
+
+
+class GraphQueryError(ValueError):
+    pass
+
+
+def _csr(n: int, src: np.ndarray, dst: np.ndarray):
+    """Смежность в CSR: соседи узла i - targets[offsets[i]:offsets[i + 1]], order - номера ребер"""
+    order = np.argsort(src, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+    return offsets, dst[order], order
+
+
+def _gather(offsets: np.ndarray, targets: np.ndarray, nodes: np.ndarray):
+    """Соседи всех узлов nodes и позиции соответствующих ребер в CSR"""
+    counts = offsets[nodes + 1] - offsets[nodes]
+    starts = np.repeat(offsets[nodes], counts)
+    positions = starts + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return targets[positions], positions
+
+
+class GraphIndex:
+    """Связи одного холста в CSR"""
+
+    def __init__(self, node_ids: List[str], node_types: List[str], src: np.ndarray, dst: np.ndarray,
+                 edges: List[Dict]):
+        self.node_ids = node_ids
+        self.node_types = node_types
+        self.index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.src = src
+        self.dst = dst
+        self.edges = edges  # поля ребер для ответа, в порядке src/dst
+        n = len(node_ids)
+        self.out_offsets, self.out_targets, self.out_edges = _csr(n, src, dst)
+        self.in_offsets, self.in_targets, self.in_edges = _csr(n, dst, src)
+        self._components: Optional[tuple] = None  # (alive, метки)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def _expand(self, frontier: np.ndarray, direction: str):
+        """Соседи фронта и номера ребер, по которым они достигнуты"""
+        parts = []
+        if direction in ("both", "out"):
+            targets, positions = _gather(self.out_offsets, self.out_targets, frontier)
+            parts.append((targets, self.out_edges[positions]))
+        if direction in ("both", "in"):
+            targets, positions = _gather(self.in_offsets, self.in_targets, frontier)
+            parts.append((targets, self.in_edges[positions]))
+        targets = np.concatenate([p[0] for p in parts])
+        edge_ids = np.concatenate([p[1] for p in parts])
+        return targets, edge_ids
+
+    def neighbourhood(self, start: int, depth: int, direction: str, limit: int = MAX_NODES):
+        """Узлы не дальше depth шагов от start; truncated - окрестность обрезана по limit"""
+        seen = {start}
+        frontier = np.array([start])
+        truncated = False
+        for _ in range(depth):
+            if not frontier.size:
+                break
+            targets, _ = self._expand(frontier, direction)
+            new = np.setdiff1d(np.unique(targets), np.fromiter(seen, dtype=np.int64), assume_unique=True)
+            if len(seen) + new.size > limit:
+                new = new[:limit - len(seen)]
+                truncated = True
+            seen.update(new.tolist())
+            frontier = new
+            if truncated:
+                break
+        return np.array(sorted(seen)), truncated
+
+    def shortest_path(self, source: int, target: int, direction: str, max_depth: int):
+        """Узлы и ребра кратчайшего (по числу связей) пути или None"""
+        n = len(self)
+        parent_edge = np.full(n, -1)
+        parent_node = np.full(n, -1)
+        visited = np.zeros(n, dtype=bool)
+        visited[source] = True
+        frontier = np.array([source])
+        for _ in range(max_depth):
+            if visited[target] or not frontier.size:
+                break
+            targets, edge_ids = self._expand(frontier, direction)
+            # Для каждого соседа - узел фронта, из которого он достигнут
+            origins = self._edge_origin(edge_ids, targets)
+            fresh = ~visited[targets]
+            targets, edge_ids, origins = targets[fresh], edge_ids[fresh], origins[fresh]
+            targets, first = np.unique(targets, return_index=True)
+            parent_edge[targets] = edge_ids[first]
+            parent_node[targets] = origins[first]
+            visited[targets] = True
+            frontier = targets
+        if not visited[target]:
+            return None
+
+        nodes, edges = [target], []
+        while nodes[-1] != source:
+            edges.append(int(parent_edge[nodes[-1]]))
+            nodes.append(int(parent_node[nodes[-1]]))
+        return nodes[::-1], edges[::-1]
+
+    def _edge_origin(self, edge_ids: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        # Ребро src->dst пришло либо из src (исходящее), либо из dst (входящее)
+        return np.where(self.dst[edge_ids] == targets, self.src[edge_ids], self.dst[edge_ids])
+
+    def live_edges(self, alive: np.ndarray) -> np.ndarray:
+        """Маска ребер, оба конца которых среди alive (маска узлов)"""
+        return alive[self.src] & alive[self.dst]
+
+    def components(self, alive: np.ndarray) -> np.ndarray:
+        """Метка компоненты связности каждого узла (наименьший номер узла в ней) по ребрам между живыми узлами"""
+        if self._components is not None and np.array_equal(self._components[0], alive):
+            return self._components[1]
+        keep = self.live_edges(alive)
+        src, dst = self.src[keep], self.dst[keep]
+        labels = np.arange(len(self))
+        while True:
+            updated = labels.copy()
+            np.minimum.at(updated, src, labels[dst])
+            np.minimum.at(updated, dst, labels[src])
+            updated = updated[updated]  # перескок по указателям сокращает число проходов
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        self._components = (alive, labels)
+        return labels
+
+    def subgraph_edges(self, nodes: np.ndarray) -> np.ndarray:
+        """Номера ребер, оба конца которых в nodes"""
+        _, edge_ids = self._expand(nodes, "out")
+        inside = np.zeros(len(self), dtype=bool)
+        inside[nodes] = True
+        return np.sort(edge_ids[inside[self.dst[edge_ids]]])
+
+
+def build_index(db: Session, canvas_id: str) -> GraphIndex:
+    node_ids: List[str] = []
+    node_types: List[str] = []
+    index: Dict[str, int] = {}
+
+    def node(node_id: str, node_type: str) -> int:
+        if node_id not in index:
+            index[node_id] = len(node_ids)
+            node_ids.append(node_id)
+            node_types.append(node_type)
+        return index[node_id]
+
+    src, dst, edges = [], [], []
+    task_links = db.query(TaskLink.id, TaskLink.source_id, TaskLink.target_id, TaskLink.link_type,
+                          TaskLink.link_target_type).filter(TaskLink.canvas_id == canvas_id).all()
+    for link in task_links:
+        if not link.target_id:
+            continue
+        src.append(node(link.source_id, "card"))
+        dst.append(node(link.target_id, "note" if link.link_target_type == "note" else "card"))
+        edges.append({"id": link.id, "kind": "task_link", "source": link.source_id, "target": link.target_id,
+                      "type": link.link_type, "target_type": link.link_target_type})
+    note_links = db.query(NoteLink.id, NoteLink.source_id, NoteLink.target_id, NoteLink.link_type) \
+        .filter(NoteLink.canvas_id == canvas_id).all()
+    for link in note_links:
+        src.append(node(link.source_id, "note"))
+        dst.append(node(link.target_id, "note"))
+        edges.append({"id": link.id, "kind": "note_link", "source": link.source_id, "target": link.target_id,
+                      "type": link.link_type})
+    return GraphIndex(node_ids, node_types, np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64), edges)
+
+
+_indexes: "OrderedDict[str, tuple]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_index(db: Session, canvas_id: str) -> GraphIndex:
+    """Индекс холста из памяти воркера или заново, если связи менялись"""
+    version, _ = http_cache.read_versions(db.get_bind(), LINK_TABLES, canvas_id)
+    with _lock:
+        cached = _indexes.get(canvas_id)
+        if cached and cached[0] == version:
+            _indexes.move_to_end(canvas_id)
+            return cached[1]
+
+    graph = build_index(db, canvas_id)
+    with _lock:
+        _indexes[canvas_id] = (version, graph)
+        _indexes.move_to_end(canvas_id)
+        while len(_indexes) > MAX_CANVASES:
+            _indexes.popitem(last=False)
+    return graph
+
+
+def _node_details(db: Session, canvas_id: str, node_ids: List[str]) -> Dict[str, Dict]:
+    """Заголовки и координаты узлов в формате /api/graph; удаленных карточек в ответе нет"""
+    details = {}
+    for model, node_type in ((Task, "card"), (Note, "note")):
+        for start in range(0, len(node_ids), 1000):
+            # Только по первичному ключу: с условием на canvas_id планировщик может выбрать индекс холста
+            rows = db.query(model.id, model.canvas_id, model.title, model.x, model.y).filter(
+                model.id.in_(node_ids[start:start + 1000])).all()
+            for row in rows:
+                if row.canvas_id == canvas_id:
+                    details[row.id] = {"id": row.id, "label": row.title, "type": node_type, "x": row.x,
+                                       "y": row.y}
+    return details
+
+
+def _response(db: Session, canvas_id: str, graph: GraphIndex, node_ids: List[str], edge_ids) -> Dict:
+    details = _node_details(db, canvas_id, node_ids)
+    return {
+        "nodes": [details[node_id] for node_id in node_ids if node_id in details],
+        "edges": [graph.edges[i] for i in edge_ids
+                  if graph.edges[i]["source"] in details and graph.edges[i]["target"] in details],
+    }
+
+
+def _check_direction(direction: str) -> None:
+    if direction not in DIRECTIONS:
+        raise GraphQueryError(f"Неизвестное направление: {direction}")
+
+
+def neighbourhood(db: Session, canvas_id: str, node_id: str, depth: int = 1, direction: str = "both") -> Dict:
+    _check_direction(direction)
+    depth = max(0, min(depth, MAX_DEPTH))
+    graph = get_index(db, canvas_id)
+    if node_id not in graph.index:
+        # Узел без связей: окрестность - он сам
+        return {**_response(db, canvas_id, graph, [node_id], []), "truncated": False}
+    nodes, truncated = graph.neighbourhood(graph.index[node_id], depth, direction)
+    result = _response(db, canvas_id, graph, [graph.node_ids[i] for i in nodes], graph.subgraph_edges(nodes))
+    result["truncated"] = truncated
+    return result
+
+
+def shortest_path(db: Session, canvas_id: str, source_id: str, target_id: str, direction: str = "both",
+                  max_depth: int = 50) -> Optional[Dict]:
+    _check_direction(direction)
+    graph = get_index(db, canvas_id)
+    if source_id == target_id:
+        return {**_response(db, canvas_id, graph, [source_id], []), "length": 0}
+    if source_id not in graph.index or target_id not in graph.index:
+        return None
+    found = graph.shortest_path(graph.index[source_id], graph.index[target_id], direction, max_depth)
+    if found is None:
+        return None
+    nodes, edges = found
+    return {**_response(db, canvas_id, graph, [graph.node_ids[i] for i in nodes], edges), "length": len(edges)}
+
+
+def _canvas_ids(db: Session, canvas_id: str) -> List[str]:
+    return [row.id for model in (Task, Note) for row in db.query(model.id).filter(model.canvas_id == canvas_id)]
+
+
+def components(db: Session, canvas_id: str, min_size: int = 2, limit: int = 100) -> Dict:
+    """
+    Компоненты связности по убыванию размера; карточки без связей - компоненты
+    из одного узла. Концы связей, карточек которых уже нет, не считаются.
+    """
+    graph = get_index(db, canvas_id)
+    existing = _canvas_ids(db, canvas_id)
+    present = set(existing)
+    alive = np.fromiter((node_id in present for node_id in graph.node_ids), dtype=bool, count=len(graph))
+    labels = graph.components(alive)[alive]
+    linked_ids = [graph.node_ids[i] for i in np.flatnonzero(alive)]
+    unlinked = [node_id for node_id in existing if node_id not in graph.index]
+
+    unique, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    order = np.argsort(-sizes, kind="stable")
+    members = np.argsort(inverse, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    # Номера живых узлов среди alive: метка ребра - компонента его начала
+    position = np.cumsum(alive) - 1
+    keep = graph.live_edges(alive)
+    edge_counts = np.bincount(inverse[position[graph.src[keep]]], minlength=len(unique))
+
+    result = []
+    for component in order:
+        if sizes[component] < max(min_size, 1) or len(result) >= limit:
+            break
+        nodes = members[starts[component]:starts[component + 1]]
+        result.append({
+            "size": int(sizes[component]),
+            "node_ids": [linked_ids[i] for i in nodes],
+            "edge_count": int(edge_counts[component]),
+        })
+    # Карточки без связей идут последними, по одной
+    if min_size <= 1:
+        for node_id in unlinked[:max(limit - len(result), 0)]:
+            result.append({"size": 1, "node_ids": [node_id], "edge_count": 0})
+    return {"total": int(len(unique)) + len(unlinked), "linked_nodes": len(linked_ids), "components": result}
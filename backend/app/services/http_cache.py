@@ -0,0 +1,275 @@
+"""
+HTTP-кэширование читающих эндпоинтов: ETag/Last-Modified по версиям таблиц.
+
+Каждая запись в отслеживаемые таблицы увеличивает счетчик в change_versions
+для пары (таблица, холст) в той же транзакции. Middleware по этим счетчикам
+вычисляет слабый ETag и отвечает 304 на условный GET, не выполняя обработчик
+и не загружая ORM-объекты - нужен только один маленький Core-запрос.
+
+Пока шина событий подключена, прочитанные версии запоминаются в воркере
+(VersionMemo) и сбрасываются событием versions, которое bump_versions
+публикует в той же транзакции: повторные проверки ETag, индексы размещения,
+обзора и графа обходятся без запроса к change_versions.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import Connection, Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+
+from ..models import DEFAULT_CANVAS_ID, Canvas, ChangeVersion
+from .event_bus import bus
+
+# Таблицы, изменения которых отслеживаются
+TRACKED_TABLES = ("tasks", "notes", "task_links", "note_links", "files")
+
+# Читающие эндпоинты и таблицы, от которых зависит их ответ
+CACHED_ROUTES: Dict[str, Tuple[str, ...]] = {
+    "/api/cards": ("tasks",),
+    "/api/notes": ("notes",),
+    "/api/task-links": ("task_links",),
+    "/api/note-links": ("note_links",),
+    "/api/search": ("tasks", "notes", "files"),
+    "/api/graph": ("tasks", "notes", "task_links", "note_links"),
+    "/api/graph/neighbourhood": ("tasks", "notes", "task_links", "note_links"),
+    "/api/graph/path": ("tasks", "notes", "task_links", "note_links"),
+    "/api/graph/components": ("task_links", "note_links"),
+    "/api/canvas/clusters": ("tasks", "notes"),
+}
+
+# max-age для Cache-Control; 0 - клиент и nginx обязаны перепроверять ответ по ETag
+CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+TOPIC = "versions"
+
+Version = Tuple[int, datetime]
+
+
+class VersionMemo:
+    """
+    Версии пар (таблица, холст), известные воркеру.
+
+    Сброс увеличивает поколение: значение, прочитанное из БД до сброса, уже
+    устарело и не запоминается (put с поколением начала чтения).
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple[str, str], Version]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tables: Iterable[str], canvas_id: str) -> Optional[List[Version]]:
+        with self._lock:
+            values = [self._data.get((table_name, canvas_id)) for table_name in tables]
+            if None in values:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return values
+
+    def put(self, generation: int, canvas_id: str, versions: Dict[str, Version]) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+            for table_name, version in versions.items():
+                self._data[(table_name, canvas_id)] = version
+                self._data.move_to_end((table_name, canvas_id))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, keys: Iterable[Tuple[str, str]]) -> None:
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+versions_memo = VersionMemo()
+
+
+def _apply_items(items: List[str]) -> None:
+    keys = []
+    for item in items:
+        table_name, _, canvas_id = item.partition(":")
+        keys.append((table_name, canvas_id))
+    versions_memo.invalidate(keys)
+
+
+bus.subscribe(TOPIC, _apply_items)
+bus.on_resync(versions_memo.clear)
+
+
+def bump_versions(connection: Connection, keys: Iterable[Tuple[str, str]]) -> None:
+    """Увеличить версии для пар (таблица, холст) в текущей транзакции"""
+    keys = sorted(set(keys))  # фиксированный порядок - без взаимных блокировок
+    if not keys:
+        return
+
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return
+
+    table = ChangeVersion.__table__
+    stmt = insert(table).values([
+        {"table_name": table_name, "canvas_id": canvas_id, "version": 1}
+        for table_name, canvas_id in keys
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.table_name, table.c.canvas_id],
+        set_={"version": table.c.version + 1, "changed_at": stmt.excluded.changed_at},
+    )
+    connection.execute(stmt)
+    # Здесь - сразу, в остальных воркерах (и повторно здесь) - событием после коммита
+    versions_memo.invalidate(keys)
+    bus.publish(connection, TOPIC, [f"{table_name}:{canvas_id}" for table_name, canvas_id in keys])
+
+
+def _changed_keys(session) -> Set[Tuple[str, str]]:
+    keys = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Canvas):
+            # Удаление холста каскадом затрагивает все его таблицы
+            keys.update((table_name, obj.id) for table_name in TRACKED_TABLES)
+            continue
+        table_name = getattr(obj, "__tablename__", None)
+        if table_name in TRACKED_TABLES:
+            keys.add((table_name, obj.canvas_id or DEFAULT_CANVAS_ID))
+    return keys
+
+
+def track_changes(session_factory) -> None:
+    """Подписать фабрику сессий на учет версий при каждом flush"""
+
+    @event.listens_for(session_factory, "after_flush")
+    def _bump_after_flush(session, flush_context):
+        keys = _changed_keys(session)
+        if keys:
+            bump_versions(session.connection(), keys)
+
+
+def read_versions(engine: Engine, tables: Iterable[str], canvas_id: str) -> Tuple[int, datetime]:
+    """Вернуть суммарную версию и время последнего изменения таблиц холста"""
+    tables = list(tables)
+    # Без шины о чужих записях не узнать - только запрос
+    memoized = bus.connected
+    if memoized:
+        cached = versions_memo.get(tables, canvas_id)
+        if cached is not None:
+            return _combine(cached)
+        generation = versions_memo.generation
+
+    table = ChangeVersion.__table__
+    stmt = select(table.c.table_name, table.c.version, table.c.changed_at).where(
+        table.c.canvas_id == canvas_id, table.c.table_name.in_(tables)
+    )
+    with engine.connect() as connection:
+        rows = connection.execute(stmt).all()
+
+    # Таблицы без строки в change_versions еще не менялись
+    versions: Dict[str, Version] = {table_name: (0, _EPOCH) for table_name in tables}
+    for row in rows:
+        row_changed_at = row.changed_at
+        if row_changed_at.tzinfo is None:
+            row_changed_at = row_changed_at.replace(tzinfo=timezone.utc)
+        versions[row.table_name] = (row.version, row_changed_at)
+    if memoized:
+        versions_memo.put(generation, canvas_id, versions)
+    return _combine(versions.values())
+
+
+def _combine(versions: Iterable[Version]) -> Tuple[int, datetime]:
+    version = 0
+    changed_at = _EPOCH
+    for table_version, table_changed_at in versions:
+        version += table_version
+        changed_at = max(changed_at, table_changed_at)
+    return version, changed_at
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Слабое сравнение: W/ префикс игнорируется (nginx gzip тоже ослабляет ETag)
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def _not_modified_since(header: Optional[str], changed_at: datetime) -> bool:
+    if not header:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return changed_at.replace(microsecond=0) <= since
+
+
+class HTTPCacheMiddleware(BaseHTTPMiddleware):
+    """ETag, Last-Modified и ответы 304 для CACHED_ROUTES"""
+
+    def __init__(self, app, engine: Engine, routes: Dict[str, Tuple[str, ...]] = CACHED_ROUTES):
+        super().__init__(app)
+        self.engine = engine
+        self.routes = routes
+
+    async def dispatch(self, request: Request, call_next):
+        tables = self.routes.get(request.url.path)
+        if tables is None or request.method not in ("GET", "HEAD"):
+            return await call_next(request)
+
+        canvas_id = request.query_params.get("canvas_id", DEFAULT_CANVAS_ID)
+        version, changed_at = await run_in_threadpool(read_versions, self.engine, tables, canvas_id)
+
+        digest = hashlib.sha1(
+            f"{request.url.path}?{request.url.query}:{version}:{changed_at.timestamp()}".encode()
+        ).hexdigest()[:20]
+        etag = f'W/"{digest}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(changed_at, usegmt=True),
+            "Cache-Control": f"public, max-age={CACHE_MAX_AGE}, must-revalidate",
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, etag)
+        else:
+            not_modified = _not_modified_since(request.headers.get("if-modified-since"), changed_at)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+        response = await call_next(request)
+        if response.status_code == 200:
+            for name, value in headers.items():
+                response.headers.setdefault(name, value)
+        return response
@@ -0,0 +1,345 @@
+"""
+Инструментирование запросов: число SQL-запросов, время в БД и сериализации.
+
+- события движка SQLAlchemy считают запросы и их время для текущего HTTP-запроса;
+- медленные запросы пишутся в лог с параметрами и планом EXPLAIN (Postgres);
+- InstrumentedRoute отделяет время обработчика от времени сериализации ответа;
+- метрики по маршрутам отдаются в текстовом формате Prometheus через render_metrics();
+- каждый запрос получает request ID, спаны (services/tracing) и строку журнала доступа.
+
+Метрики собираются в пределах процесса: при нескольких воркерах Prometheus
+опрашивает каждый из них (или суммирует через агрегирующий прокси).
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+from . import tracing
+
+logger = logging.getLogger("holst.sql")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+
+# Границы гистограммы длительности запросов, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+    endpoint_time: float = 0.0
+    handler_time: float = 0.0
+
+    @property
+    def serialize_time(self) -> float:
+        return max(0.0, self.handler_time - self.endpoint_time)
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("holst_request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+class _RouteMetrics:
+    __slots__ = ("requests", "duration", "queries", "db_time", "serialize_time", "buckets")
+
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+def counter_lines(prefix: str, stats: Dict[str, Any], kinds: Dict[str, str]) -> List[str]:
+    """
+    Значения stats в текстовом формате Prometheus. kinds - ключи stats и их
+    типы (counter или gauge); метрика называется prefix_ключ, у counter - с _total.
+    """
+    lines = []
+    for key, kind in kinds.items():
+        name = f"{prefix}_{key}_total" if kind == "counter" else f"{prefix}_{key}"
+        value = stats[key]
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {int(value) if isinstance(value, bool) else value}")
+    return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[Tuple[str, str, int], _RouteMetrics] = {}
+        self.slow_queries = 0
+        self.untracked_queries = 0
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def observe(self, method: str, route: str, status: int, duration: float, stats: RequestStats) -> None:
+        with self._lock:
+            metrics = self._routes.get((method, route, status))
+            if metrics is None:
+                metrics = self._routes[(method, route, status)] = _RouteMetrics()
+            metrics.requests += 1
+            metrics.duration += duration
+            metrics.queries += stats.queries
+            metrics.db_time += stats.db_time
+            metrics.serialize_time += stats.serialize_time
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    metrics.buckets[i] += 1
+
+    def add_collector(self, collector: Callable[[], List[str]]) -> None:
+        """Подключить дополнительные строки метрик (кэши и т.п.)"""
+        self._collectors.append(collector)
+
+    def add_counters(self, prefix: str, stats: Callable[[], Dict[str, Any]], kinds: Dict[str, str]) -> None:
+        """Подключить значения словаря stats() как метрики (см. counter_lines)"""
+        self.add_collector(lambda: counter_lines(prefix, stats(), kinds))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            slow_queries = self.slow_queries
+            untracked_queries = self.untracked_queries
+
+        def series(name, kind, help_text, value_of):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (method, route, status), metrics in routes:
+                lines.append(f'{name}{{method="{method}",route="{route}",status="{status}"}} {value_of(metrics)}')
+
+        series("holst_http_requests_total", "counter", "HTTP requests", lambda m: m.requests)
+        series("holst_db_queries_total", "counter", "SQL statements issued while serving requests", lambda m: m.queries)
+        series("holst_db_seconds_total", "counter", "Time spent in SQL statements", lambda m: round(m.db_time, 6))
+        series("holst_serialize_seconds_total", "counter", "Time spent encoding responses",
+               lambda m: round(m.serialize_time, 6))
+
+        lines.append("# HELP holst_http_request_duration_seconds HTTP request latency")
+        lines.append("# TYPE holst_http_request_duration_seconds histogram")
+        for (method, route, status), metrics in routes:
+            labels = f'method="{method}",route="{route}",status="{status}"'
+            for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                lines.append(f'holst_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'holst_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics.requests}')
+            lines.append(f"holst_http_request_duration_seconds_sum{{{labels}}} {round(metrics.duration, 6)}")
+            lines.append(f"holst_http_request_duration_seconds_count{{{labels}}} {metrics.requests}")
+
+        lines.append("# HELP holst_db_slow_queries_total SQL statements slower than SLOW_QUERY_MS")
+        lines.append("# TYPE holst_db_slow_queries_total counter")
+        lines.append(f"holst_db_slow_queries_total {slow_queries}")
+        lines.append("# HELP holst_db_background_queries_total SQL statements outside HTTP requests")
+        lines.append("# TYPE holst_db_background_queries_total counter")
+        lines.append(f"holst_db_background_queries_total {untracked_queries}")
+
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+# SQL
+
+def _explain(cursor, statement: str, parameters) -> Optional[str]:
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute("EXPLAIN " + statement, parameters)
+        return "\n".join(row[0] for row in explain_cursor.fetchall())
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        explain_cursor.close()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Подписать движок на подсчет запросов и журнал медленных запросов"""
+    explain = SLOW_QUERY_EXPLAIN and engine.dialect.name == "postgresql"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("holst_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["holst_query_start"].pop()
+        tracing.record_statement(statement, duration, conn.dialect.name, executemany)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += duration
+        else:
+            with metrics._lock:
+                metrics.untracked_queries += 1
+
+        if duration * 1000 >= SLOW_QUERY_MS:
+            with metrics._lock:
+                metrics.slow_queries += 1
+            plan = _explain(cursor, statement, parameters) if explain and not executemany else None
+            logger.warning(
+                "Slow query %.1f ms: %s\nparameters: %r%s",
+                duration * 1000, statement, parameters, f"\nplan:\n{plan}" if plan else "",
+            )
+
+
+# HTTP
+
+class InstrumentedRoute(APIRoute):
+    """Маршрут, который отдельно замеряет работу обработчика и сериализацию ответа"""
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if not getattr(endpoint, "__holst_timed__", False):
+            self.dependant.call = _timed_endpoint(endpoint)
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request):
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                stats = _current.get()
+                if stats is not None:
+                    stats.handler_time += time.perf_counter() - started
+
+        return timed_handler
+
+
+def _timed_endpoint(endpoint):
+    name = f"handler {endpoint.__name__}"
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracing.span(name):
+                    return await endpoint(*args, **kwargs)
+            finally:
+                _add_endpoint_time(time.perf_counter() - started)
+    else:
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracing.span(name):
+                    return endpoint(*args, **kwargs)
+            finally:
+                _add_endpoint_time(time.perf_counter() - started)
+    timed.__holst_timed__ = True
+    return timed
+
+
+def _add_endpoint_time(duration: float) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.endpoint_time += duration
+
+
+@contextmanager
+def serializing():
+    """Сериализация внутри обработчика (services/serialization) учитывается в serialize, а не в endpoint"""
+    started = time.perf_counter()
+    try:
+        with tracing.span("serialize"):
+            yield
+    finally:
+        _add_endpoint_time(started - time.perf_counter())
+
+
+class InstrumentationMiddleware(BaseHTTPMiddleware):
+    """
+    Собирает RequestStats на время запроса и записывает их в реестр по шаблону
+    маршрута; ведет корневой спан и пишет строку журнала доступа, когда ответ
+    отдан целиком.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        stats = RequestStats()
+        token = _current.set(stats)
+        request_id, trace_id, parent_id, sampled = tracing.request_context(request.headers)
+        root = tracing.start_span(f"{request.method} {request.url.path}", trace_id=trace_id, parent_id=parent_id,
+                                  kind="server") if sampled else None
+        span_token = tracing.set_current(root)
+        started = time.perf_counter()
+        status = 500
+        response = None
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["Server-Timing"] = (
+                f"db;dur={stats.db_time * 1000:.1f};desc=\"{stats.queries} queries\", "
+                f"serialize;dur={stats.serialize_time * 1000:.1f}"
+            )
+            response.headers["X-Request-ID"] = request_id
+            return response
+        finally:
+            route = request.scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            handled = time.perf_counter() - started
+            metrics.observe(request.method, path, status, handled, stats)
+            tracing.reset_current(span_token)
+            _current.reset(token)
+            entry = {
+                "request_id": request_id,
+                "trace_id": trace_id,
+                "method": request.method,
+                "path": request.url.path,
+                "route": path,
+                "status": status,
+                "handler_ms": round(handled * 1000, 2),
+                "db_ms": round(stats.db_time * 1000, 2),
+                "queries": stats.queries,
+                "serialize_ms": round(stats.serialize_time * 1000, 2),
+                "request_bytes": int(request.headers.get("content-length") or 0),
+                "client": request.headers.get("x-real-ip") or (request.client.host if request.client else None),
+            }
+            if root is not None:
+                root.name = f"{request.method} {path}"
+                root.attributes.update({"http.method": request.method, "http.route": path,
+                                        "http.target": request.url.path, "http.status_code": status,
+                                        "request_id": request_id, "db.queries": stats.queries})
+            if response is None:
+                _finish(entry, root, started, 0)
+            else:
+                response.body_iterator = _counted(response.body_iterator, entry, root, started)
+
+
+async def _counted(body, entry, root, started):
+    """Тело ответа с подсчетом байт; журнал и спан закрываются после последнего куска"""
+    size = 0
+    try:
+        async for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        _finish(entry, root, started, size)
+
+
+def _finish(entry, root, started, size: int) -> None:
+    entry["response_bytes"] = size
+    entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    tracing.log_access(entry)
+    if root is not None:
+        root.attributes.update({"http.request_content_length": entry["request_bytes"],
+                                "http.response_content_length": size})
+        tracing.end_span(root)
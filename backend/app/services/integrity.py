@@ -0,0 +1,290 @@
+"""
+Ссылочная целостность связей, вложений и журнала событий.
+
+У TaskLink.target_id нет внешнего ключа: в зависимости от link_target_type он
+указывает на задачу или на заметку. В Postgres это проверяют триггеры (см.
+models/task_link.py), но строки, оставшиеся от старых версий, удаления в SQLite
+и вложения удаленных карточек разбирает чистильщик:
+
+- link_target_type исправляется, если цель нашлась в другой таблице;
+- связи без источника или цели на том же холсте удаляются;
+- вложения без карточки удаляются вместе с файлом в media и извлеченным текстом;
+- события удаленных карточек старше EVENT_RETENTION удаляются;
+- журнал операций и надгробия синхронизации (services/sync) старше SYNC_RETENTION удаляются;
+- файлы в media без записи в files старше MEDIA_GRACE удаляются.
+
+Все проверки - anti-join (NOT EXISTS) одним запросом на таблицу; удаление идет
+пачками по BATCH_SIZE строк в отдельных транзакциях, чтобы не держать долгие
+блокировки. Запуск: python -m app.services.integrity [--dry-run], POST
+/api/admin/integrity/sweep или фоновый поток с INTEGRITY_SWEEP_INTERVAL.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import and_, delete, exists, func, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ..models import EventLog, File, FileContent, Note, NoteLink, SyncOperation, Task, TaskLink, Tombstone
+from . import http_cache
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+EVENT_RETENTION = timedelta(days=int(os.getenv("EVENT_ORPHAN_RETENTION_DAYS", "30")))
+# Клиент, не синхронизировавшийся дольше, загружает холст заново
+SYNC_RETENTION = timedelta(days=int(os.getenv("SYNC_RETENTION_DAYS", "30")))
+# Файл в media появляется раньше записи в files - моложе этого не трогаем
+MEDIA_GRACE = timedelta(hours=1)
+# Период фоновой проверки, с; 0 - только вручную
+SWEEP_INTERVAL = float(os.getenv("INTEGRITY_SWEEP_INTERVAL", "0"))
+# Ключ pg_advisory_lock: из нескольких воркеров проверку выполняет один
+ADVISORY_LOCK_ID = 0x686F6C7374
+
+tasks, notes = Task.__table__, Note.__table__
+task_links, note_links = TaskLink.__table__, NoteLink.__table__
+files, events = File.__table__, EventLog.__table__
+file_contents = FileContent.__table__
+sync_operations, tombstones = SyncOperation.__table__, Tombstone.__table__
+
+
+def _present(target, column, owner):
+    """Строка target с id = column есть на том же холсте, что и строка owner"""
+    return exists().where(target.c.id == column, target.c.canvas_id == owner.c.canvas_id)
+
+
+def _link_target_present():
+    target_type = func.coalesce(task_links.c.link_target_type, "")
+    return or_(and_(target_type == "task", _present(tasks, task_links.c.target_id, task_links)),
+               and_(target_type == "note", _present(notes, task_links.c.target_id, task_links)))
+
+
+def _orphans(now: datetime):
+    """Таблица и условие, по которому строка считается висячей"""
+    return {
+        "task_links": (task_links, or_(~_present(tasks, task_links.c.source_id, task_links),
+                                       ~_link_target_present())),
+        "note_links": (note_links, or_(~_present(notes, note_links.c.source_id, note_links),
+                                       ~_present(notes, note_links.c.target_id, note_links))),
+        # При удалении карточки ORM обнуляет task_id/note_id вложений
+        "files": (files, and_(~_present(tasks, files.c.task_id, files),
+                              ~_present(notes, files.c.note_id, files))),
+        # В SQLite внешние ключи не проверяются и ON DELETE CASCADE не срабатывает
+        "file_contents": (file_contents, ~exists().where(files.c.id == file_contents.c.file_id)),
+        "event_logs": (events, and_(events.c.entity_type.in_(("card", "note")),
+                                    events.c.timestamp < now - EVENT_RETENTION,
+                                    ~_present(tasks, events.c.entity_id, events),
+                                    ~_present(notes, events.c.entity_id, events))),
+        "sync_operations": (sync_operations, sync_operations.c.applied_at < now - SYNC_RETENTION),
+        "tombstones": (tombstones, tombstones.c.deleted_at < now - SYNC_RETENTION),
+    }
+
+
+def _retypes():
+    """Новое значение link_target_type и условие: цель нашлась только в другой таблице"""
+    target_type = func.coalesce(task_links.c.link_target_type, "")
+    in_tasks = _present(tasks, task_links.c.target_id, task_links)
+    in_notes = _present(notes, task_links.c.target_id, task_links)
+    return {
+        "note": and_(target_type != "note", ~in_tasks, in_notes),
+        "task": and_(target_type != "task", in_tasks, ~in_notes),
+    }
+
+
+def _scoped(table, condition, canvas_id: Optional[str]):
+    return and_(table.c.canvas_id == canvas_id, condition) if canvas_id else condition
+
+
+def scan(engine: Engine, canvas_id: Optional[str] = None) -> Dict[str, int]:
+    """Число строк, которые исправит или удалит sweep, без изменений"""
+    now = datetime.now(timezone.utc)
+    report = {}
+    with engine.connect() as connection:
+        for target_type, condition in _retypes().items():
+            report[f"retype_to_{target_type}"] = connection.execute(
+                select(func.count()).select_from(task_links).where(_scoped(task_links, condition, canvas_id))
+            ).scalar()
+        for name, (table, condition) in _orphans(now).items():
+            report[name] = connection.execute(
+                select(func.count()).select_from(table).where(_scoped(table, condition, canvas_id))
+            ).scalar()
+    return report
+
+
+def _repair_targets(engine: Engine, canvas_id: Optional[str]) -> Dict[str, int]:
+    report = {}
+    for target_type, condition in _retypes().items():
+        condition = _scoped(task_links, condition, canvas_id)
+        with engine.begin() as connection:
+            canvases = connection.execute(select(task_links.c.canvas_id).where(condition).distinct()).scalars().all()
+            if not canvases:
+                report[f"retype_to_{target_type}"] = 0
+                continue
+            result = connection.execute(update(task_links).where(condition).values(link_target_type=target_type))
+            http_cache.bump_versions(connection, [("task_links", canvas) for canvas in canvases])
+        report[f"retype_to_{target_type}"] = result.rowcount
+    return report
+
+
+def _delete_batches(engine: Engine, table, condition, batch_size: int, *columns) -> Iterator[list]:
+    """Удалять строки по условию пачками; каждая отданная пачка уже закоммичена"""
+    key = next(iter(table.primary_key.columns))
+    last_id = None
+    while True:
+        with engine.begin() as connection:
+            # Каждая пачка продолжает просмотр с последнего id, а не с начала таблицы
+            query = select(key.label("id"), table.c.canvas_id, *columns).where(condition)
+            if last_id is not None:
+                query = query.where(key > last_id)
+            rows = connection.execute(query.order_by(key).limit(batch_size)).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            connection.execute(delete(table).where(key.in_([row.id for row in rows])))
+            if table.name in http_cache.TRACKED_TABLES:
+                http_cache.bump_versions(connection, [(table.name, row.canvas_id) for row in rows])
+        yield rows
+        if len(rows) < batch_size:
+            return
+
+
+def _remove_media(media_dir: Path, filepath: str) -> None:
+    path = media_dir / Path(filepath).name
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Не удалось удалить вложение %s: %s", path, e)
+
+
+def _sweep_media_dir(engine: Engine, media_dir: Path, now: datetime) -> int:
+    """Файлы в media, на которые не ссылается ни одна запись files"""
+    with engine.connect() as connection:
+        referenced = {Path(filepath).name for filepath in connection.execute(select(files.c.filepath)).scalars()}
+    cutoff = (now - MEDIA_GRACE).timestamp()
+    removed = 0
+    for path in media_dir.iterdir():
+        if path.is_file() and path.name not in referenced and path.stat().st_mtime < cutoff:
+            _remove_media(media_dir, path.name)
+            removed += 1
+    return removed
+
+
+def sweep(engine: Engine, media_dir: Optional[Path] = None, canvas_id: Optional[str] = None,
+          batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Исправить типы целей связей и удалить висячие строки; вернуть число затронутых строк"""
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    report = _repair_targets(engine, canvas_id)
+    for name, (table, condition) in _orphans(now).items():
+        columns = (table.c.filepath,) if table is files else ()
+        report[name] = 0
+        for rows in _delete_batches(engine, table, _scoped(table, condition, canvas_id), batch_size, *columns):
+            report[name] += len(rows)
+            if table is files and media_dir is not None:
+                for row in rows:
+                    _remove_media(media_dir, row.filepath)
+    if media_dir is not None and canvas_id is None and media_dir.is_dir():
+        report["media_files"] = _sweep_media_dir(engine, media_dir, now)
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+def delete_links(db: Session, model, entity_ids: Iterable[str], canvas_id: str) -> None:
+    """
+    Удалить связи задач или заметок в их транзакции, до удаления самих строк.
+
+    Иначе ORM пытается обнулить source_id связей (NOT NULL), а связи, где они
+    цель, остаются висеть в /api/graph до прохода чистильщика.
+    """
+    entity_ids = list(entity_ids)
+    if model is Task:
+        deletes = [(TaskLink, or_(TaskLink.source_id.in_(entity_ids),
+                                  and_(TaskLink.target_id.in_(entity_ids), TaskLink.link_target_type == "task")))]
+    else:
+        deletes = [(TaskLink, and_(TaskLink.target_id.in_(entity_ids), TaskLink.link_target_type == "note")),
+                   (NoteLink, or_(NoteLink.source_id.in_(entity_ids), NoteLink.target_id.in_(entity_ids)))]
+    changed = []
+    for link_model, condition in deletes:
+        count = db.query(link_model).filter(link_model.canvas_id == canvas_id, condition) \
+            .delete(synchronize_session=False)
+        if count:
+            changed.append((link_model.__tablename__, canvas_id))
+    http_cache.bump_versions(db.connection(), changed)
+
+
+class IntegritySweeper:
+    """Фоновый поток, раз в interval секунд вызывающий sweep"""
+
+    def __init__(self, engine: Engine, media_dir: Optional[Path] = None, interval: float = SWEEP_INTERVAL):
+        self.engine = engine
+        self.media_dir = media_dir
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="integrity-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.run_once()
+                if report and any(value for key, value in report.items() if key != "duration_ms"):
+                    logger.info("Integrity sweep: %s", report)
+            except Exception as e:
+                logger.warning("Integrity sweep failed: %s", e)
+
+    def run_once(self) -> Optional[Dict[str, int]]:
+        """Один проход; None, если его уже выполняет другой воркер"""
+        if self.engine.dialect.name != "postgresql":
+            return sweep(self.engine, self.media_dir)
+        with self.engine.connect() as connection:
+            if not connection.execute(select(func.pg_try_advisory_lock(ADVISORY_LOCK_ID))).scalar():
+                return None
+            connection.commit()  # блокировка сессионная, транзакцию открытой не держим
+            try:
+                return sweep(self.engine, self.media_dir)
+            finally:
+                connection.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_ID)))
+                connection.commit()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="app.services.integrity", description="Проверка ссылочной целостности")
+    parser.add_argument("--canvas", help="только этот холст")
+    parser.add_argument("--media-dir", default="media")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать")
+    args = parser.parse_args(argv)
+
+    from ..database import engine
+
+    if args.dry_run:
+        report = scan(engine, args.canvas)
+    else:
+        report = sweep(engine, Path(args.media_dir), args.canvas, args.batch_size)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
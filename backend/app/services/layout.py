@@ -0,0 +1,503 @@
+"""
+Автоматическая раскладка карточек холста на сервере.
+
+- layered - задачи по слоям зависимостей TaskLink (упрощенный Sugiyama): слой
+  узла - длина самого длинного пути от истоков, порядок внутри слоя -
+  барицентры соседей;
+- tree - дерево подзадач по Task.parent_id;
+- force - силовая раскладка заметок по NoteLink (Fruchterman-Reingold).
+  Отталкивание считается на сетке: пары из соседних ячеек - точно, дальние
+  ячейки - сверткой плотности с ядром через FFT. Итерация стоит
+  O(n + G² log G) вместо O(n²), поэтому раскладка тянет 10k+ узлов.
+
+Координаты считаются векторно в numpy и записываются одним UPDATE на таблицу.
+Раскладку можно ограничить поддеревом/компонентой одной карточки (root_id).
+"""
+import functools
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, text, update
+from sqlalchemy.orm import Session
+
+from ..models import Note, NoteLink, Task, TaskLink
+from . import entity_cache, http_cache
+from .write_coalescer import coalescer, position_seq
+
+ALGORITHMS = ("layered", "tree", "force")
+DIRECTIONS = ("LR", "TB")
+
+# Модель, карточки которой раскладывает алгоритм
+MODELS = {"layered": Task, "tree": Task, "force": Note}
+
+# Зазор между карточками, px
+GAP = 80
+
+# Связи, у которых источник должен стоять после цели ("A depends_on B" - B раньше)
+REVERSED_LINK_TYPES = {"depends_on", "follows"}
+
+# Итераций барицентрической сортировки слоев
+ORDERING_SWEEPS = 8
+
+# До скольких узлов отталкивание считается точно, O(n²)
+EXACT_REPULSION_LIMIT = 1000
+# Среднее число узлов в ячейке сетки приближенного отталкивания
+CELL_OCCUPANCY = 4
+# Предел сетки по стороне (FFT на (2G)²)
+MAX_GRID_CELLS = 256
+# Своя ячейка и соседи "вперед": вместе с обратным направлением покрывают окрестность 3x3
+_FORWARD_CELLS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+FORCE_ITERATIONS = 100
+GRAVITY = 0.05
+
+
+class LayoutError(ValueError):
+    pass
+
+
+class Graph:
+    """Карточки одной таблицы и ребра между ними в виде массивов индексов"""
+
+    def __init__(self, ids: List[str], xy: np.ndarray, size: np.ndarray, src: np.ndarray, dst: np.ndarray):
+        self.ids = ids
+        self.xy = xy  # левый верхний угол
+        self.size = size
+        self.src = src
+        self.dst = dst
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, rows, edges) -> "Graph":
+        ids = [row.id for row in rows]
+        index = {entity_id: i for i, entity_id in enumerate(ids)}
+        xy = np.array([(row.x or 0, row.y or 0) for row in rows], dtype=float).reshape(-1, 2)
+        size = np.array([(row.width or 300, row.height or 200) for row in rows], dtype=float).reshape(-1, 2)
+        pairs = {(index[a], index[b]) for a, b in edges if a in index and b in index and a != b}
+        pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        return cls(ids, xy, size, pairs[:, 0], pairs[:, 1])
+
+    def take(self, keep: np.ndarray) -> "Graph":
+        remap = np.full(len(self), -1)
+        remap[keep] = np.arange(int(keep.sum()))
+        edge_keep = keep[self.src] & keep[self.dst]
+        return Graph([entity_id for entity_id, k in zip(self.ids, keep) if k], self.xy[keep], self.size[keep],
+                     remap[self.src[edge_keep]], remap[self.dst[edge_keep]])
+
+    def centers(self) -> np.ndarray:
+        return self.xy + self.size / 2
+
+
+def load_graph(db: Session, canvas_id: str, algorithm: str) -> Graph:
+    model = MODELS[algorithm]
+    columns = [model.id, model.x, model.y, model.width, model.height]
+    if algorithm == "tree":
+        columns.append(Task.parent_id)
+    rows = db.query(*columns).filter(model.canvas_id == canvas_id).order_by(model.id).all()
+
+    if algorithm == "tree":
+        edges = [(row.parent_id, row.id) for row in rows if row.parent_id]
+    elif algorithm == "layered":
+        links = db.query(TaskLink.source_id, TaskLink.target_id, TaskLink.link_type).filter(
+            TaskLink.canvas_id == canvas_id, TaskLink.link_target_type == "task").all()
+        edges = [(link.target_id, link.source_id) if link.link_type in REVERSED_LINK_TYPES
+                 else (link.source_id, link.target_id) for link in links]
+    else:
+        edges = db.query(NoteLink.source_id, NoteLink.target_id).filter(NoteLink.canvas_id == canvas_id).all()
+    return Graph.build(rows, edges)
+
+
+def _gather(offsets: np.ndarray, targets: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Все соседи узлов nodes по CSR (offsets, targets)"""
+    counts = offsets[nodes + 1] - offsets[nodes]
+    starts = np.repeat(offsets[nodes], counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return targets[starts + within]
+
+
+def _csr(n: int, src: np.ndarray, dst: np.ndarray):
+    order = np.argsort(src, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+    return offsets, dst[order]
+
+
+def reachable(graph: Graph, root: int, undirected: bool = False) -> np.ndarray:
+    """Маска узлов, достижимых из root (волнами по всем ребрам сразу)"""
+    src, dst = graph.src, graph.dst
+    if undirected:
+        src, dst = np.concatenate((src, dst)), np.concatenate((dst, src))
+    offsets, targets = _csr(len(graph), src, dst)
+    seen = np.zeros(len(graph), dtype=bool)
+    seen[root] = True
+    frontier = np.array([root])
+    while frontier.size:
+        neighbours = np.unique(_gather(offsets, targets, frontier))
+        frontier = neighbours[~seen[neighbours]]
+        seen[frontier] = True
+    return seen
+
+
+def _rank_within(groups: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Место каждого узла внутри своей группы при сортировке по keys"""
+    order = np.lexsort((keys, groups))
+    sorted_groups = groups[order]
+    starts = np.searchsorted(sorted_groups, sorted_groups)
+    rank = np.empty(len(groups), dtype=np.int64)
+    rank[order] = np.arange(len(groups)) - starts
+    return rank
+
+
+def _stack(groups: np.ndarray, rank: np.ndarray, extent: np.ndarray) -> np.ndarray:
+    """Центры узлов, уложенных внутри групп по rank вплотную с зазором, группа центрирована в 0"""
+    order = np.lexsort((rank, groups))
+    sorted_groups = groups[order]
+    padded = extent[order] + GAP
+    ends = np.cumsum(padded)
+    group_start = np.searchsorted(sorted_groups, sorted_groups)
+    offset_before = ends[group_start] - padded[group_start]
+    within = ends - offset_before - padded
+    totals = np.bincount(sorted_groups, padded) - GAP
+    center = np.empty(len(groups))
+    center[order] = within + extent[order] / 2 - totals[sorted_groups] / 2
+    return center
+
+
+def _levels(level: np.ndarray, extent: np.ndarray) -> np.ndarray:
+    """Центры уровней по главной оси: ширина уровня - самая большая карточка в нем"""
+    widths = np.zeros(level.max() + 1)
+    np.maximum.at(widths, level, extent)
+    starts = np.concatenate(([0.0], np.cumsum(widths + GAP)[:-1]))
+    return starts[level] + widths[level] / 2
+
+
+def _axes(direction: str):
+    if direction not in DIRECTIONS:
+        raise LayoutError(f"Неизвестное направление: {direction}")
+    return (0, 1) if direction == "LR" else (1, 0)
+
+
+def _grid(size: np.ndarray) -> np.ndarray:
+    """Центры карточек, уложенных квадратной сеткой с одинаковыми ячейками"""
+    n = len(size)
+    columns = int(np.ceil(np.sqrt(n)))
+    cell = size.max(axis=0) + GAP
+    index = np.arange(n)
+    return np.stack((index % columns, index // columns), axis=1) * cell + cell / 2
+
+
+def _break_cycles(n: int, src: np.ndarray, dst: np.ndarray):
+    """Развернуть обратные ребра обхода в глубину - после этого граф ациклический"""
+    order = np.argsort(src, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n)))).tolist()
+    targets = dst[order].tolist()
+    state = [0] * n  # 0 - не посещен, 1 - на стеке, 2 - обработан
+    back = []
+    for start in range(n):
+        if state[start]:
+            continue
+        state[start] = 1
+        stack = [(start, offsets[start])]
+        while stack:
+            node, position = stack[-1]
+            if position == offsets[node + 1]:
+                state[node] = 2
+                stack.pop()
+                continue
+            stack[-1] = (node, position + 1)
+            target = targets[position]
+            if state[target] == 1:
+                back.append(position)
+            elif state[target] == 0:
+                state[target] = 1
+                stack.append((target, offsets[target]))
+    reverse = np.zeros(len(src), dtype=bool)
+    reverse[order[back]] = True
+    return np.where(reverse, dst, src), np.where(reverse, src, dst)
+
+
+def _longest_path_layers(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    Слои алгоритмом Кана волнами по ациклическому графу: узел попадает в слой,
+    когда обработаны все его предшественники, то есть номер слоя - длина самого
+    длинного пути до узла.
+    """
+    offsets, targets = _csr(n, src, dst)
+    indegree = np.bincount(dst, minlength=n)
+    layer = np.full(n, -1)
+    frontier = np.flatnonzero(indegree == 0)
+    current = 0
+    while frontier.size:
+        layer[frontier] = current
+        current += 1
+        successors = _gather(offsets, targets, frontier)
+        indegree -= np.bincount(successors, minlength=n)
+        candidates = np.unique(successors)
+        frontier = candidates[indegree[candidates] == 0]
+    return layer
+
+
+def layered_layout(graph: Graph, direction: str = "LR") -> np.ndarray:
+    main, cross = _axes(direction)
+    n = len(graph)
+    centers = np.zeros((n, 2))
+    linked = np.zeros(n, dtype=bool)
+    linked[graph.src] = linked[graph.dst] = True
+
+    if linked.any():
+        part = graph.take(linked)
+        layer = _longest_path_layers(len(part), *_break_cycles(len(part), part.src, part.dst))
+        # Начальный порядок - текущее положение карточек, чтобы раскладка не перемешивала холст
+        rank = _rank_within(layer, part.centers()[:, cross])
+        for sweep in range(ORDERING_SWEEPS):
+            # Четные проходы тянут узел к предшественникам, нечетные - к последователям
+            a, b = (part.src, part.dst) if sweep % 2 == 0 else (part.dst, part.src)
+            total = np.bincount(b, rank[a].astype(float), minlength=len(part))
+            count = np.bincount(b, minlength=len(part))
+            barycenter = np.where(count > 0, total / np.maximum(count, 1), rank)
+            rank = _rank_within(layer, barycenter + rank * 1e-6)
+        part_centers = np.zeros((len(part), 2))
+        part_centers[:, main] = _levels(layer, part.size[:, main])
+        part_centers[:, cross] = _stack(layer, rank, part.size[:, cross])
+        centers[linked] = part_centers
+
+    if (~linked).any():
+        # Карточки без связей - отдельным блоком под графом
+        loose = _grid(graph.size[~linked])
+        if linked.any():
+            left = (centers[linked] - graph.size[linked] / 2)[:, 0].min()
+            bottom = (centers[linked] + graph.size[linked] / 2)[:, 1].max()
+            loose += (left, bottom + 2 * GAP)
+        centers[~linked] = loose
+    return centers
+
+
+def tree_layout(graph: Graph, direction: str = "TB") -> np.ndarray:
+    main, cross = _axes(direction)
+    n = len(graph)
+    parent = np.full(n, -1)
+    parent[graph.dst] = graph.src
+    cross_position = graph.centers()[:, cross]
+
+    # Дети в порядке текущего положения на холсте
+    edge_order = np.lexsort((cross_position[graph.dst], graph.src))
+    offsets, children = _csr(n, graph.src[edge_order], graph.dst[edge_order])
+    children_of = [children[offsets[i]:offsets[i + 1]].tolist() for i in range(n)]
+
+    depth = np.zeros(n, dtype=np.int64)
+    tree_parent = np.full(n, -1)
+    preorder: List[int] = []
+    visited = np.zeros(n, dtype=bool)
+    roots = sorted(np.flatnonzero(parent < 0).tolist(), key=lambda i: cross_position[i])
+    # Узлы в циклах parent_id недостижимы из корней - такой цикл рвется на первом узле
+    for root in roots + sorted(range(n), key=lambda i: cross_position[i]):
+        if visited[root]:
+            continue
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            visited[node] = True
+            preorder.append(node)
+            for child in reversed(children_of[node]):
+                if not visited[child]:
+                    tree_parent[child] = node
+                    depth[child] = depth[node] + 1
+                    stack.append(child)
+    tree_children = [[child for child in children_of[node] if tree_parent[child] == node] for node in range(n)]
+
+    # Ширина поддерева снизу вверх, затем раздача мест сверху вниз
+    extent = graph.size[:, cross]
+    span = extent.copy()
+    children_total = np.zeros(n)
+    for node in reversed(preorder):
+        if tree_children[node]:
+            children_total[node] = sum(span[child] for child in tree_children[node]) \
+                + GAP * (len(tree_children[node]) - 1)
+            span[node] = max(extent[node], children_total[node])
+
+    left = np.zeros(n)
+    cursor = 0.0
+    for node in preorder:
+        if tree_parent[node] < 0:
+            left[node] = cursor
+            cursor += span[node] + GAP
+        start = left[node] + (span[node] - children_total[node]) / 2
+        for child in tree_children[node]:
+            left[child] = start
+            start += span[child] + GAP
+
+    centers = np.zeros((n, 2))
+    centers[:, cross] = left + span / 2
+    if n:
+        centers[:, main] = _levels(depth, graph.size[:, main])
+    return centers
+
+
+@functools.lru_cache(maxsize=16)
+def _far_kernel(cells: int):
+    """FFT ядра отталкивания k²·d/|d|² в единицах ячейки; соседние ячейки считаются точно"""
+    size = 2 * cells
+    offsets = np.arange(size)
+    offsets = np.where(offsets < cells, offsets, offsets - size).astype(float)
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    dist2 = dx ** 2 + dy ** 2
+    near = (np.abs(dx) <= 1) & (np.abs(dy) <= 1)
+    dist2[near] = 1.0
+    kx = np.where(near, 0.0, dx / dist2)
+    ky = np.where(near, 0.0, dy / dist2)
+    return np.fft.rfft2(kx), np.fft.rfft2(ky)
+
+
+def _pair_forces(pos: np.ndarray, a: np.ndarray, b: np.ndarray, k: float, n: int) -> np.ndarray:
+    """Отталкивание по списку неупорядоченных пар: a получает силу, b - противоположную"""
+    dx = pos[a, 0] - pos[b, 0]
+    dy = pos[a, 1] - pos[b, 1]
+    w = (k * k) / np.maximum(dx * dx + dy * dy, (0.01 * k) ** 2)
+    dx *= w
+    dy *= w
+    return np.stack((np.bincount(a, dx, minlength=n) - np.bincount(b, dx, minlength=n),
+                     np.bincount(a, dy, minlength=n) - np.bincount(b, dy, minlength=n)), axis=1)
+
+
+def _repulsion(pos: np.ndarray, k: float) -> np.ndarray:
+    n = len(pos)
+    if n <= EXACT_REPULSION_LIMIT:
+        d = pos[:, None, :] - pos[None, :, :]
+        dist2 = np.maximum((d ** 2).sum(axis=2), (0.01 * k) ** 2)
+        np.fill_diagonal(dist2, np.inf)
+        return (d * (k * k / dist2)[:, :, None]).sum(axis=1)
+
+    # Ячейка не крупнее 2k: в плотных скоплениях иначе ближних пар становится O(n²)
+    low = pos.min(axis=0)
+    extent = max(float((pos.max(axis=0) - low).max()), 1e-6)
+    cells = int(np.clip(max(np.sqrt(n / CELL_OCCUPANCY), extent / (2 * k)), 4, MAX_GRID_CELLS))
+    cell_size = extent / cells * (1 + 1e-9)
+    cell = np.minimum(((pos - low) / cell_size).astype(np.int64), cells - 1)
+    cell_id = cell[:, 0] * cells + cell[:, 1]
+
+    # Дальнее поле: плотность узлов по ячейкам, свернутая с ядром
+    mass = np.zeros((2 * cells, 2 * cells))
+    mass[:cells, :cells] = np.bincount(cell_id, minlength=cells * cells).reshape(cells, cells)
+    kernel_x, kernel_y = _far_kernel(cells)
+    mass_fft = np.fft.rfft2(mass)
+    scale = k * k / cell_size
+    field_x = np.fft.irfft2(mass_fft * kernel_x, s=mass.shape)[:cells, :cells] * scale
+    field_y = np.fft.irfft2(mass_fft * kernel_y, s=mass.shape)[:cells, :cells] * scale
+    force = np.stack((field_x[cell[:, 0], cell[:, 1]], field_y[cell[:, 0], cell[:, 1]]), axis=1)
+
+    # Ближнее поле: точные пары со своей и восемью соседними ячейками. Каждая пара
+    # ячеек берется один раз (своя и четыре соседа "вперед"), сила прикладывается к обоим
+    order = np.argsort(cell_id, kind="stable")
+    sorted_ids = cell_id[order]
+    all_cells = np.arange(cells * cells)
+    cell_start = np.searchsorted(sorted_ids, all_cells)
+    cell_end = np.searchsorted(sorted_ids, all_cells, side="right")
+    a_parts, b_parts = [], []
+    for di, dj in _FORWARD_CELLS:
+        ni, nj = cell[:, 0] + di, cell[:, 1] + dj
+        ok = (ni >= 0) & (ni < cells) & (nj >= 0) & (nj < cells)
+        nodes = np.flatnonzero(ok)
+        neighbour = ni[ok] * cells + nj[ok]
+        counts = cell_end[neighbour] - cell_start[neighbour]
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        a = np.repeat(nodes, counts)
+        b = order[np.repeat(cell_start[neighbour], counts) + within]
+        if (di, dj) == (0, 0):
+            a, b = a[a < b], b[a < b]
+        a_parts.append(a)
+        b_parts.append(b)
+    return force + _pair_forces(pos, np.concatenate(a_parts), np.concatenate(b_parts), k, n)
+
+
+def force_layout(graph: Graph, iterations: int = FORCE_ITERATIONS, seed: int = 0) -> np.ndarray:
+    n = len(graph)
+    if n == 0:
+        return np.zeros((0, 2))
+    rng = np.random.default_rng(seed)
+    k = float(graph.size.max(axis=1).mean()) + GAP  # желаемое расстояние между центрами
+    side = k * np.sqrt(n)
+
+    pos = graph.centers()
+    if np.ptp(pos, axis=0).max() < side / 4:
+        # Карточки лежат кучей (значения по умолчанию) - начинаем со случайного квадрата
+        pos = rng.uniform(0, side, size=(n, 2))
+    else:
+        pos = pos + rng.normal(scale=0.01 * k, size=(n, 2))
+
+    temperature = side / 10
+    cooling = 0.01 ** (1 / max(iterations, 1))
+    for _ in range(iterations):
+        force = _repulsion(pos, k)
+        d = pos[graph.src] - pos[graph.dst]
+        pull = d * (np.sqrt((d ** 2).sum(axis=1)) / k)[:, None]
+        for axis in (0, 1):
+            force[:, axis] -= np.bincount(graph.src, pull[:, axis], minlength=n)
+            force[:, axis] += np.bincount(graph.dst, pull[:, axis], minlength=n)
+        force -= GRAVITY * (pos - pos.mean(axis=0))
+
+        length = np.maximum(np.sqrt((force ** 2).sum(axis=1)), 1e-9)
+        pos += force * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= cooling
+    return pos
+
+
+def apply_positions(db: Session, model, canvas_id: str, ids: List[str], xy: np.ndarray) -> None:
+    """Записать координаты одним запросом и сбросить зависящие от них кэши"""
+    if not ids:
+        return
+    # Положения из буфера перетаскивания старше раскладки
+    coalescer.take(model, ids, fields=("x", "y"))
+    seq = position_seq()
+    table = model.__table__
+    connection = db.connection()
+    xs = xy[:, 0].astype(int).tolist()
+    ys = xy[:, 1].astype(int).tolist()
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(
+            f"UPDATE {table.name} AS t SET x = v.x, y = v.y, pos_seq = :seq, updated_at = now() "
+            "FROM unnest(CAST(:ids AS varchar[]), CAST(:xs AS integer[]), CAST(:ys AS integer[])) AS v(id, x, y) "
+            "WHERE t.id = v.id AND t.canvas_id = :canvas_id"
+        ), {"ids": ids, "xs": xs, "ys": ys, "seq": seq, "canvas_id": canvas_id})
+    else:
+        stmt = update(table).where(table.c.id == bindparam("b_id"), table.c.canvas_id == canvas_id) \
+            .values(x=bindparam("b_x"), y=bindparam("b_y"), pos_seq=seq)
+        connection.execute(stmt, [{"b_id": i, "b_x": x, "b_y": y} for i, x, y in zip(ids, xs, ys)])
+
+    # UPDATE мимо ORM: версии для ETag и кэш карточек обновляются явно
+    http_cache.bump_versions(connection, [(table.name, canvas_id)])
+    entity_cache.mark_changed(db, {(table.name, entity_id) for entity_id in ids})
+
+
+def layout_canvas(db: Session, canvas_id: str, algorithm: str, root_id: Optional[str] = None,
+                  direction: Optional[str] = None, iterations: Optional[int] = None,
+                  dry_run: bool = False) -> Dict:
+    """Разложить холст (или поддерево root_id) и, если не dry_run, сохранить координаты"""
+    if algorithm not in ALGORITHMS:
+        raise LayoutError(f"Неизвестный алгоритм: {algorithm}")
+
+    graph = load_graph(db, canvas_id, algorithm)
+    if root_id is not None:
+        if root_id not in graph.ids:
+            raise LayoutError("Корневая карточка не найдена")
+        graph = graph.take(reachable(graph, graph.ids.index(root_id), undirected=algorithm == "force"))
+
+    if algorithm == "layered":
+        centers = layered_layout(graph, direction or "LR")
+    elif algorithm == "tree":
+        centers = tree_layout(graph, direction or "TB")
+    else:
+        centers = force_layout(graph, iterations or FORCE_ITERATIONS)
+
+    xy = centers - graph.size / 2
+    if len(graph):
+        # Результат встает на место прежнего bounding box
+        xy += graph.xy.min(axis=0) - xy.min(axis=0)
+    xy = np.rint(xy)
+
+    if not dry_run:
+        apply_positions(db, MODELS[algorithm], canvas_id, graph.ids, xy)
+    return {
+        "algorithm": algorithm,
+        "count": len(graph),
+        "positions": [{"id": entity_id, "x": int(x), "y": int(y)} for entity_id, (x, y) in zip(graph.ids, xy)],
+    }
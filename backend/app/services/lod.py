@@ -0,0 +1,267 @@
+"""
+Кластеры карточек для обзора холста при сильном отдалении.
+
+Пирамида квадратных тайлов: на уровне 0 сторона тайла BASE_CELL px, на каждом
+следующем - вдвое больше. Карточка относится к тайлу своего центра. Для каждого
+уровня хранится число карточек в тайлах, сводки (число, bounding box, заголовки
+верхних карточек) считаются лениво и пересчитываются только для тайлов,
+помеченных грязными.
+
+Пирамида живет в памяти воркера. При изменении версии tasks/notes в
+change_versions дочитываются только строки, измененные после прошлой
+синхронизации (по updated_at/created_at), и переносятся между тайлами. Если
+число строк разошлось (удаления), пирамида строится заново; на случай удаления
+и создания между двумя синхронизациями она перестраивается и раз в FULL_RESYNC.
+
+Ответ на крупном уровне содержит десятки тайлов независимо от размера холста.
+"""
+import heapq
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..models import Note, Task
+from . import http_cache
+
+# Сторона тайла нулевого уровня, px холста
+BASE_CELL = 1024
+MAX_LEVEL = 10
+# Желаемый размер тайла на экране, px: по нему из масштаба выбирается уровень
+TARGET_SCREEN_CELL = 160
+# Заголовков в сводке тайла
+TITLES_PER_CLUSTER = 3
+# Запас при дочитывании изменений: транзакция могла начаться раньше, чем закоммитилась
+SYNC_OVERLAP = timedelta(seconds=5)
+FULL_RESYNC = timedelta(minutes=5)
+MAX_CANVASES = 32
+
+KINDS = {"tasks": Task, "notes": Note}
+
+Tile = Tuple[int, int]
+
+
+@dataclass
+class Item:
+    kind: str
+    x: int
+    y: int
+    width: int
+    height: int
+    title: str
+    z_index: int
+
+    @property
+    def tile(self) -> Tile:
+        return (math.floor((self.x + self.width / 2) / BASE_CELL),
+                math.floor((self.y + self.height / 2) / BASE_CELL))
+
+
+@dataclass
+class Summary:
+    count: int = 0
+    tasks: int = 0
+    notes: int = 0
+    bounds: Tuple[float, float, float, float] = (math.inf, math.inf, -math.inf, -math.inf)
+    # (z_index, заголовок, id) верхних карточек тайла
+    top: List[Tuple[int, str, str]] = field(default_factory=list)
+
+    def merge(self, other: "Summary") -> None:
+        self.count += other.count
+        self.tasks += other.tasks
+        self.notes += other.notes
+        self.bounds = (min(self.bounds[0], other.bounds[0]), min(self.bounds[1], other.bounds[1]),
+                       max(self.bounds[2], other.bounds[2]), max(self.bounds[3], other.bounds[3]))
+        self.top = heapq.nlargest(TITLES_PER_CLUSTER, self.top + other.top)
+
+
+class CanvasLOD:
+    """Пирамида тайлов одного холста"""
+
+    def __init__(self):
+        self.items: Dict[str, Item] = {}
+        self.members: Dict[Tile, Set[str]] = {}
+        self.occupancy: List[Dict[Tile, int]] = [{} for _ in range(MAX_LEVEL + 1)]
+        self.summaries: List[Dict[Tile, Summary]] = [{} for _ in range(MAX_LEVEL + 1)]
+        self.dirty: List[Set[Tile]] = [set() for _ in range(MAX_LEVEL + 1)]
+        self.version: Optional[int] = None
+        self.synced_at: Optional[datetime] = None
+        self.built_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+
+    def _count(self, tile: Tile, delta: int) -> None:
+        tx, ty = tile
+        for level in range(MAX_LEVEL + 1):
+            key = (tx >> level, ty >> level)
+            count = self.occupancy[level].get(key, 0) + delta
+            if count:
+                self.occupancy[level][key] = count
+            else:
+                self.occupancy[level].pop(key, None)
+                self.summaries[level].pop(key, None)
+            self.dirty[level].add(key)
+
+    @classmethod
+    def build(cls, items: Dict[str, Item]) -> "CanvasLOD":
+        lod = cls()
+        lod.items = items
+        for entity_id, item in items.items():
+            lod.members.setdefault(item.tile, set()).add(entity_id)
+        lod.occupancy[0] = {tile: len(ids) for tile, ids in lod.members.items()}
+        for level in range(1, MAX_LEVEL + 1):
+            counts = lod.occupancy[level]
+            for (tx, ty), count in lod.occupancy[level - 1].items():
+                key = (tx >> 1, ty >> 1)
+                counts[key] = counts.get(key, 0) + count
+        return lod
+
+    def put(self, entity_id: str, item: Item) -> None:
+        old = self.items.get(entity_id)
+        if old == item:
+            return
+        if old is not None:
+            self.members[old.tile].discard(entity_id)
+            self._count(old.tile, -1)
+        self.items[entity_id] = item
+        self.members.setdefault(item.tile, set()).add(entity_id)
+        self._count(item.tile, 1)
+
+    def _summary(self, level: int, tile: Tile) -> Summary:
+        if tile not in self.dirty[level] and tile in self.summaries[level]:
+            return self.summaries[level][tile]
+        summary = Summary()
+        if level == 0:
+            members = [(entity_id, self.items[entity_id]) for entity_id in self.members.get(tile, ())]
+            summary.count = len(members)
+            summary.tasks = sum(1 for _, item in members if item.kind == "tasks")
+            summary.notes = summary.count - summary.tasks
+            summary.bounds = (min(item.x for _, item in members), min(item.y for _, item in members),
+                              max(item.x + item.width for _, item in members),
+                              max(item.y + item.height for _, item in members))
+            summary.top = heapq.nlargest(TITLES_PER_CLUSTER, ((item.z_index, item.title, entity_id)
+                                                             for entity_id, item in members))
+        else:
+            tx, ty = tile
+            for child in ((2 * tx, 2 * ty), (2 * tx + 1, 2 * ty), (2 * tx, 2 * ty + 1), (2 * tx + 1, 2 * ty + 1)):
+                if child in self.occupancy[level - 1]:
+                    summary.merge(self._summary(level - 1, child))
+        self.summaries[level][tile] = summary
+        self.dirty[level].discard(tile)
+        return summary
+
+    def clusters(self, level: int, viewport: Optional[Tuple[float, float, float, float]] = None) -> List[Dict]:
+        cell = BASE_CELL << level
+        tiles = self.occupancy[level].keys()
+        if viewport is not None:
+            x0, y0, x1, y1 = viewport
+            tx0, ty0 = math.floor(x0 / cell), math.floor(y0 / cell)
+            tx1, ty1 = math.floor(x1 / cell), math.floor(y1 / cell)
+            # Тайлы, чьи карточки видны: bbox может выходить за тайл на размер карточки
+            tiles = [tile for tile in tiles if tx0 - 1 <= tile[0] <= tx1 + 1 and ty0 - 1 <= tile[1] <= ty1 + 1]
+
+        result = []
+        for tile in sorted(tiles):
+            summary = self._summary(level, tile)
+            left, top, right, bottom = summary.bounds
+            if viewport is not None and (right < x0 or left > x1 or bottom < y0 or top > y1):
+                continue
+            cluster = {
+                "tile": list(tile),
+                "count": summary.count,
+                "tasks": summary.tasks,
+                "notes": summary.notes,
+                "x": left,
+                "y": top,
+                "width": right - left,
+                "height": bottom - top,
+                "titles": [title for _, title, _ in summary.top],
+            }
+            if summary.count == 1:
+                # Одиночную карточку клиент может показать как есть
+                cluster["id"] = summary.top[0][2]
+                cluster["type"] = "card" if summary.tasks else "note"
+            result.append(cluster)
+        return result
+
+
+def level_for_scale(scale: float) -> int:
+    """Уровень, у которого тайл на экране занимает около TARGET_SCREEN_CELL px"""
+    if scale <= 0:
+        return MAX_LEVEL
+    level = math.log2(TARGET_SCREEN_CELL / (scale * BASE_CELL))
+    return max(0, min(MAX_LEVEL, round(level)))
+
+
+def _rows(db: Session, model, canvas_id: str, since=None):
+    query = db.query(model.id, model.x, model.y, model.width, model.height, model.title, model.z_index) \
+        .filter(model.canvas_id == canvas_id)
+    if since is not None:
+        query = query.filter(func.coalesce(model.updated_at, model.created_at) >= since)
+    return query.all()
+
+
+def _load(db: Session, canvas_id: str, since=None) -> Dict[str, Item]:
+    items = {}
+    for kind, model in KINDS.items():
+        for row in _rows(db, model, canvas_id, since):
+            items[row.id] = Item(kind, row.x or 0, row.y or 0, row.width or 300, row.height or 200,
+                                 row.title or "", row.z_index or 0)
+    return items
+
+
+def _count_rows(db: Session, canvas_id: str) -> int:
+    return sum(db.execute(select(func.count()).select_from(model).where(model.canvas_id == canvas_id)).scalar()
+               for model in KINDS.values())
+
+
+_pyramids: "OrderedDict[str, CanvasLOD]" = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+
+def get_pyramid(db: Session, canvas_id: str) -> CanvasLOD:
+    """Пирамида холста, сверенная с текущей версией tasks/notes"""
+    version, _ = http_cache.read_versions(db.get_bind(), tuple(KINDS), canvas_id)
+    with _pyramids_lock:
+        lod = _pyramids.get(canvas_id)
+        if lod is None:
+            lod = _pyramids[canvas_id] = CanvasLOD()
+        _pyramids.move_to_end(canvas_id)
+        while len(_pyramids) > MAX_CANVASES:
+            _pyramids.popitem(last=False)
+
+    with lod.lock:
+        if lod.version == version:
+            return lod
+        now = db.execute(select(func.now())).scalar()
+        if isinstance(now, str):  # SQLite отдает CURRENT_TIMESTAMP строкой
+            now = datetime.fromisoformat(now)
+        if lod.built_at is not None and now - lod.built_at > FULL_RESYNC:
+            lod.version = None
+        if lod.version is not None:
+            # Дочитать только измененные строки; расхождение в числе строк значит, что были удаления
+            for entity_id, item in _load(db, canvas_id, since=lod.synced_at - SYNC_OVERLAP).items():
+                lod.put(entity_id, item)
+            if len(lod.items) != _count_rows(db, canvas_id):
+                lod.version = None
+        if lod.version is None:
+            fresh = CanvasLOD.build(_load(db, canvas_id))
+            lod.items, lod.members = fresh.items, fresh.members
+            lod.occupancy, lod.summaries, lod.dirty = fresh.occupancy, fresh.summaries, fresh.dirty
+            lod.built_at = now
+        lod.version = version
+        lod.synced_at = now
+        return lod
+
+
+def get_clusters(db: Session, canvas_id: str, scale: float,
+                 viewport: Optional[Tuple[float, float, float, float]] = None) -> Dict:
+    level = level_for_scale(scale)
+    lod = get_pyramid(db, canvas_id)
+    with lod.lock:
+        clusters = lod.clusters(level, viewport)
+    return {"level": level, "cell_size": BASE_CELL << level, "clusters": clusters}
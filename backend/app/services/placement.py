@@ -0,0 +1,324 @@
+"""
+Поиск свободного места для новых карточек.
+
+Прямоугольники задач и заметок холста раскладываются по корзинам равномерной
+сетки (spatial hash), проверка пересечения смотрит только корзины под
+прямоугольником. Индекс строится одним запросом по колонкам координат и
+хранится в памяти воркера вместе с суммарной версией tasks/notes из
+change_versions.
+
+Свои записи (создание, перемещение, удаление карточки) воркер вносит в индекс
+сам и после коммита (apply_changes) запоминает новую версию, если она
+выросла ровно на его изменения. Чужие, массовые и неучтенные изменения
+сдвигают версию дальше - индекс строится заново при следующем поиске.
+
+Слот, выбранный для создаваемой карточки, резервируется под блокировкой
+(reserve_id): параллельное создание на том же холсте его уже не получит.
+
+Свободный слот ищется на решетке вокруг опорной карточки кольцами, внутри кольца -
+от ближних слотов к дальним (при равенстве - справа, затем снизу). Обычно
+хватает первых колец, и поиск занимает десятки микросекунд.
+"""
+import functools
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..models import Note, Task
+from . import http_cache
+
+Rect = Tuple[float, float, float, float]  # x, y, width, height
+
+# Зазор между карточками, px
+GAP = 40
+# Сторона корзины сетки, px - порядка размера карточки
+BUCKET_SIZE = 512
+# Сколько колец решетки просматривать, прежде чем ставить карточку под всеми
+MAX_RINGS = 32
+# Для скольких холстов держать индекс в памяти
+MAX_CANVASES = 64
+
+DEFAULT_POSITION = (100, 100)
+
+
+class OccupancyGrid:
+    """Прямоугольники в корзинах равномерной сетки"""
+
+    def __init__(self, bucket_size: int = BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.rects: List[Optional[Rect]] = []  # None - удаленный
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.bounds: Optional[Rect] = None  # min x, min y, max x, max y
+
+    def _cells(self, x: float, y: float, width: float, height: float):
+        size = self.bucket_size
+        for cx in range(math.floor(x / size), math.floor((x + width) / size) + 1):
+            for cy in range(math.floor(y / size), math.floor((y + height) / size) + 1):
+                yield cx, cy
+
+    def add(self, rect: Rect) -> int:
+        index = len(self.rects)
+        self.rects.append(rect)
+        for cell in self._cells(*rect):
+            self.buckets.setdefault(cell, []).append(index)
+        x, y, width, height = rect
+        if self.bounds is None:
+            self.bounds = (x, y, x + width, y + height)
+        else:
+            left, top, right, bottom = self.bounds
+            self.bounds = (min(left, x), min(top, y), max(right, x + width), max(bottom, y + height))
+        return index
+
+    def remove(self, index: int) -> None:
+        # Границы не сужаются: они нужны только как запасное место под всеми карточками
+        rect = self.rects[index]
+        if rect is None:
+            return
+        self.rects[index] = None
+        for cell in self._cells(*rect):
+            bucket = self.buckets[cell]
+            bucket.remove(index)
+            if not bucket:
+                del self.buckets[cell]
+
+    def overlaps(self, rect: Rect, gap: float = 0) -> bool:
+        x, y, width, height = rect
+        x, y, width, height = x - gap, y - gap, width + 2 * gap, height + 2 * gap
+        for cell in self._cells(x, y, width, height):
+            for index in self.buckets.get(cell, ()):
+                ox, oy, ow, oh = self.rects[index]  # в корзинах только живые прямоугольники
+                if x < ox + ow and ox < x + width and y < oy + oh and oy < y + height:
+                    return True
+        return False
+
+
+class CanvasIndex:
+    """Занятые прямоугольники холста и id карточек для поиска опорной"""
+
+    def __init__(self):
+        self.grid = OccupancyGrid()
+        self.positions: Dict[str, Rect] = {}
+        self._slots: Dict[str, int] = {}  # id -> номер прямоугольника в сетке
+        self._z: Dict[str, int] = {}
+        self.latest: Optional[str] = None  # карточка с наибольшим z_index - созданная последней
+        self._latest_z = None
+
+    def add(self, entity_id: str, rect: Rect, z_index: int = 0) -> None:
+        """Добавить карточку или заменить ее прямоугольник"""
+        if entity_id in self._slots:
+            self.grid.remove(self._slots[entity_id])
+        self._slots[entity_id] = self.grid.add(rect)
+        self.positions[entity_id] = rect
+        self._z[entity_id] = z_index or 0
+        if self._latest_z is None or (z_index or 0) >= self._latest_z:
+            self.latest, self._latest_z = entity_id, z_index or 0
+
+    def update(self, entity_id: str, fields: Dict[str, Any]) -> None:
+        """Учесть измененные x, y, width, height, z_index карточки"""
+        if entity_id not in self.positions:
+            return
+        x, y, width, height = self.positions[entity_id]
+        rect = (_or(fields.get("x"), x), _or(fields.get("y"), y),
+                _or(fields.get("width"), width), _or(fields.get("height"), height))
+        self.add(entity_id, rect, _or(fields.get("z_index"), self._z[entity_id]))
+
+    def remove(self, entity_id: str) -> None:
+        slot = self._slots.pop(entity_id, None)
+        if slot is None:
+            return
+        self.grid.remove(slot)
+        del self.positions[entity_id]
+        del self._z[entity_id]
+        if entity_id == self.latest:
+            self.latest = max(self._z, key=self._z.get, default=None)
+            self._latest_z = self._z[self.latest] if self.latest is not None else None
+
+    def anchor(self, anchor_id: Optional[str] = None) -> Optional[Rect]:
+        if anchor_id and anchor_id in self.positions:
+            return self.positions[anchor_id]
+        if self.latest is not None:
+            return self.positions[self.latest]
+        return None
+
+    def find_slots(self, anchor: Optional[Rect], sizes: List[Tuple[float, float]], gap: float = GAP) -> List[Tuple[int, int]]:
+        """Свободные места для карточек заданных размеров; уже выбранные слоты тоже считаются занятыми"""
+        placed = OccupancyGrid()
+        slots = []
+        for width, height in sizes:
+            x, y = self._find_slot(anchor, width, height, gap, placed)
+            placed.add((x, y, width, height))
+            slots.append((int(x), int(y)))
+        return slots
+
+    def _free(self, rect: Rect, gap: float, placed: OccupancyGrid) -> bool:
+        return not self.grid.overlaps(rect, gap) and not placed.overlaps(rect, gap)
+
+    def _find_slot(self, anchor: Optional[Rect], width: float, height: float, gap: float,
+                   placed: OccupancyGrid) -> Tuple[float, float]:
+        if anchor is None:
+            anchor = (*DEFAULT_POSITION, 0, 0)
+            if self._free((*DEFAULT_POSITION, width, height), gap, placed):
+                return DEFAULT_POSITION
+        ax, ay, aw, ah = anchor
+        for ring in range(1, MAX_RINGS + 1):
+            for dx, dy in _ring_offsets(ring, aw, ah, width, height, gap):
+                if self._free((ax + dx, ay + dy, width, height), gap, placed):
+                    return ax + dx, ay + dy
+
+        # Вокруг опорной все занято - под всеми карточками холста
+        bounds = [grid.bounds for grid in (self.grid, placed) if grid.bounds]
+        left = min(b[0] for b in bounds)
+        bottom = max(b[3] for b in bounds)
+        return left, bottom + gap
+
+
+def _or(value, default):
+    return default if value is None else value
+
+
+@functools.lru_cache(maxsize=1024)
+def _ring_offsets(ring: int, anchor_width: float, anchor_height: float, width: float, height: float,
+                  gap: float) -> List[Tuple[float, float]]:
+    """
+    Смещения слотов кольца решетки относительно левого верхнего угла опорной
+    карточки, от ближних к дальним. Размеры карточек обычно одинаковые, поэтому
+    порядок считается один раз.
+    """
+    def offset(i: int, anchor_size: float, size: float) -> float:
+        # Слоты справа/снизу начинаются за краем опорной карточки, слева/сверху - перед ним
+        if i > 0:
+            return anchor_size + gap + (i - 1) * (size + gap)
+        if i < 0:
+            return -gap - size + (i + 1) * (size + gap)
+        return 0.0
+
+    candidates = []
+    for i in range(-ring, ring + 1):
+        for j in range(-ring, ring + 1):
+            if max(abs(i), abs(j)) != ring:
+                continue
+            dx, dy = offset(i, anchor_width, width), offset(j, anchor_height, height)
+            distance = (dx + (width - anchor_width) / 2) ** 2 + (dy + (height - anchor_height) / 2) ** 2
+            # При равном расстоянии: справа, потом снизу
+            candidates.append((distance, -i, -j, dx, dy))
+    candidates.sort()
+    return [(dx, dy) for _, _, _, dx, dy in candidates]
+
+
+_indexes: "OrderedDict[str, Tuple[int, CanvasIndex]]" = OrderedDict()
+# Слоты создаваемых, еще не записанных карточек: холст -> id -> (прямоугольник, z_index)
+_reserved: Dict[str, Dict[str, Tuple[Rect, int]]] = {}
+_lock = threading.Lock()
+# Удерживается, пока индекс строится: снятие резерва ждет, иначе построенный по
+# БД до коммита индекс потерял бы только что записанную карточку
+_build_lock = threading.Lock()
+
+# Версия tasks/notes меняется при записи любой из двух таблиц
+VERSION_TABLES = ("tasks", "notes")
+
+
+def build_index(db: Session, canvas_id: str) -> CanvasIndex:
+    index = CanvasIndex()
+    for model in (Task, Note):
+        rows = db.query(model.id, model.x, model.y, model.width, model.height, model.z_index) \
+            .filter(model.canvas_id == canvas_id).all()
+        for row in rows:
+            index.add(row.id, (row.x or 0, row.y or 0, row.width or 300, row.height or 200), row.z_index)
+    return index
+
+
+def get_index(db: Session, canvas_id: str) -> CanvasIndex:
+    """Индекс холста из памяти воркера или заново, если карточки менялись не этим воркером"""
+    version, _ = http_cache.read_versions(db.get_bind(), VERSION_TABLES, canvas_id)
+    with _lock:
+        cached = _indexes.get(canvas_id)
+        if cached and cached[0] == version:
+            _indexes.move_to_end(canvas_id)
+            return cached[1]
+
+    with _build_lock:
+        version, _ = http_cache.read_versions(db.get_bind(), VERSION_TABLES, canvas_id)
+        with _lock:
+            cached = _indexes.get(canvas_id)
+            if cached and cached[0] == version:
+                return cached[1]
+        index = build_index(db, canvas_id)
+        with _lock:
+            # Зарезервированные слоты еще не в БД
+            for entity_id, (rect, z_index) in _reserved.get(canvas_id, {}).items():
+                index.add(entity_id, rect, z_index)
+            _indexes[canvas_id] = (version, index)
+            _indexes.move_to_end(canvas_id)
+            while len(_indexes) > MAX_CANVASES:
+                _indexes.popitem(last=False)
+    return index
+
+
+def find_slots(db: Session, canvas_id: str, sizes: List[Tuple[float, float]],
+               anchor_id: Optional[str] = None) -> List[Tuple[int, int]]:
+    """Ближайшие к опорной карточке (по умолчанию - последней созданной) свободные места"""
+    index = get_index(db, canvas_id)
+    with _lock:
+        return index.find_slots(index.anchor(anchor_id), sizes)
+
+
+def find_slot(db: Session, canvas_id: str, width: float, height: float,
+              anchor_id: Optional[str] = None, reserve_id: Optional[str] = None,
+              z_index: int = 0) -> Tuple[int, int]:
+    """Свободное место; с reserve_id оно занимается за этой карточкой до apply_changes или release"""
+    index = get_index(db, canvas_id)
+    with _lock:
+        x, y = index.find_slots(index.anchor(anchor_id), [(width, height)])[0]
+        if reserve_id is not None:
+            rect = (x, y, width, height)
+            _reserved.setdefault(canvas_id, {})[reserve_id] = (rect, z_index)
+            index.add(reserve_id, rect, z_index)
+    return x, y
+
+
+def release(canvas_id: str, entity_id: str, keep: bool = False) -> None:
+    """Снять резерв; без keep (запись не удалась) освободить и место в индексе"""
+    with _build_lock, _lock:
+        reserved = _reserved.get(canvas_id)
+        if not reserved or reserved.pop(entity_id, None) is None:
+            return
+        if not reserved:
+            del _reserved[canvas_id]
+        cached = _indexes.get(canvas_id)
+        if cached is not None and not keep:
+            cached[1].remove(entity_id)
+
+
+def apply_changes(db: Session, canvas_id: str, bumped: int, *,
+                  placed: Optional[Dict[str, Tuple[Rect, int]]] = None,
+                  moved: Optional[Dict[str, Dict[str, Any]]] = None,
+                  removed: Iterable[str] = ()) -> None:
+    """
+    После коммита, увеличившего версию tasks/notes холста на bumped: внести
+    изменения в индекс и запомнить его под новой версией. Если версия выросла
+    больше (писал кто-то еще), индекс выбрасывается.
+    """
+    version, _ = http_cache.read_versions(db.get_bind(), VERSION_TABLES, canvas_id)
+    with _build_lock, _lock:
+        reserved = _reserved.get(canvas_id, {})
+        for entity_id in placed or ():
+            reserved.pop(entity_id, None)
+        if canvas_id in _reserved and not reserved:
+            del _reserved[canvas_id]
+        cached = _indexes.get(canvas_id)
+        if cached is None:
+            return
+        cached_version, index = cached
+        if cached_version + bumped != version:
+            del _indexes[canvas_id]
+            return
+        for entity_id, (rect, z_index) in (placed or {}).items():
+            index.add(entity_id, rect, z_index)
+        for entity_id, fields in (moved or {}).items():
+            index.update(entity_id, fields)
+        for entity_id in removed:
+            index.remove(entity_id)
+        _indexes[canvas_id] = (version, index)
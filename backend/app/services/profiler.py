@@ -0,0 +1,233 @@
+"""
+Сэмплирующий профилировщик для работающих воркеров.
+
+Пока профилирование не запущено, он ничего не делает: нет ни потока, ни хуков
+на запросах. Во время окна фоновый поток раз в interval снимает стеки всех
+потоков процесса через sys._current_frames() и считает одинаковые стеки.
+
+Результат - свернутые стеки ("folded", формат flamegraph.pl / speedscope) и
+сводка по категориям: гидратация ORM, jsonable_encoder, драйвер БД и т.д.
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def is_admin(token) -> bool:
+    """Токен совпадает с ADMIN_TOKEN; сравнение за постоянное время"""
+    if not ADMIN_TOKEN or token is None:
+        return False
+    if isinstance(token, str):
+        token = token.encode()
+    return hmac.compare_digest(token, ADMIN_TOKEN.encode())
+
+MAX_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+MAX_DEPTH = 128
+
+# Сколько последних профилей отдельных запросов хранить
+RECENT_PROFILES = 32
+
+# Стеки, у которых верхний кадр - ожидание, это простаивающие потоки
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("base_events.py", "_run_once"),
+    ("profiler.py", "profile_window"),  # сам запрос на профилирование
+}
+
+# Категории проверяются от верхнего кадра стека вниз; первая совпавшая побеждает
+_CATEGORIES = [
+    ("db_driver", ("psycopg2", "asyncpg", "sqlite3", "sqlalchemy/engine/default.py:do_execute",
+                   "sqlalchemy/engine/cursor.py:fetch", "sqlalchemy/engine/cursor.py:_fetch")),
+    ("orm_hydration", ("sqlalchemy/orm/loading.py", "sqlalchemy/orm/strategies.py",
+                       "sqlalchemy/orm/attributes.py", "sqlalchemy/orm/state.py")),
+    ("jsonable_encoder", ("fastapi/encoders.py",)),
+    ("json_render", ("json/encoder.py", "starlette/responses.py:render", "fastapi/responses.py")),
+    ("pydantic", ("pydantic/", "pydantic_core/")),
+    ("sqlalchemy", ("sqlalchemy/",)),
+    ("app", ("app/",)),
+]
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename.replace("\\", "/")
+    for marker in ("site-packages/", "dist-packages/", "/lib/python"):
+        index = filename.rfind(marker)
+        if index != -1:
+            filename = filename[index + len(marker):]
+            if marker == "/lib/python":
+                filename = filename.split("/", 1)[-1]
+            break
+    else:
+        index = filename.rfind("/app/")
+        if index != -1:
+            filename = filename[index + 1:]
+    return f"{filename}:{code.co_name}"
+
+
+def _collapse(frame) -> List[str]:
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+
+def _category(labels: List[str]) -> str:
+    for label in reversed(labels):
+        for name, markers in _CATEGORIES:
+            if any(marker in label for marker in markers):
+                return name
+    return "other"
+
+
+class SamplingProfiler:
+    """Сэмплирует стеки всех потоков, кроме своего, пока не будет остановлен"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = max(MIN_INTERVAL, interval)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or _is_idle(frame):
+                    continue
+                self.stacks[";".join(_collapse(frame))] += 1
+                self.samples += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def categories(self) -> Dict[str, Dict[str, float]]:
+        totals: Counter = Counter()
+        for stack, count in self.stacks.items():
+            totals[_category(stack.split(";"))] += count
+        return {
+            name: {"samples": count, "share": round(count / self.samples, 4) if self.samples else 0.0}
+            for name, count in totals.most_common()
+        }
+
+    def report(self, profile_id: Optional[str] = None) -> Dict:
+        return {
+            "id": profile_id,
+            "duration": round(self.duration, 3),
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "categories": self.categories(),
+            "folded": self.folded(),
+        }
+
+
+# В процессе одновременно идет не больше одного профилирования
+_session_lock = threading.Lock()
+
+_recent: "OrderedDict[str, Dict]" = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def profile_window(seconds: float, interval: float) -> Dict:
+    """Профилировать воркер в течение окна и вернуть отчет"""
+    seconds = min(max(seconds, 0.1), MAX_SECONDS)
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy("Профилирование уже идет")
+    try:
+        profiler = SamplingProfiler(interval).start()
+        time.sleep(seconds)
+        return profiler.stop().report(str(uuid.uuid4()))
+    finally:
+        _session_lock.release()
+
+
+def get_recent(profile_id: str) -> Optional[Dict]:
+    with _recent_lock:
+        return _recent.get(profile_id)
+
+
+def _remember(report: Dict) -> None:
+    with _recent_lock:
+        _recent[report["id"]] = report
+        while len(_recent) > RECENT_PROFILES:
+            _recent.popitem(last=False)
+
+
+class ProfileRequestMiddleware:
+    """
+    Профилирование отдельного запроса по заголовкам X-Profile: 1 и X-Admin-Token.
+
+    Чистый ASGI без обертки ответа: запросы без заголовка проходят насквозь.
+    Отчет сохраняется в памяти воркера, его id возвращается в X-Profile-Id.
+    Сэмплируются все потоки, поэтому параллельные запросы тоже попадут в профиль.
+    """
+
+    def __init__(self, app, interval: float = 0.002):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or ())
+        if headers.get(b"x-profile") != b"1" or not is_admin(headers.get(b"x-admin-token")):
+            return await self.app(scope, receive, send)
+        if not _session_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        profile_id = str(uuid.uuid4())
+        profiler = SamplingProfiler(self.interval).start()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            try:
+                _remember(profiler.stop().report(profile_id))
+            finally:
+                _session_lock.release()
@@ -0,0 +1,155 @@
+"""
+Ограничение частоты записей на клиента.
+
+Token bucket на клиента: WRITE_RATE_LIMIT запросов в секунду в среднем и до
+WRITE_RATE_BURST подряд. Считаются только изменяющие запросы к /api; сверх
+лимита - 429 с Retry-After, обработчик не вызывается.
+
+Клиент - его адрес. За прокси из TRUSTED_PROXIES (nginx) адрес берется из
+X-Real-IP или X-Forwarded-For, иначе все клиенты делили бы одну корзину
+адреса прокси. Заголовок X-Client-Id выбирает сам клиент, поэтому в ключ он
+не входит.
+
+Перетаскивание (PUT карточки или заметки только с x, y, z_index, которые
+откладывает services/write_coalescer) считается по отдельной, большей квоте
+POSITION_RATE_LIMIT: частые PUT при перетаскивании в БД почти не попадают.
+
+Счетчики живут в воркере: при N воркерах клиент за балансировщиком может
+получить до N лимитов.
+"""
+import ipaddress
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from .write_coalescer import coalescer
+
+# Запросов в секунду на клиента; 0 - без ограничения
+WRITE_RATE_LIMIT = float(os.getenv("WRITE_RATE_LIMIT", "50"))
+WRITE_RATE_BURST = int(os.getenv("WRITE_RATE_BURST", "100"))
+
+# Отдельная квота для PUT только с положением (перетаскивание на 60 Гц); 0 - без ограничения
+POSITION_RATE_LIMIT = float(os.getenv("POSITION_RATE_LIMIT", "300"))
+POSITION_RATE_BURST = int(os.getenv("POSITION_RATE_BURST", "600"))
+
+# Адреса прокси, которым можно верить в X-Real-IP / X-Forwarded-For
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(net.strip())
+    for net in os.getenv("TRUSTED_PROXIES", "127.0.0.1/32,::1/128,10.0.0.0/8,172.16.0.0/12").split(",")
+    if net.strip()
+]
+
+WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+_POSITION_PATH = re.compile(r"^/api/(cards|notes)/[^/]+$")
+# Тело PUT с одним положением заведомо короче
+_POSITION_BODY_LIMIT = 512
+
+
+class TokenBucketLimiter:
+    """Корзины токенов по ключу клиента; давно не активные вытесняются"""
+
+    def __init__(self, rate: float = WRITE_RATE_LIMIT, burst: int = WRITE_RATE_BURST, maxsize: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def acquire(self, key: str) -> Optional[float]:
+        """Списать токен; None - можно, иначе через сколько секунд появится токен"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = None
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"clients": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected}
+
+
+def _trusted(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in net for net in TRUSTED_PROXIES)
+
+
+def client_key(request: Request) -> str:
+    """Адрес клиента; за доверенным прокси - из его заголовков"""
+    host = request.client.host if request.client else "unknown"
+    if _trusted(host):
+        forwarded = request.headers.get("x-real-ip") or request.headers.get("x-forwarded-for", "").split(",")[-1]
+        if forwarded.strip():
+            host = forwarded.strip()
+    return f"ip:{host}"
+
+
+async def _is_position_only(request: Request) -> bool:
+    """PUT, который write_coalescer отложит: только x, y, z_index карточки или заметки"""
+    if request.method != "PUT" or not _POSITION_PATH.match(request.url.path):
+        return False
+    try:
+        length = int(request.headers.get("content-length", ""))
+    except ValueError:
+        return False
+    if length > _POSITION_BODY_LIMIT:
+        return False
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        return False
+    return isinstance(data, dict) and coalescer.accepts(data)
+
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """429 для изменяющих запросов к /api сверх лимита клиента"""
+
+    def __init__(self, app, limiter: TokenBucketLimiter, position_limiter: Optional[TokenBucketLimiter] = None):
+        super().__init__(app)
+        self.limiter = limiter
+        self.position_limiter = position_limiter
+
+    async def dispatch(self, request: Request, call_next):
+        if request.method not in WRITE_METHODS or not request.url.path.startswith("/api/"):
+            return await call_next(request)
+        limiter = self.limiter
+        if await _is_position_only(request):
+            if self.position_limiter is None:
+                return await call_next(request)
+            limiter = self.position_limiter
+        wait = limiter.acquire(client_key(request))
+        if wait is not None:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Слишком много запросов"},
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+        return await call_next(request)
+
+
+write_limiter = TokenBucketLimiter()
+position_limiter = TokenBucketLimiter(POSITION_RATE_LIMIT, POSITION_RATE_BURST) if POSITION_RATE_LIMIT > 0 else None
@@ -0,0 +1,56 @@
+"""
+Быстрая сериализация ответов со списками.
+
+TypeAdapter схемы собирается один раз при импорте модуля, а строки select по
+колонкам (или ORM-объекты) проверяются и кодируются в JSON целиком в
+pydantic-core - без jsonable_encoder и json.dumps, через которые FastAPI
+пропускает ответ обработчика. Колонки запроса берутся из полей схемы
+(columns), поэтому лишние колонки не читаются, а связи не подгружаются.
+
+Строки Row перед проверкой превращаются в словари: доступ к их атрибутам по
+имени в несколько раз дороже, чем zip с одним на весь список набором ключей.
+"""
+from typing import Any, List
+
+from pydantic import TypeAdapter
+from sqlalchemy.engine import Row
+from starlette.responses import Response
+
+from . import instrumentation
+
+
+class JSONSerializer:
+    """Ответ по схеме schema (например, List[TaskSummary]) в обход сериализации FastAPI"""
+
+    def __init__(self, schema: Any, exclude_unset: bool = False):
+        self.adapter = TypeAdapter(schema)
+        self.exclude_unset = exclude_unset
+
+    def dump(self, data: Any) -> bytes:
+        value = self.adapter.validate_python(_plain(data), from_attributes=True)
+        return self.adapter.dump_json(value, exclude_unset=self.exclude_unset)
+
+    def response(self, data: Any) -> Response:
+        with instrumentation.serializing():
+            return Response(self.dump(data), media_type="application/json")
+
+
+def _plain(data: Any) -> Any:
+    """Списки Row (в том числе в значениях словаря) - в списки словарей"""
+    if isinstance(data, dict):
+        return {key: _plain(value) for key, value in data.items()}
+    if isinstance(data, list) and data and isinstance(data[0], Row):
+        keys = data[0]._fields
+        # Списки могут быть склеены из запросов с разными колонками (/api/graph)
+        if all(row._fields == keys for row in data):
+            return [dict(zip(keys, row)) for row in data]
+        return [row._asdict() for row in data]
+    return data
+
+
+def columns(model, schema, **expressions) -> List:
+    """Колонки model для полей schema; expressions - поля, которых нет среди атрибутов model"""
+    return [
+        expressions[name].label(name) if name in expressions else getattr(model, name)
+        for name in schema.model_fields
+    ]
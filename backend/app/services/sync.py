@@ -0,0 +1,314 @@
+"""
+Синхронизация офлайн-клиентов: журнал операций и изменения с курсора.
+
+Клиент копит операции, пока нет связи, и отправляет их пачкой в POST
+/api/sync вместе с курсором прошлой синхронизации. Сервер в одной транзакции:
+
+- пропускает уже примененные операции (client_id, op_id) и возвращает их
+  сохраненный результат - повтор запроса после обрыва ничего не удваивает;
+- применяет новые по порядку. Изменение сливается по полям: если клиент
+  прислал prev (значения до изменения) и на сервере поле с тех пор изменилось,
+  побеждает более позднее изменение (время клиента против updated_at строки),
+  а проигравшие поля клиента возвращаются в conflicts. Удаление побеждает
+  изменение;
+- записывает результаты в sync_operations.
+
+Затем отдаются строки, измененные после курсора (по индексам ix_*_changed и
+ix_*_created_at), и надгробия удаленных - каждая сущность один раз, в текущем
+состоянии. Курсор - время БД на начало запроса; чтение идет с запасом
+SYNC_OVERLAP (транзакция могла закоммититься позже, чем началась), так что
+клиент может получить строку повторно. Пустой, устаревший (SYNC_RETENTION) или
+слишком отставший курсор дает reset: клиенту нужна полная загрузка.
+
+Удаления связей вместе с их карточкой надгробий не оставляют: клиент удаляет
+связи удаленных карточек сам.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import schemas
+from ..crud import BaseCRUD, note_crud, task_crud
+from ..models import Canvas, NoteLink, SyncOperation, TaskLink, Tombstone
+from .integrity import SYNC_RETENTION
+from .write_coalescer import coalescer
+
+# Запас при чтении изменений после курсора
+SYNC_OVERLAP = timedelta(seconds=5)
+# Операций в одном запросе; больше - частями
+MAX_OPS = 1000
+# Изменений в ответе; если после курсора их больше, дешевле загрузить холст заново
+MAX_CHANGES = 5000
+
+CARDS: Dict[str, BaseCRUD] = {"task": task_crud, "note": note_crud}
+UPDATE_SCHEMAS = {"task": schemas.TaskUpdate, "note": schemas.NoteUpdate}
+LINKS = {"task_link": TaskLink, "note_link": NoteLink}
+DELETED_TABLES = ("tasks", "notes", "task_links", "note_links")
+
+
+def track_deletions(session_factory) -> None:
+    """Оставлять надгробие для каждой карточки, заметки и связи, удаленной через ORM"""
+
+    @event.listens_for(session_factory, "after_flush")
+    def _tombstones_after_flush(session, flush_context):
+        rows = [
+            {"canvas_id": obj.canvas_id, "table_name": obj.__tablename__, "entity_id": str(obj.id)}
+            for obj in session.deleted
+            if getattr(obj, "__tablename__", None) in DELETED_TABLES
+        ]
+        if rows:
+            session.connection().execute(insert(Tombstone.__table__), rows)
+
+
+def _utc(value) -> Optional[datetime]:
+    if value is None:
+        return None
+    if isinstance(value, str):  # SQLite отдает CURRENT_TIMESTAMP строкой
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _bound(db: Session, value: datetime):
+    # В SQLite время хранится строкой без пояса, сравнивать нужно в том же виде
+    return value.replace(tzinfo=None) if db.get_bind().dialect.name == "sqlite" else value
+
+
+def encode_cursor(at: datetime) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"t": at.isoformat()}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[datetime]:
+    """Время курсора; None, если курсора нет или он не разбирается"""
+    if not cursor:
+        return None
+    try:
+        return _utc(json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["t"])
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        return None
+
+
+# Операции
+
+def _result(op: schemas.SyncOperation, status: str, id: Optional[str] = None, conflicts: Tuple = (),
+            error: Optional[str] = None) -> Dict[str, Any]:
+    return {"op_id": op.op_id, "status": status, "id": id, "conflicts": list(conflicts), "error": error}
+
+
+def _is_deleted(db: Session, canvas_id: str, table_name: str, entity_id: str) -> bool:
+    return db.execute(select(Tombstone.id).where(
+        Tombstone.canvas_id == canvas_id, Tombstone.table_name == table_name, Tombstone.entity_id == entity_id,
+    ).limit(1)).first() is not None
+
+
+def _card_fields(op: schemas.SyncOperation, crud: BaseCRUD) -> Dict[str, Any]:
+    """Поля операции, которые можно писать, с типами по схеме изменения"""
+    fields = {field: value for field, value in op.fields.items() if field in crud.writable}
+    checked = UPDATE_SCHEMAS[op.type].model_validate(fields).model_dump(exclude_unset=True)
+    return {**fields, **checked}
+
+
+def _apply_card(db: Session, canvas_id: str, op: schemas.SyncOperation, client_ts: datetime,
+                now: datetime) -> Dict[str, Any]:
+    crud = CARDS[op.type]
+    table_name = crud.model.__tablename__
+    if not op.id:
+        return _result(op, "rejected", error="Не указан id")
+    try:
+        fields = _card_fields(op, crud)
+    except ValidationError as e:
+        return _result(op, "rejected", op.id, error=str(e.errors()[0]["msg"]))
+
+    if op.action == "delete":
+        if crud.get(db, op.id, canvas_id) is not None:
+            crud.remove(db, op.id, canvas_id, commit=False)
+        return _result(op, "applied", op.id)
+
+    # Положение из буфера перетаскивания - самое свежее состояние сервера
+    pending = coalescer.take(crud.model, [op.id]).get(op.id, {})
+    obj = crud.get(db, op.id, canvas_id)
+    if obj is None:
+        if _is_deleted(db, canvas_id, table_name, op.id):
+            return _result(op, "deleted", op.id)
+        if op.action == "update":
+            return _result(op, "rejected", op.id, error=crud.not_found)
+        if db.get(crud.model, op.id) is not None:
+            return _result(op, "rejected", op.id, error="id уже занят на другом холсте")
+        obj = crud.create(db, canvas_id, fields, id=op.id, commit=False)
+        # create заполняет только общие колонки
+        for field, value in fields.items():
+            setattr(obj, field, value)
+        db.flush()
+        return _result(op, "applied", op.id)
+
+    # Создание уже существующей карточки (например, повтор без журнала) - как изменение
+    prev = op.prev if op.action == "update" else None
+    changed_at = _utc(obj.updated_at or obj.created_at) or now
+    accepted = dict(pending)
+    conflicts = []
+    for field, value in fields.items():
+        current = pending.get(field, getattr(obj, field))
+        if prev is None or field not in prev or prev[field] == current or current == value:
+            accepted[field] = value
+        elif client_ts > (now if field in pending else changed_at):
+            # Поле меняли обе стороны: побеждает более позднее изменение
+            accepted[field] = value
+        else:
+            conflicts.append(field)
+    if accepted:
+        crud.update(db, op.id, canvas_id, accepted, commit=False)
+    return _result(op, "merged" if conflicts else "applied", op.id, conflicts)
+
+
+def _apply_link(db: Session, canvas_id: str, op: schemas.SyncOperation) -> Dict[str, Any]:
+    model = LINKS[op.type]
+    if op.action == "update":
+        return _result(op, "rejected", op.id, error="Связи не изменяются")
+
+    if op.action == "delete":
+        if not (op.id or "").isdigit():
+            return _result(op, "rejected", op.id, error="Некорректный id связи")
+        link = db.get(model, int(op.id))
+        if link is not None and link.canvas_id == canvas_id:
+            db.delete(link)
+            db.flush()
+        return _result(op, "applied", op.id)
+
+    source_id, target_id = op.fields.get("source_id"), op.fields.get("target_id")
+    if model is TaskLink:
+        target_type = op.fields.get("link_target_type", "task")
+        if target_type not in CARDS:
+            return _result(op, "rejected", error="Invalid link_target_type")
+        values = {"link_type": op.fields.get("link_type", "depends_on"), "link_target_type": target_type}
+        ends = ((task_crud, source_id), (CARDS[target_type], target_id))
+    else:
+        values = {"link_type": op.fields.get("link_type", "linked_to")}
+        ends = ((note_crud, source_id), (note_crud, target_id))
+    for crud, entity_id in ends:
+        if not entity_id or not crud.exists(db, entity_id, canvas_id):
+            status = "deleted" if entity_id and _is_deleted(db, canvas_id, crud.model.__tablename__, entity_id) \
+                else "rejected"
+            return _result(op, status, error=crud.not_found)
+
+    # Такая связь уже есть (создана другим клиентом) - отдать ее id
+    existing = db.execute(select(model.id).where(
+        model.canvas_id == canvas_id, model.source_id == source_id, model.target_id == target_id,
+        *(getattr(model, column) == value for column, value in values.items()),
+    ).limit(1)).scalar()
+    if existing is None:
+        link = model(canvas_id=canvas_id, source_id=source_id, target_id=target_id, **values)
+        db.add(link)
+        db.flush()
+        existing = link.id
+    return _result(op, "applied", str(existing))
+
+
+def apply_operations(db: Session, canvas_id: str, client_id: str, ops: List[schemas.SyncOperation],
+                     now: datetime) -> List[Dict[str, Any]]:
+    """Применить новые операции и записать их в журнал; повторы получают прежний результат"""
+    done = {
+        op_id: result for op_id, result in db.execute(
+            select(SyncOperation.op_id, SyncOperation.result).where(
+                SyncOperation.client_id == client_id, SyncOperation.op_id.in_({op.op_id for op in ops}))
+        ).all()
+    } if ops else {}
+    results = []
+    for op in ops:
+        if op.op_id in done:
+            results.append(done[op.op_id])
+            continue
+        # Часы клиента могут спешить: изменение не может быть позже приема
+        client_ts = min(_utc(op.ts) or now, now)
+        if op.type in CARDS:
+            result = _apply_card(db, canvas_id, op, client_ts, now)
+        else:
+            result = _apply_link(db, canvas_id, op)
+        db.add(SyncOperation(canvas_id=canvas_id, client_id=client_id, op_id=op.op_id, entity_type=op.type,
+                             entity_id=result["id"], action=op.action, status=result["status"], result=result,
+                             client_ts=client_ts))
+        done[op.op_id] = result
+        results.append(result)
+    db.flush()
+    return results
+
+
+# Изменения
+
+def _changed_rows(db: Session, crud: BaseCRUD, canvas_id: str, since: datetime) -> List[Dict[str, Any]]:
+    rows = crud.get_multi(db, canvas_id, include_content=True, filters=[crud.changed >= _bound(db, since)],
+                          limit=MAX_CHANGES + 1)
+    return [row._asdict() for row in rows]
+
+
+def _new_links(db: Session, model, canvas_id: str, since: datetime) -> List[Dict[str, Any]]:
+    columns = [model.__table__.c[name] for name in (schemas.TaskLink if model is TaskLink
+                                                     else schemas.NoteLink).model_fields]
+    rows = db.execute(select(*columns).where(model.canvas_id == canvas_id, model.created_at >= _bound(db, since))
+                      .limit(MAX_CHANGES + 1)).all()
+    return [row._asdict() for row in rows]
+
+
+def changes_since(db: Session, canvas_id: str, since: datetime) -> Optional[Dict[str, Any]]:
+    """Изменения холста после since (с запасом); None, если их больше MAX_CHANGES"""
+    since = since - SYNC_OVERLAP
+    changes = {
+        "tasks": _changed_rows(db, task_crud, canvas_id, since),
+        "notes": _changed_rows(db, note_crud, canvas_id, since),
+        "task_links": _new_links(db, TaskLink, canvas_id, since),
+        "note_links": _new_links(db, NoteLink, canvas_id, since),
+    }
+    deleted: Dict[str, set] = {table_name: set() for table_name in DELETED_TABLES}
+    for table_name, entity_id in db.execute(
+        select(Tombstone.table_name, Tombstone.entity_id)
+        .where(Tombstone.canvas_id == canvas_id, Tombstone.deleted_at >= _bound(db, since))
+        .limit(MAX_CHANGES + 1)
+    ).all():
+        deleted[table_name].add(entity_id)
+    if sum(map(len, changes.values())) + sum(map(len, deleted.values())) > MAX_CHANGES:
+        return None
+    # Строка, которая есть сейчас, важнее надгробия (id пересоздан)
+    for table_name, rows in changes.items():
+        deleted[table_name] -= {str(row["id"]) for row in rows}
+    changes["deleted"] = {table_name: sorted(ids) for table_name, ids in deleted.items()}
+    return changes
+
+
+def synchronize(db: Session, canvas_id: str, request: schemas.SyncRequest) -> Dict[str, Any]:
+    if len(request.ops) > MAX_OPS:
+        raise HTTPException(status_code=413, detail=f"Не больше {MAX_OPS} операций за запрос")
+    if db.get(Canvas, canvas_id) is None:
+        raise HTTPException(status_code=404, detail="Холст не найден")
+
+    now = _utc(db.execute(select(func.now())).scalar())
+    try:
+        results = apply_operations(db, canvas_id, request.client_id, request.ops, now)
+        db.commit()
+    except IntegrityError:
+        # Тот же пакет пришел параллельно (повтор после таймаута): второй раз операции окажутся в журнале
+        db.rollback()
+        try:
+            results = apply_operations(db, canvas_id, request.client_id, request.ops, now)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Операции применяются другим запросом, повторите позже")
+
+    since = decode_cursor(request.cursor)
+    changes = None
+    if since is not None and now - since <= SYNC_RETENTION:
+        changes = changes_since(db, canvas_id, since)
+    return {
+        "results": results,
+        "changes": changes or {},
+        "cursor": encode_cursor(now),
+        "reset": changes is None,
+    }
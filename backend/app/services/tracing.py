@@ -0,0 +1,283 @@
+"""
+Трассировка запросов: request ID, спаны и JSON-журнал доступа.
+
+Идентификатор запроса приходит от nginx (X-Request-ID, он же trace id в
+заголовке traceparent) или создается здесь и возвращается в ответе.
+Спаны в духе OpenTelemetry: запрос -> обработчик -> SQL-запросы и
+сериализация; родитель - спан nginx из traceparent. Спаны пишутся, только
+если задан TRACE_FILE (JSON Lines) или TRACE_COLLECTOR_URL (OTLP/HTTP JSON,
+например http://collector:4318/v1/traces), фоновым потоком пачками; при
+переполнении очереди отбрасываются.
+
+Журнал доступа holst.access - одна JSON-строка на запрос: длительность,
+время в БД и сериализации, размеры запроса и ответа, request ID.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("holst.access")
+
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "holst-backend")
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL")
+# Доля трасс, начатых здесь (без traceparent); решение nginx/клиента из traceparent соблюдается
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "1") == "1"
+
+# Текст SQL в атрибутах спана обрезается
+STATEMENT_CHARS = 500
+QUEUE_SIZE = 10000
+BATCH_SIZE = 512
+EXPORT_INTERVAL = 1.0
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_HEX32 = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    kind: str = "internal"
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "service": SERVICE_NAME,
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": {"server": 2, "client": 3}.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class SpanExporter:
+    """Очередь законченных спанов и поток, выгружающий их пачками"""
+
+    def __init__(self, path: Optional[str] = TRACE_FILE, url: Optional[str] = TRACE_COLLECTOR_URL):
+        self.path = path
+        self.url = url
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.exported = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.url)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"spans_exported": self.exported, "spans_dropped": self.dropped}
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch: List[Span]) -> None:
+        try:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for span in batch:
+                        f.write(json.dumps(span.to_json(), ensure_ascii=False, default=str) + "\n")
+            if self.url:
+                payload = {"resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                    "scopeSpans": [{"scope": {"name": "holst"}, "spans": [span.to_otlp() for span in batch]}],
+                }]}
+                request = urllib.request.Request(self.url, data=json.dumps(payload).encode(),
+                                                 headers={"Content-Type": "application/json"}, method="POST")
+                urllib.request.urlopen(request, timeout=5).close()
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning("Span export failed, %d spans dropped: %s", len(batch), e)
+
+
+exporter = SpanExporter()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("holst_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def request_context(headers) -> Tuple[str, str, Optional[str], bool]:
+    """request ID, trace id, родительский спан и решение о записи по заголовкам запроса"""
+    request_id = (headers.get("x-request-id") or "")[:64]
+    match = _TRACEPARENT.match(headers.get("traceparent") or "")
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        sampled = int(flags, 16) & 1 == 1
+    else:
+        # nginx $request_id - 32 hex-символа, годится как trace id
+        trace_id = request_id if _HEX32.match(request_id) else _new_id(16)
+        parent_id = None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    return request_id or trace_id, trace_id, parent_id, sampled and exporter.enabled
+
+
+def start_span(name: str, *, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+               kind: str = "internal", **attributes) -> Optional[Span]:
+    """Новый спан: корневой (trace_id задан) или дочерний текущего; None, если трасса не пишется"""
+    if trace_id is None:
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    return Span(name, trace_id, _new_id(8), parent_id, time.time_ns(), kind=kind, attributes=attributes)
+
+
+def end_span(span: Optional[Span], error: Optional[BaseException] = None) -> None:
+    if span is None:
+        return
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    exporter.export(span)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Дочерний спан текущего на время блока; вне записываемой трассы ничего не делает"""
+    child = start_span(name, **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        end_span(child, e)
+        raise
+    else:
+        end_span(child)
+    finally:
+        _current_span.reset(token)
+
+
+def set_current(active: Optional[Span]):
+    """Сделать спан текущим; вернуть токен для reset_current"""
+    return _current_span.set(active)
+
+
+def reset_current(token) -> None:
+    _current_span.reset(token)
+
+
+def record_statement(statement: str, duration: float, dialect: str, executemany: bool) -> None:
+    """Законченный SQL-запрос длительностью duration секунд - дочерний спан текущего"""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    end_ns = time.time_ns()
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+    child = Span(f"db {verb}", parent.trace_id, _new_id(8), parent.span_id, end_ns - int(duration * 1e9), end_ns,
+                 kind="client", attributes={"db.system": dialect, "db.statement": statement[:STATEMENT_CHARS],
+                                            "db.executemany": executemany})
+    exporter.export(child)
+
+
+# Журнал доступа
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = getattr(record, "access", None)
+        if entry is None:
+            entry = {"level": record.levelname.lower(), "logger": record.name, "message": record.getMessage()}
+        return json.dumps({"ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(), **entry},
+                          ensure_ascii=False, default=str)
+
+
+def configure_access_log() -> None:
+    """JSON-строки holst.access в stdout (ACCESS_LOG=0 отключает)"""
+    if not ACCESS_LOG or access_logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_JSONFormatter())
+    access_logger.addHandler(handler)
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+
+
+def log_access(entry: Dict[str, Any]) -> None:
+    if ACCESS_LOG:
+        access_logger.info("access", extra={"access": entry})
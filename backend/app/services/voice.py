@@ -0,0 +1,199 @@
+"""
+Диктовка: аудио -> текст (voice-stt) -> карточка или заметка за один запрос.
+
+Браузер отправляет запись в POST /api/voice, бэкенд передает ее сервису
+распознавания и сразу создает элемент (или дописывает текст в существующий);
+в ответе - текст и сам элемент. Отдельные запросы /transcribe, /max-z-index и
+POST /api/cards клиенту не нужны.
+
+Аудио уходит в voice-stt телом запроса кусками по CHUNK_SIZE, без multipart и
+без чтения файла в память. Соединения keep-alive берутся из пула (до
+VOICE_STT_POOL_SIZE на воркер), установка TCP на запрос не тратится.
+Соединение, которое сервис закрыл между запросами, обнаруживается при
+отправке - запрос один раз повторяется на новом.
+"""
+import http.client
+import json
+import os
+import queue
+import threading
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from ..crud import BaseCRUD
+from . import tracing
+
+VOICE_STT_URL = os.getenv("VOICE_STT_URL", "http://voice-stt:5000")
+VOICE_STT_TIMEOUT = float(os.getenv("VOICE_STT_TIMEOUT", "120"))
+VOICE_STT_POOL_SIZE = int(os.getenv("VOICE_STT_POOL_SIZE", "4"))
+
+CHUNK_SIZE = 64 * 1024
+# Длина названия элемента, созданного из текста
+TITLE_CHARS = 60
+
+# Ошибки соединения, закрытого сервисом, пока оно лежало в пуле
+_STALE_ERRORS = (ConnectionError, http.client.BadStatusLine)
+
+
+class SttError(Exception):
+    """Сервис распознавания недоступен или вернул ошибку"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SttClient:
+    """HTTP-клиент voice-stt с пулом keep-alive соединений"""
+
+    def __init__(self, url: str = VOICE_STT_URL, pool_size: int = VOICE_STT_POOL_SIZE,
+                 timeout: float = VOICE_STT_TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=max(pool_size, 1))
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self.reused = 0
+
+    def transcribe(self, audio: BinaryIO, content_type: Optional[str] = None, model: Optional[str] = None) -> str:
+        """Текст записи моделью model (по умолчанию - модель сервиса); audio читается кусками с текущей позиции"""
+        start = audio.tell()
+        size = audio.seek(0, os.SEEK_END) - start
+        headers = {"Content-Type": content_type or "application/octet-stream", "Content-Length": str(size)}
+        with tracing.span("stt transcribe", audio_bytes=size) as active:
+            if active is not None:
+                headers["traceparent"] = f"00-{active.trace_id}-{active.span_id}-01"
+            with self._lock:
+                self.requests += 1
+            try:
+                path = "/transcribe" + (f"?{urlencode({'model': model})}" if model else "")
+                status, body = self._post(path, audio, start, headers)
+            except (OSError, http.client.HTTPException) as e:
+                self._failed()
+                raise SttError(f"Сервис распознавания недоступен: {e}") from e
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {}
+        if status != 200:
+            self._failed()
+            # Неизвестная модель и неподдерживаемый формат - ошибки запроса клиента
+            raise SttError(data.get("error") or f"Сервис распознавания ответил {status}",
+                           {404: 400, 415: 415}.get(status, 502))
+        return (data.get("text") or "").strip()
+
+    def _post(self, path: str, audio: BinaryIO, start: int, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            audio.seek(start)
+            try:
+                conn.putrequest("POST", self.base_path + path, skip_accept_encoding=True)
+                for name, value in headers.items():
+                    conn.putheader(name, value)
+                conn.endheaders()
+                while chunk := audio.read(CHUNK_SIZE):
+                    conn.send(chunk)
+                response = conn.getresponse()
+                body = response.read()
+            except _STALE_ERRORS:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return response.status, body
+        raise AssertionError("unreachable")
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            with self._lock:
+                self.reused += 1
+            return conn, True
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        with self._lock:
+            self.connections += 1
+        return cls(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _failed(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "failures": self.failures, "connections": self.connections,
+                    "connections_reused": self.reused, "connections_idle": self._idle.qsize()}
+
+
+stt = SttClient()
+
+
+def text_block(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text, "source": "voice"}
+
+
+def title_from(text: str) -> str:
+    title = text.split("\n", 1)[0]
+    if len(title) <= TITLE_CHARS:
+        return title
+    return title[:TITLE_CHARS].rsplit(" ", 1)[0] + "…"
+
+
+def dictate(db: Session, canvas_id: str, crud: BaseCRUD, audio: BinaryIO, content_type: Optional[str], *,
+            entity_id: Optional[str] = None, anchor_id: Optional[str] = None, title: Optional[str] = None,
+            model: Optional[str] = None) -> Tuple[str, Any, bool]:
+    """
+    Распознать запись и дописать текст в элемент entity_id или создать новый
+    (рядом с anchor_id); вернуть текст, элемент и признак создания.
+    """
+    # Элемент проверяется до распознавания: оно занимает основное время
+    if entity_id is not None:
+        crud.get_or_404(db, entity_id, canvas_id)
+    # Соединение с БД не держится, пока идет распознавание
+    db.rollback()
+    try:
+        text = stt.transcribe(audio, content_type, model)
+    except SttError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if not text:
+        raise HTTPException(status_code=422, detail="Речь не распознана")
+
+    if entity_id is not None:
+        obj = crud.get_or_404(db, entity_id, canvas_id)
+        content: List = list(obj.content or [])
+        return text, crud.update(db, entity_id, canvas_id, {"content": [*content, text_block(text)]}), False
+    data = {"title": title or title_from(text), "content": [text_block(text)]}
+    if anchor_id:
+        data["anchor_id"] = anchor_id
+    return text, crud.create(db, canvas_id, data), True
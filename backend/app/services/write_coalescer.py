@@ -0,0 +1,230 @@
+"""
+Слияние частых изменений положения карточек.
+
+При перетаскивании клиент шлет PUT с x/y/z_index много раз подряд. Такие
+запросы не пишут в БД сами: последнее значение каждого поля запоминается в
+буфере воркера (offer), ответ собирается из снимка entity_cache и буфера, а
+фоновый поток раз в окно (COALESCE_WINDOW_MS) записывает весь буфер одной
+транзакцией - executemany по первичному ключу на таблицу и холст.
+
+Остальные записи сначала забирают из буфера отложенные поля своих карточек
+(take), чтобы старое положение не перезаписало более новое. Списки и ETag
+видят новое положение после сброса буфера, то есть с задержкой до одного окна.
+
+Буфер у каждого воркера свой, и PUT одной карточки могут попасть в разные
+воркеры, которые сбрасывают буферы независимо. Поэтому у каждого положения
+есть номер - время приема запроса (position_seq), он пишется в колонку
+pos_seq, и UPDATE при сбросе не трогает строку, если в ней уже более новое
+положение. Прочие записи координат (PUT с другими полями, PATCH, раскладка)
+тоже ставят pos_seq.
+Без запущенного потока (скрипты, тесты, COALESCE_WINDOW_MS=0) буфер не
+используется и запись идет сразу.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, or_, update
+
+from ..models import Note, Task
+from . import entity_cache, http_cache, placement
+
+logger = logging.getLogger(__name__)
+
+# Поля, изменения которых сливаются
+POSITION_FIELDS = frozenset({"x", "y", "z_index"})
+
+# Окно слияния; 0 - писать сразу
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW_MS", "100")) / 1000
+
+MODELS = {model.__tablename__: model for model in (Task, Note)}
+
+Key = Tuple[str, str]
+
+
+def position_seq() -> int:
+    """Номер положения: более позднее изменение - больший номер во всех воркерах"""
+    return time.time_ns()
+
+
+def stamp(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля записи с pos_seq, если среди них есть положение"""
+    if data.keys() & POSITION_FIELDS:
+        return {**data, "pos_seq": position_seq()}
+    return data
+
+
+class WriteCoalescer:
+    """Буфер последних положений карточек и поток, сбрасывающий его в БД"""
+
+    def __init__(self, window: float = COALESCE_WINDOW):
+        self.window = window
+        # (таблица, id) -> (холст, поля, pos_seq последнего изменения)
+        self._pending: Dict[Key, Tuple[str, Dict[str, Any], int]] = {}
+        self._lock = threading.Lock()
+        # Удерживается, пока буфер пишется в БД
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session_factory = None
+        self.received = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def accepts(self, data: Dict[str, Any]) -> bool:
+        """Запрос меняет только положение и может быть отложен"""
+        return self.enabled and bool(data) and data.keys() <= POSITION_FIELDS
+
+    def offer(self, model, canvas_id: str, entity_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Запомнить поля; вернуть все отложенные поля карточки"""
+        key = (model.__tablename__, entity_id)
+        seq = position_seq()
+        with self._lock:
+            self.received += 1
+            _, pending, _ = self._pending.get(key, (canvas_id, {}, seq))
+            pending = {**pending, **fields}
+            self._pending[key] = (canvas_id, pending, seq)
+            return dict(pending)
+
+    def pending(self, model, entity_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._pending.get((model.__tablename__, entity_id))
+        return dict(item[1]) if item else None
+
+    def take(self, model, entity_ids: Iterable[str],
+             fields: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Забрать отложенные поля карточек (все или только fields) для записи в
+        текущем запросе.
+
+        Дожидается идущего сброса: иначе он может закоммитить старое положение
+        после записи запроса. Вызывать до записи в транзакции.
+        """
+        if not self.enabled and not self._pending:
+            return {}
+        table_name = model.__tablename__
+        fields = POSITION_FIELDS if fields is None else frozenset(fields)
+        taken = {}
+        with self._flush_lock, self._lock:
+            for entity_id in entity_ids:
+                key = (table_name, entity_id)
+                item = self._pending.get(key)
+                if item is None:
+                    continue
+                canvas_id, pending, seq = item
+                taken[entity_id] = {field: value for field, value in pending.items() if field in fields}
+                rest = {field: value for field, value in pending.items() if field not in fields}
+                if rest:
+                    self._pending[key] = (canvas_id, rest, seq)
+                else:
+                    del self._pending[key]
+        return taken
+
+    def max_z_index(self, canvas_id: str) -> Optional[int]:
+        """Наибольший отложенный z_index холста - его еще нет в БД"""
+        with self._lock:
+            values = [fields["z_index"] for item_canvas_id, fields, _ in self._pending.values()
+                      if item_canvas_id == canvas_id and fields.get("z_index") is not None]
+        return max(values) if values else None
+
+    def start(self, session_factory) -> None:
+        if self.window <= 0 or self._thread is not None:
+            return
+        self._session_factory = session_factory
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="write-coalescer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        # Остаток буфера - синхронно, до закрытия пула соединений
+        if self._session_factory is not None:
+            self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "pending": pending,
+            "received": self.received,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failures": self.failures,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.window):
+            self.flush()
+
+    def flush(self) -> int:
+        """Записать буфер одной транзакцией; при ошибке вернуть его обратно"""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        # executemany требует одинаковых параметров: группы по холсту и набору полей
+        groups: Dict[Tuple[str, str, Tuple[str, ...]], List[Dict[str, Any]]] = {}
+        for (table_name, entity_id), (canvas_id, fields, seq) in batch.items():
+            names = tuple(sorted(fields))
+            groups.setdefault((table_name, canvas_id, names), []).append(
+                {"b_id": entity_id, "b_seq": seq, **{f"b_{name}": fields[name] for name in names}})
+        try:
+            with self._session_factory() as db:
+                changed = set()
+                for (table_name, canvas_id, names), rows in groups.items():
+                    table = MODELS[table_name].__table__
+                    # Строки удаленных карточек и более новые положения из других воркеров не меняются
+                    stmt = update(table).where(
+                        table.c.id == bindparam("b_id"), table.c.canvas_id == canvas_id,
+                        or_(table.c.pos_seq.is_(None), table.c.pos_seq < bindparam("b_seq")),
+                    ).values(pos_seq=bindparam("b_seq"), **{name: bindparam(f"b_{name}") for name in names})
+                    db.connection().execute(stmt, rows)
+                    changed.add((table_name, canvas_id))
+                    entity_cache.mark_changed(db, [(table_name, row["b_id"]) for row in rows])
+                http_cache.bump_versions(db.connection(), sorted(changed))
+                db.commit()
+        except Exception as e:
+            logger.warning("Position flush failed, %d rows requeued: %s", len(batch), e)
+            self.failures += 1
+            with self._lock:
+                # Значения, пришедшие во время записи, новее
+                for key, (canvas_id, fields, seq) in batch.items():
+                    _, newer, newer_seq = self._pending.get(key, (canvas_id, {}, seq))
+                    self._pending[key] = (canvas_id, {**fields, **newer}, newer_seq)
+            return 0
+        self.flushes += 1
+        self.rows_written += len(batch)
+        self._update_placement(batch, changed)
+        return len(batch)
+
+    def _update_placement(self, batch: Dict[Key, Tuple[str, Dict[str, Any], int]], changed) -> None:
+        """Внести новые положения в индекс свободных мест, чтобы следующее создание его не перестраивало"""
+        moved: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (_, entity_id), (canvas_id, fields, _) in batch.items():
+            moved.setdefault(canvas_id, {})[entity_id] = fields
+        try:
+            with self._session_factory() as db:
+                for canvas_id, fields in moved.items():
+                    bumped = sum(1 for _, changed_canvas in changed if changed_canvas == canvas_id)
+                    placement.apply_changes(db, canvas_id, bumped, moved=fields)
+        except Exception as e:
+            logger.warning("Placement index update failed: %s", e)
+
+
+coalescer = WriteCoalescer()
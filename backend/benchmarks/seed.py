@@ -0,0 +1,101 @@
+"""
+Генерация синтетических холстов для нагрузочных тестов.
+
+Холст размера N содержит N карточек (задачи и заметки в заданной пропорции),
+дерево подзадач, связи задач (в т.ч. на заметки) и связи заметок. Плотность
+связей задается средним числом исходящих связей на карточку.
+"""
+import random
+import uuid
+from typing import Dict, List
+
+from sqlalchemy import delete
+from sqlalchemy.engine import Engine
+
+from app.models import Canvas, Note, NoteLink, Task, TaskLink
+
+BATCH_SIZE = 5000
+
+WORDS = [
+    "договор", "релиз", "дизайн", "бюджет", "клиент", "отчет", "встреча", "макет",
+    "сервер", "миграция", "тест", "документация", "план", "идея", "исследование", "ошибка",
+]
+
+LINK_TYPES = ["depends_on", "blocks", "follows", "related_to"]
+
+
+def _title(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def _content(rng: random.Random) -> List[Dict]:
+    return [{"type": "paragraph", "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))}]
+
+
+def _insert(connection, table, rows: List[Dict]) -> None:
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(table.insert(), rows[start:start + BATCH_SIZE])
+
+
+def seed_board(engine: Engine, canvas_id: str, size: int, note_ratio: float = 0.5,
+               link_density: float = 1.5, subtask_ratio: float = 0.2, seed: int = 42) -> Dict[str, int]:
+    """Пересоздать холст canvas_id и заполнить его синтетическими данными"""
+    rng = random.Random(seed)
+    n_notes = int(size * note_ratio)
+    n_tasks = size - n_notes
+    columns = max(1, int(size ** 0.5))
+
+    def position(i: int) -> Dict[str, int]:
+        return {"x": (i % columns) * 340, "y": (i // columns) * 240}
+
+    task_ids = [str(uuid.uuid4()) for _ in range(n_tasks)]
+    note_ids = [str(uuid.uuid4()) for _ in range(n_notes)]
+
+    tasks = []
+    for i, task_id in enumerate(task_ids):
+        # Родитель всегда создан раньше, как при ручном создании подзадач
+        parent_id = task_ids[rng.randrange(i)] if i and rng.random() < subtask_ratio else None
+        tasks.append({
+            "id": task_id, "canvas_id": canvas_id, "title": _title(rng), "content": _content(rng),
+            "z_index": i + 1, "width": 300, "height": 200, "parent_id": parent_id, "task_type": "task",
+            **position(i),
+        })
+
+    notes = []
+    for i, note_id in enumerate(note_ids):
+        notes.append({
+            "id": note_id, "canvas_id": canvas_id, "title": _title(rng), "content": _content(rng),
+            "z_index": n_tasks + i + 1, "width": 300, "height": 200,
+            "task_id": rng.choice(task_ids) if task_ids and rng.random() < 0.3 else None,
+            "note_type": "note", **position(n_tasks + i),
+        })
+
+    task_links = []
+    if task_ids:
+        for _ in range(int(n_tasks * link_density)):
+            to_note = note_ids and rng.random() < 0.25
+            task_links.append({
+                "canvas_id": canvas_id, "source_id": rng.choice(task_ids),
+                "target_id": rng.choice(note_ids) if to_note else rng.choice(task_ids),
+                "link_type": rng.choice(LINK_TYPES), "link_target_type": "note" if to_note else "task",
+            })
+
+    note_links = []
+    if len(note_ids) > 1:
+        for _ in range(int(n_notes * link_density * 0.6)):
+            source_id, target_id = rng.sample(note_ids, 2)
+            note_links.append({"canvas_id": canvas_id, "source_id": source_id,
+                               "target_id": target_id, "link_type": "linked_to"})
+
+    with engine.begin() as connection:
+        connection.execute(delete(Canvas.__table__).where(Canvas.__table__.c.id == canvas_id))
+        # SQLite не выполняет ON DELETE CASCADE без PRAGMA foreign_keys
+        for model in (NoteLink, TaskLink, Note, Task):
+            connection.execute(delete(model.__table__).where(model.__table__.c.canvas_id == canvas_id))
+        connection.execute(Canvas.__table__.insert().values(id=canvas_id, title=f"Benchmark {size}"))
+        _insert(connection, Task.__table__, tasks)
+        _insert(connection, Note.__table__, notes)
+        _insert(connection, TaskLink.__table__, task_links)
+        _insert(connection, NoteLink.__table__, note_links)
+
+    return {"tasks": n_tasks, "notes": n_notes, "task_links": len(task_links), "note_links": len(note_links)}
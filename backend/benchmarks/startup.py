@@ -0,0 +1,101 @@
+"""
+Замер времени старта воркера.
+
+    python -m benchmarks.startup --runs 5 [--top 15] [--output startup.json]
+
+Для каждого прогона в отдельном процессе запускается uvicorn с app.main:app и
+замеряется время до первого успешного ответа /api/health, а также время импорта
+app.main. С --top выводятся самые дорогие модули по данным python -X importtime.
+БД должна быть подготовлена заранее (python -m app.init_db): воркер ее не трогает.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_ready(timeout: float = 30.0) -> float:
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                connection.request("GET", "/api/health")
+                if connection.getresponse().status == 200:
+                    return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("Воркер не ответил за отведенное время")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def import_profile(top: int):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=BACKEND_DIR,
+                            check=True, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if parts[0].isdigit():
+            rows.append({"module": parts[2].strip(), "self_ms": int(parts[0]) / 1000,
+                         "cumulative_ms": int(parts[1]) / 1000})
+    return sorted(rows, key=lambda row: row["self_ms"], reverse=True)[:top]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="benchmarks.startup", description="Время старта воркера")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="показать N самых дорогих импортов")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.join(BACKEND_DIR, "static"), exist_ok=True)
+    imports = [measure_import() for _ in range(args.runs)]
+    ready = [measure_ready() for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "import_ms": {"median": round(statistics.median(imports) * 1000, 1), "max": round(max(imports) * 1000, 1)},
+        "ready_ms": {"median": round(statistics.median(ready) * 1000, 1), "max": round(max(ready) * 1000, 1)},
+    }
+    if args.top:
+        report["top_imports"] = import_profile(args.top)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Общие фикстуры: приложение на SQLite во временном каталоге.
+
+Переменные окружения задаются до импорта app - database.py создает engine
+при импорте, а main.py монтирует static и media из текущего каталога.
+"""
+import os
+import tempfile
+import uuid
+from pathlib import Path
+
+WORK_DIR = Path(tempfile.mkdtemp(prefix="holst-tests-"))
+(WORK_DIR / "static").mkdir()
+(WORK_DIR / "media").mkdir()
+os.chdir(WORK_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{WORK_DIR / 'test.db'}"
+os.environ.setdefault("ACCESS_LOG", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.init_db import init_db
+
+init_db()
+
+from app.main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def canvas_id(client):
+    """Отдельный холст на тест - тесты не видят данные друг друга"""
+    canvas_id = f"t-{uuid.uuid4().hex[:12]}"
+    client.post("/api/canvases", json={"id": canvas_id, "title": canvas_id}).raise_for_status()
+    return canvas_id
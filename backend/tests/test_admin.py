@@ -0,0 +1,24 @@
+import pytest
+
+from app.services import profiler
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", "secret")
+    return "secret"
+
+
+def test_admin_token_required(client, admin_token):
+    assert client.post("/api/admin/integrity/sweep").status_code == 403
+    assert client.post("/api/admin/integrity/sweep", headers={"X-Admin-Token": "secre"}).status_code == 403
+    response = client.post("/api/admin/integrity/sweep", params={"dry_run": True},
+                           headers={"X-Admin-Token": admin_token})
+    assert response.status_code == 200
+    assert "task_links" in response.json()
+
+
+def test_admin_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", None)
+    assert client.post("/api/admin/integrity/sweep", headers={"X-Admin-Token": ""}).status_code == 403
+    assert not profiler.is_admin("")
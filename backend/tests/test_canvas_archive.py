@@ -0,0 +1,107 @@
+import io
+import json
+import tarfile
+
+import pytest
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import File
+from app.services import canvas_archive
+
+
+def _export(client, canvas_id):
+    response = client.get("/api/canvas/export", params={"canvas_id": canvas_id})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    return response.content
+
+
+def _archive(*members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+MANIFEST = ("manifest.json", json.dumps({"format": "holst-canvas", "version": canvas_archive.FORMAT_VERSION}).encode())
+
+
+def _import(client, archive, **data):
+    return client.post("/api/canvas/import", files={"file": ("canvas.tar.gz", archive)}, data=data)
+
+
+def test_round_trip(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    root = client.post("/api/cards", params=params, json={"title": "root", "x": 10, "y": 20}).json()
+    child = client.post("/api/cards", params=params, json={"title": "child", "parent_id": root["id"]}).json()
+    note = client.post("/api/notes", params=params, json={"title": "note", "content": [{"text": "body"}]}).json()
+    other = client.post("/api/notes", params=params, json={"title": "other"}).json()
+    client.post("/api/task-links", params=params, json={
+        "source_id": root["id"], "target_id": note["id"], "link_target_type": "note"}).raise_for_status()
+    client.post("/api/note-links", params=params, json={
+        "source_id": note["id"], "target_id": other["id"]}).raise_for_status()
+    client.post(f"/api/cards/{root['id']}/files", params=params,
+                files={"file": ("a.txt", b"attachment")}).raise_for_status()
+
+    response = _import(client, _export(client, canvas_id), title="copy")
+    assert response.status_code == 200
+    imported = response.json()
+    copy = {"canvas_id": imported["canvas_id"]}
+    assert imported["canvas_id"] != canvas_id
+    assert client.get(f"/api/canvases/{imported['canvas_id']}").json()["title"] == "copy"
+
+    cards = {card["title"]: card for card in client.get("/api/cards", params=copy).json()}
+    notes = {n["title"]: n for n in client.get("/api/notes", params=copy).json()}
+    assert set(cards) == {"root", "child"} and set(notes) == {"note", "other"}
+    # Новые id, ссылки между строками переписаны на них
+    assert cards["root"]["id"] != root["id"]
+    assert (cards["root"]["x"], cards["root"]["y"]) == (10, 20)
+    assert cards["child"]["parent_id"] == cards["root"]["id"]
+    assert client.get(f"/api/notes/{notes['note']['id']}", params=copy).json()["content"] == [{"text": "body"}]
+    task_links = client.get("/api/task-links", params=copy).json()
+    assert [(link["source_id"], link["target_id"]) for link in task_links] == \
+        [(cards["root"]["id"], notes["note"]["id"])]
+    note_links = client.get("/api/note-links", params=copy).json()
+    assert [(link["source_id"], link["target_id"]) for link in note_links] == \
+        [(notes["note"]["id"], notes["other"]["id"])]
+
+    with SessionLocal() as db:
+        record = db.execute(select(File).where(File.canvas_id == imported["canvas_id"])).scalar_one()
+    assert record.task_id == cards["root"]["id"]
+    url = client.get(f"/api/files/{record.id}/download", params=copy).json()["url"]
+    assert client.get(url).content == b"attachment"
+
+    # Исходный холст не изменился
+    assert len(client.get("/api/cards", params=params).json()) == 2
+
+
+def test_export_missing_canvas(client):
+    assert client.get("/api/canvas/export", params={"canvas_id": "missing"}).status_code == 404
+
+
+def test_import_rejects_garbage(client):
+    response = _import(client, b"not a tar archive")
+    assert response.status_code == 400
+
+
+def test_export_of_deleted_canvas_fails_cleanly(tmp_path):
+    # Холст удален между проверкой в обработчике и записью архива
+    with pytest.raises(canvas_archive.ArchiveError):
+        b"".join(canvas_archive.stream_export(SessionLocal, "missing", tmp_path))
+
+
+@pytest.mark.parametrize("members", [
+    [MANIFEST, ("tasks.ndjson", b"")],
+    [MANIFEST],
+    [MANIFEST, ("canvas.json", b"{}"), ("canvas.json", b"{}")],
+])
+def test_import_requires_single_canvas_json(client, members):
+    canvases = len(client.get("/api/canvases").json())
+    response = _import(client, _archive(*members))
+    assert response.status_code == 400
+    assert "canvas.json" in response.json()["detail"]
+    assert len(client.get("/api/canvases").json()) == canvases
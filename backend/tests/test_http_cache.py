@@ -0,0 +1,33 @@
+def test_conditional_get(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    card = client.post("/api/cards", params=params, json={"title": "a"}).json()
+
+    first = client.get("/api/cards", params=params)
+    etag = first.headers["etag"]
+    cached = client.get("/api/cards", params=params, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    # Запись меняет версию таблицы холста - ответ снова полный
+    client.put(f"/api/cards/{card['id']}", params=params, json={"title": "b"}).raise_for_status()
+    fresh = client.get("/api/cards", params=params, headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
+    assert [c["title"] for c in fresh.json()] == ["b"]
+
+
+def test_etag_is_per_canvas(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    etag = client.get("/api/notes", params=params).headers["etag"]
+    client.post("/api/notes", params={"canvas_id": "default"}, json={"title": "elsewhere"}).raise_for_status()
+    assert client.get("/api/notes", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_delete_invalidates(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    note = client.post("/api/notes", params=params, json={"title": "n"}).json()
+    etag = client.get("/api/notes", params=params).headers["etag"]
+    client.delete(f"/api/notes/{note['id']}", params=params).raise_for_status()
+    response = client.get("/api/notes", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json() == []
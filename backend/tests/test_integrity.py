@@ -0,0 +1,45 @@
+from sqlalchemy import insert, select
+
+from app.database import engine
+from app.models import TaskLink
+from app.services import integrity
+
+
+def test_sweep_removes_dangling_links(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    a = client.post("/api/cards", params=params, json={"title": "a"}).json()
+    b = client.post("/api/cards", params=params, json={"title": "b"}).json()
+    note = client.post("/api/notes", params=params, json={"title": "n"}).json()
+    client.post("/api/task-links", params=params, json={
+        "source_id": a["id"], "target_id": b["id"], "link_target_type": "task"}).raise_for_status()
+    with engine.begin() as connection:
+        connection.execute(insert(TaskLink.__table__), [
+            # Цель удалена
+            {"canvas_id": canvas_id, "source_id": a["id"], "target_id": "missing",
+             "link_type": "depends_on", "link_target_type": "task"},
+            # Цель - заметка, а тип указан task
+            {"canvas_id": canvas_id, "source_id": a["id"], "target_id": note["id"],
+             "link_type": "depends_on", "link_target_type": "task"},
+        ])
+
+    report = integrity.scan(engine, canvas_id)
+    assert report["task_links"] == 2
+    assert report["retype_to_note"] == 1
+
+    report = integrity.sweep(engine, canvas_id=canvas_id)
+    assert report["retype_to_note"] == 1
+    assert report["task_links"] == 1
+    with engine.connect() as connection:
+        rows = connection.execute(select(TaskLink.target_id, TaskLink.link_target_type).where(
+            TaskLink.canvas_id == canvas_id).order_by(TaskLink.id)).all()
+    assert [tuple(row) for row in rows] == [(b["id"], "task"), (note["id"], "note")]
+    assert integrity.scan(engine, canvas_id)["task_links"] == 0
+
+
+def test_scan_is_scoped_to_canvas(client, canvas_id):
+    with engine.begin() as connection:
+        connection.execute(insert(TaskLink.__table__), {
+            "canvas_id": canvas_id, "source_id": "gone", "target_id": "gone",
+            "link_type": "depends_on", "link_target_type": "task"})
+    assert integrity.scan(engine, canvas_id)["task_links"] == 1
+    assert integrity.scan(engine, "default")["task_links"] == 0
@@ -0,0 +1,20 @@
+def test_force_layout(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    a = client.post("/api/notes", params=params, json={"title": "a", "x": 0, "y": 0}).json()
+    b = client.post("/api/notes", params=params, json={"title": "b", "x": 0, "y": 0}).json()
+    client.post("/api/note-links", params=params, json={"source_id": a["id"], "target_id": b["id"]}).raise_for_status()
+    response = client.post("/api/canvas/layout", params=params,
+                           json={"algorithm": "force", "iterations": 10, "dry_run": True})
+    assert response.status_code == 200
+    positions = {p["id"]: (p["x"], p["y"]) for p in response.json()["positions"]}
+    assert positions.keys() == {a["id"], b["id"]}
+    assert positions[a["id"]] != positions[b["id"]]
+
+
+def test_invalid_request(client, canvas_id):
+    params = {"canvas_id": canvas_id}
+    for body in ({"algorithm": "force", "iterations": "abc"}, {"algorithm": "force", "iterations": 0},
+                 {"algorithm": "force", "iterations": 10**6}):
+        assert client.post("/api/canvas/layout", params=params, json=body).status_code == 422
+    assert client.post("/api/canvas/layout", params=params, json={"algorithm": "spiral"}).status_code == 400
+    assert client.post("/api/canvas/layout", params=params, json={"root_id": "missing"}).status_code == 404
@@ -0,0 +1,92 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+from app.database import SessionLocal
+from app.models import Task
+
+
+def _sync(client, canvas_id, ops, client_id="device", cursor=None):
+    response = client.post("/api/sync", params={"canvas_id": canvas_id},
+                           json={"client_id": client_id, "cursor": cursor, "ops": ops})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _op(type, action, id, fields=None, **extra):
+    return {"op_id": uuid.uuid4().hex, "type": type, "action": action, "id": id, "fields": fields or {}, **extra}
+
+
+def _ts(delta: timedelta) -> str:
+    return (datetime.now(timezone.utc) + delta).isoformat()
+
+
+def _edited_on_server(client, canvas_id, card_id, fields, ago: timedelta):
+    """Изменение сервера, сделанное ago назад (у SQLite updated_at с точностью до секунды)"""
+    client.put(f"/api/cards/{card_id}", params={"canvas_id": canvas_id}, json=fields).raise_for_status()
+    with SessionLocal() as db:
+        db.execute(update(Task).where(Task.id == card_id).values(
+            updated_at=(datetime.now(timezone.utc) - ago).replace(tzinfo=None)))
+        db.commit()
+
+
+def test_replay_is_idempotent(client, canvas_id):
+    ops = [
+        _op("task", "create", "card-1", {"title": "offline"}),
+        _op("note", "create", "note-1", {"title": "n"}),
+        _op("task_link", "create", "tmp-link", {"source_id": "card-1", "target_id": "note-1",
+                                                "link_target_type": "note"}),
+    ]
+    first = _sync(client, canvas_id, ops)
+    assert [r["status"] for r in first["results"]] == ["applied"] * 3
+    assert first["reset"] is True
+
+    # Повтор после обрыва: те же op_id - те же результаты, без новых строк
+    second = _sync(client, canvas_id, ops, cursor=first["cursor"])
+    assert second["results"] == first["results"]
+    params = {"canvas_id": canvas_id}
+    assert len(client.get("/api/cards", params=params).json()) == 1
+    assert len(client.get("/api/notes", params=params).json()) == 1
+    assert len(client.get("/api/task-links", params=params).json()) == 1
+
+
+def test_changes_since_cursor(client, canvas_id):
+    cursor = _sync(client, canvas_id, [])["cursor"]
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "server"}).json()
+    client.delete(f"/api/cards/{card['id']}", params={"canvas_id": canvas_id}).raise_for_status()
+    response = _sync(client, canvas_id, [], cursor=cursor)
+    assert response["reset"] is False
+    assert response["changes"]["deleted"]["tasks"] == [card["id"]]
+
+
+def test_later_client_change_wins(client, canvas_id):
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "v1"}).json()
+    _edited_on_server(client, canvas_id, card["id"], {"title": "server"}, timedelta(hours=1))
+
+    # Клиент видел v1 и изменил поле позже сервера
+    op = _op("task", "update", card["id"], {"title": "client"}, prev={"title": "v1"}, ts=_ts(-timedelta(minutes=5)))
+    result = _sync(client, canvas_id, [op])["results"][0]
+    assert result["status"] == "applied"
+    assert client.get(f"/api/cards/{card['id']}", params={"canvas_id": canvas_id}).json()["title"] == "client"
+
+
+def test_earlier_client_change_loses(client, canvas_id):
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "v1", "width": 200}).json()
+    _edited_on_server(client, canvas_id, card["id"], {"title": "server"}, timedelta(minutes=5))
+
+    # Изменение сделано офлайн час назад: title уступает серверу, не конфликтующее поле применяется
+    op = _op("task", "update", card["id"], {"title": "client", "width": 300},
+             prev={"title": "v1", "width": 200}, ts=_ts(-timedelta(hours=1)))
+    result = _sync(client, canvas_id, [op])["results"][0]
+    assert result["status"] == "merged"
+    assert result["conflicts"] == ["title"]
+    stored = client.get(f"/api/cards/{card['id']}", params={"canvas_id": canvas_id}).json()
+    assert (stored["title"], stored["width"]) == ("server", 300)
+
+
+def test_delete_beats_update(client, canvas_id):
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "gone"}).json()
+    client.delete(f"/api/cards/{card['id']}", params={"canvas_id": canvas_id}).raise_for_status()
+    op = _op("task", "update", card["id"], {"title": "late"}, prev={"title": "gone"})
+    assert _sync(client, canvas_id, [op])["results"][0]["status"] == "deleted"
@@ -0,0 +1,56 @@
+from sqlalchemy import update
+
+from app.database import SessionLocal
+from app.models import Task
+from app.services.write_coalescer import WriteCoalescer, position_seq
+
+
+def _coalescer():
+    # Без потока: сброс вызывается из теста
+    coalescer = WriteCoalescer(window=0)
+    coalescer._session_factory = SessionLocal
+    return coalescer
+
+
+def _row(card_id):
+    with SessionLocal() as db:
+        task = db.get(Task, card_id)
+        return task.x, task.y, task.pos_seq
+
+
+def test_flush_writes_last_position(client, canvas_id):
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "a", "x": 0, "y": 0}).json()
+    coalescer = _coalescer()
+    coalescer.offer(Task, canvas_id, card["id"], {"x": 10})
+    assert coalescer.offer(Task, canvas_id, card["id"], {"y": 20}) == {"x": 10, "y": 20}
+    assert coalescer.flush() == 1
+    x, y, seq = _row(card["id"])
+    assert (x, y) == (10, 20) and seq is not None
+    assert coalescer.flush() == 0
+
+
+def test_older_position_does_not_overwrite_newer(client, canvas_id):
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "a", "x": 0, "y": 0}).json()
+    coalescer = _coalescer()
+    coalescer.offer(Task, canvas_id, card["id"], {"x": 10, "y": 10})
+    # Тем временем другой воркер записал более новое положение
+    with SessionLocal() as db:
+        db.execute(update(Task).where(Task.id == card["id"]).values(x=99, y=99, pos_seq=position_seq()))
+        db.commit()
+    coalescer.flush()
+    assert _row(card["id"])[:2] == (99, 99)
+
+    coalescer.offer(Task, canvas_id, card["id"], {"x": 5})
+    coalescer.flush()
+    assert _row(card["id"])[:2] == (5, 99)
+
+
+def test_take_removes_pending_fields(client, canvas_id):
+    card = client.post("/api/cards", params={"canvas_id": canvas_id}, json={"title": "a", "x": 0, "y": 0}).json()
+    coalescer = _coalescer()
+    coalescer.offer(Task, canvas_id, card["id"], {"x": 7, "z_index": 3})
+    assert coalescer.max_z_index(canvas_id) == 3
+    assert coalescer.take(Task, [card["id"]], ["x"]) == {card["id"]: {"x": 7}}
+    assert coalescer.pending(Task, card["id"]) == {"z_index": 3}
+    coalescer.flush()
+    assert _row(card["id"])[:2] == (0, 0)
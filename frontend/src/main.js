@@ -1,3 +1,4 @@
+import axios from 'axios'
 import { createPinia } from 'pinia'
 import { createApp } from 'vue'
 import App from './App.vue'
@@ -23,6 +24,12 @@ konvaClasses.forEach(className => {
   }
 });
 
+// Идентификатор вкладки редактора: по нему nginx не отдает редактору ответы
+// из кэша (после записи видно свежее состояние)
+// (crypto.randomUUID есть только на https и localhost)
+axios.defaults.headers.common['X-Client-Id'] = globalThis.crypto?.randomUUID?.()
+  ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+
 const app = createApp(App)
 app.use(createPinia())
 app.use(router)
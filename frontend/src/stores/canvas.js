@@ -38,6 +38,7 @@ export const useCanvasStore = defineStore('canvas', {
           const maxZResponse = await axios.get('/api/max-z-index')
           cardData.z_index = maxZResponse.data.max_z_index + 1
         }
+        // Без x/y сервер сам подберет свободное место рядом с последним элементом
         const response = await axios.post('/api/cards', cardData)
         this.cards.push(response.data)
         return response.data
@@ -79,6 +80,7 @@ export const useCanvasStore = defineStore('canvas', {
           const maxZResponse = await axios.get('/api/max-z-index')
           noteData.z_index = maxZResponse.data.max_z_index + 1
         }
+        // Без x/y сервер сам подберет свободное место рядом с последним элементом
         const response = await axios.post('/api/notes', noteData)
         this.notes.push(response.data)
         return response.data
@@ -114,6 +116,33 @@ export const useCanvasStore = defineStore('canvas', {
       }
     },
 
+    // Диктовка: запись распознается и попадает в новую заметку/задачу
+    // (или дописывается в entityId) одним запросом
+    async dictate(audio, { kind = 'note', entityId, anchorId, title, model } = {}) {
+      try {
+        const form = new FormData()
+        form.append('audio', audio)
+        form.append('kind', kind)
+        if (entityId) form.append('entity_id', entityId)
+        if (anchorId) form.append('anchor_id', anchorId)
+        if (title) form.append('title', title)
+        if (model) form.append('model', model)
+        const response = await axios.post('/api/voice', form)
+        const list = kind === 'card' ? this.cards : this.notes
+        const element = response.data[kind === 'card' ? 'task' : 'note']
+        const index = list.findIndex(item => item.id === element.id)
+        if (index !== -1) {
+          Object.assign(list[index], element)
+        } else {
+          list.push(element)
+        }
+        return response.data
+      } catch (error) {
+        console.error('Error dictating:', error)
+        throw error
+      }
+    },
+
     setSelectedElement(element) {
       this.selectedElement = element
     },
@@ -0,0 +1,313 @@
+"""
+Подготовка записи к распознаванию: декодирование, 16 кГц моно, обрезка тишины.
+
+Vosk ждет 16-битный PCM 16 кГц моно. WAV (PCM 8/16/24/32 бит и float32) и
+сырой PCM (audio/l16; rate=...; channels=...) разбираются здесь, остальное -
+WebM/Opus и OGG из MediaRecorder, MP3, M4A, FLAC - декодирует ffmpeg в
+отдельном процессе. Все идет потоком: запись читается кусками, и
+распознаватель получает звук по мере декодирования, не дожидаясь конца
+загрузки.
+
+Тишина до речи, после нее и длинные паузы выбрасываются (VAD по энергии
+кадров 30 мс с порогом от уровня шума); у краев речи остается VAD_PADDING_MS.
+"""
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from collections import deque
+
+import numpy as np
+
+TARGET_RATE = 16000
+READ_SIZE = 32 * 1024
+
+FFMPEG = shutil.which("ffmpeg")
+
+# VAD=0 отключает обрезку тишины
+VAD = os.getenv("VAD", "1") == "1"
+VAD_FRAME_MS = 30
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "300"))
+# Кадр - речь, если его RMS выше уровня шума в VAD_RATIO раз и не ниже VAD_MIN_RMS (из 32767)
+VAD_MIN_RMS = float(os.getenv("VAD_MIN_RMS", "300"))
+VAD_RATIO = float(os.getenv("VAD_RATIO", "3"))
+
+# Тип без заголовка: сырой PCM (по умолчанию 16 кГц моно, как раньше)
+RAW_TYPES = {"audio/l16", "audio/pcm", "audio/x-raw", "application/octet-stream", ""}
+
+# Сигнатуры контейнеров, которые разбирает ffmpeg
+_MAGIC = (b"\x1a\x45\xdf\xa3", b"OggS", b"ID3", b"fLaC", b"\xff\xfb", b"\xff\xf3", b"\xff\xf2")
+
+
+class AudioError(Exception):
+    """Формат не поддерживается или запись повреждена"""
+
+
+class AudioStats:
+    """Длительность записи и оставшейся после VAD речи"""
+
+    def __init__(self):
+        self.audio_samples = 0
+        self.speech_samples = 0
+
+    @property
+    def audio_s(self):
+        return round(self.audio_samples / TARGET_RATE, 3)
+
+    @property
+    def speech_s(self):
+        return round(self.speech_samples / TARGET_RATE, 3)
+
+
+def _read_exact(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class _Prefixed:
+    """Поток с уже прочитанным началом"""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size < 0:
+            data, self.head = self.head + self.stream.read(), b""
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
+
+
+class _Limited:
+    """Не больше size байт потока; size=None - до конца"""
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.left = size
+
+    def read(self, size):
+        if self.left is None:
+            return self.stream.read(size)
+        if self.left <= 0:
+            return b""
+        data = self.stream.read(min(size, self.left))
+        self.left -= len(data)
+        return data
+
+
+class Converter:
+    """Куски PCM любого формата -> int16 16 кГц моно, с состоянием между кусками"""
+
+    def __init__(self, dtype, channels, rate):
+        self.dtype = dtype  # numpy dtype, "u1" или "i3"
+        self.channels = max(channels, 1)
+        self.rate = rate
+        self.frame_bytes = self.channels * (3 if dtype == "i3" else np.dtype(dtype).itemsize)
+        self._rest = b""
+        self._carry = None  # отсчеты, не набравшие блок прореживания
+        self._tail = None  # последний отсчет для интерполяции через границу кусков
+        self._pos = 0.0
+
+    def _samples(self, data):
+        """float32 моно в диапазоне int16"""
+        if self.dtype == "i3":
+            raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+            values = (raw[:, 0].astype(np.int32) | raw[:, 1].astype(np.int32) << 8
+                      | raw[:, 2].astype(np.int8).astype(np.int32) << 16).astype(np.float32) / 256
+        else:
+            values = np.frombuffer(data, self.dtype).astype(np.float32)
+            if self.dtype == "u1":
+                values = (values - 128) * 256
+            elif self.dtype == "<i4":
+                values /= 65536
+            elif self.dtype == "<f4":
+                values *= 32767
+        return values.reshape(-1, self.channels).mean(axis=1)
+
+    def _resample(self, x):
+        if self.rate == TARGET_RATE:
+            return x
+        if self.rate % TARGET_RATE == 0:
+            # 32/48 кГц: среднее по блокам - заодно фильтр от наложения спектров
+            factor = self.rate // TARGET_RATE
+            if self._carry is not None:
+                x = np.concatenate([self._carry, x])
+            whole = len(x) - len(x) % factor
+            self._carry = x[whole:]
+            return x[:whole].reshape(-1, factor).mean(axis=1)
+        # Прочие частоты - линейная интерполяция
+        if self._tail is not None:
+            x = np.concatenate([self._tail, x])
+        if len(x) < 2:
+            self._tail = x
+            return x[:0]
+        step = self.rate / TARGET_RATE
+        positions = np.arange(self._pos, len(x) - 1, step)
+        out = np.interp(positions, np.arange(len(x)), x)
+        self._pos = (positions[-1] + step if len(positions) else self._pos) - (len(x) - 1)
+        self._tail = x[-1:]
+        return out
+
+    def feed(self, data):
+        data = self._rest + data
+        whole = len(data) - len(data) % self.frame_bytes
+        self._rest = data[whole:]
+        if not whole:
+            return b""
+        out = self._resample(self._samples(data[:whole]))
+        return np.clip(np.rint(out), -32768, 32767).astype("<i2").tobytes()
+
+
+def _wav_format(body):
+    tag, channels, rate = struct.unpack("<HHI", body[:8])
+    bits = struct.unpack("<H", body[14:16])[0]
+    if tag == 0xFFFE and len(body) >= 26:  # WAVE_FORMAT_EXTENSIBLE: формат в SubFormat
+        tag = struct.unpack("<H", body[24:26])[0]
+    dtype = {(1, 8): "u1", (1, 16): "<i2", (1, 24): "i3", (1, 32): "<i4", (3, 32): "<f4"}.get((tag, bits))
+    if dtype is None or not channels or not rate:
+        raise AudioError(f"Неподдерживаемый WAV: формат {tag}, {bits} бит")
+    return dtype, channels, rate
+
+
+def _wav(stream):
+    converter = None
+    while True:
+        header = _read_exact(stream, 8)
+        if len(header) < 8:
+            raise AudioError("В WAV нет блока data")
+        chunk_id, size = header[:4], struct.unpack("<I", header[4:])[0]
+        if chunk_id == b"fmt ":
+            converter = Converter(*_wav_format(_read_exact(stream, size + size % 2)))
+        elif chunk_id == b"data":
+            if converter is None:
+                raise AudioError("В WAV нет блока fmt")
+            # При записи потоком размер не известен: 0 или 0xFFFFFFFF - до конца файла
+            yield from _convert(_Limited(stream, size if 0 < size < 0xFFFFFFFF else None), converter)
+            return
+        else:
+            _read_exact(stream, size + size % 2)
+
+
+def _convert(stream, converter):
+    while chunk := stream.read(READ_SIZE):
+        pcm = converter.feed(chunk)
+        if pcm:
+            yield pcm
+
+
+def _ffmpeg(stream):
+    if FFMPEG is None:
+        raise AudioError("Формат не поддерживается: ffmpeg не установлен")
+    process = subprocess.Popen(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(TARGET_RATE), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    def feed():
+        try:
+            while chunk := stream.read(READ_SIZE):
+                process.stdin.write(chunk)
+        except OSError:
+            pass  # ffmpeg exited on bad input; its stderr has the reason
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    # Upload is written to ffmpeg while its output is already being recognized
+    feeder = threading.Thread(target=feed, name="ffmpeg-feed", daemon=True)
+    feeder.start()
+    try:
+        while chunk := process.stdout.read(READ_SIZE):
+            yield chunk
+        feeder.join()
+        if process.wait() != 0:
+            message = process.stderr.read().decode(errors="replace").strip().splitlines()
+            raise AudioError(f"Не удалось декодировать запись: {message[-1] if message else process.returncode}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def decode(stream, mimetype="", params=None):
+    """Генератор кусков PCM 16 кГц моно (bytes) из записи в любом поддерживаемом формате"""
+    params = params or {}
+    head = _read_exact(stream, 12)
+    stream = _Prefixed(head, stream)
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        _read_exact(stream, 12)
+        return _wav(stream)
+    container = head.startswith(_MAGIC) or head[4:8] == b"ftyp"
+    if mimetype in RAW_TYPES and not container:
+        try:
+            rate = int(params.get("rate", TARGET_RATE))
+            channels = int(params.get("channels", 1))
+        except ValueError:
+            raise AudioError("Некорректные параметры rate/channels")
+        # audio/l16 по RFC 2586 - big-endian, остальное - как пишет Vosk-клиент
+        dtype = ">i2" if mimetype == "audio/l16" and params.get("endianness") != "little-endian" else "<i2"
+        return _convert(stream, Converter(dtype, channels, rate))
+    return _ffmpeg(stream)
+
+
+def trim_silence(chunks, stats=None):
+    """Оставить речь с запасом VAD_PADDING_MS по краям; stats считает длительности"""
+    frame_bytes = TARGET_RATE * VAD_FRAME_MS // 1000 * 2
+    padding = max(VAD_PADDING_MS // VAD_FRAME_MS, 1)
+    waiting = deque(maxlen=padding)  # тихие кадры перед возможным началом речи
+    hangover = 0
+    # Начальный уровень шума низкий: запись может начаться прямо с речи
+    noise = VAD_MIN_RMS / VAD_RATIO
+    rest = b""
+    for chunk in chunks:
+        if stats is not None:
+            stats.audio_samples += len(chunk) // 2
+        if not VAD:
+            if stats is not None:
+                stats.speech_samples += len(chunk) // 2
+            yield chunk
+            continue
+        data = rest + chunk
+        count = len(data) // frame_bytes
+        rest = data[count * frame_bytes:]
+        if not count:
+            continue
+        frames = np.frombuffer(data[:count * frame_bytes], "<i2").reshape(count, -1).astype(np.float32)
+        levels = np.sqrt(np.mean(frames * frames, axis=1))
+        kept = []
+        for index, level in enumerate(levels):
+            frame = data[index * frame_bytes:(index + 1) * frame_bytes]
+            # Уровень шума: сразу вниз, вверх медленно и только по кадрам без речи
+            if level < noise:
+                noise = level
+            speech = level >= max(VAD_MIN_RMS, noise * VAD_RATIO)
+            if not speech:
+                noise += (level - noise) * 0.05
+            if speech:
+                kept.extend(waiting)
+                waiting.clear()
+                kept.append(frame)
+                hangover = padding
+            elif hangover:
+                kept.append(frame)
+                hangover -= 1
+            else:
+                waiting.append(frame)
+        if kept:
+            if stats is not None:
+                stats.speech_samples += len(kept) * frame_bytes // 2
+            yield b"".join(kept)
@@ -0,0 +1,207 @@
+"""
+Модели Vosk и пулы готовых распознавателей.
+
+Модели - подкаталоги MODELS_DIR (имя каталога - имя модели, например
+ru-small, ru-large, en) и, как раньше, каталог model под именем default.
+Запрос выбирает модель параметром model, без него берется DEFAULT_MODEL.
+
+Для каждой модели держится до RECOGNIZER_POOL_SIZE созданных заранее
+KaldiRecognizer: запрос берет свободный, после распознавания он сбрасывается
+(Reset) и возвращается в пул. Если свободных нет, создается лишний, который
+потом просто выбрасывается.
+
+Перезагрузка (POST /models/reload или изменение каталога модели, которое раз в
+MODEL_WATCH_INTERVAL секунд замечает фоновый поток) идет в фоне: новая модель
+загружается и прогревается рядом со старой, затем подменяет ее одним
+присваиванием. Запросы, начатые на старой, дорабатывают на ней; пока идет
+загрузка, в памяти две копии модели.
+"""
+import os
+import queue
+import threading
+import time
+
+import vosk
+
+MODELS_DIR = os.getenv("MODELS_DIR", "models")
+# Каталог единственной модели в старой раскладке
+MODEL_PATH = os.getenv("MODEL_PATH", "model")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "default")
+RECOGNIZER_POOL_SIZE = int(os.getenv("RECOGNIZER_POOL_SIZE", "2"))
+# Проверка каталогов моделей на изменения; 0 - только по запросу
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "30"))
+
+SAMPLE_RATE = 16000
+
+
+class ModelNotFound(Exception):
+    pass
+
+
+def _signature(path):
+    """Время изменения каталога модели и файлов в нем - признак замены"""
+    latest = os.stat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+    return latest
+
+
+class RecognizerPool:
+    """Загруженная модель и ее свободные распознаватели"""
+
+    def __init__(self, name, path, size=RECOGNIZER_POOL_SIZE):
+        self.name = name
+        self.path = path
+        self.signature = _signature(path)
+        started = time.perf_counter()
+        self.model = vosk.Model(path)
+        self._idle = queue.LifoQueue(maxsize=max(size, 1))
+        for _ in range(size):
+            self._idle.put_nowait(self._new())
+        self.load_s = round(time.perf_counter() - started, 3)
+        self.loaded_at = time.time()
+        self.retired = False
+        self.requests = 0
+        self.created = size
+
+    def _new(self):
+        return vosk.KaldiRecognizer(self.model, SAMPLE_RATE)
+
+    def acquire(self):
+        self.requests += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            self.created += 1
+            return self._new()
+
+    def release(self, recognizer):
+        # Распознаватели замененной модели не возвращаются: модель освобождается с последним
+        if self.retired:
+            return
+        recognizer.Reset()
+        try:
+            self._idle.put_nowait(recognizer)
+        except queue.Full:
+            pass
+
+    def stats(self):
+        return {"path": self.path, "idle": self._idle.qsize(), "requests": self.requests,
+                "recognizers_created": self.created, "load_s": self.load_s, "loaded_at": self.loaded_at}
+
+
+class ModelRegistry:
+    """Пулы по именам моделей, фоновая перезагрузка и наблюдение за каталогами"""
+
+    def __init__(self, models_dir=MODELS_DIR, model_path=MODEL_PATH, default=DEFAULT_MODEL):
+        self.models_dir = models_dir
+        self.model_path = model_path
+        self.default = default
+        self._pools = {}
+        self._loading = set()
+        self.errors = {}
+        # Признак каталога, который загрузить не удалось: повторять, только если он изменится
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def paths(self):
+        """Имена и каталоги моделей на диске"""
+        found = {}
+        if os.path.isdir(self.model_path):
+            found["default"] = self.model_path
+        if os.path.isdir(self.models_dir):
+            for name in sorted(os.listdir(self.models_dir)):
+                path = os.path.join(self.models_dir, name)
+                if os.path.isdir(path):
+                    found[name] = path
+        return found
+
+    def names(self):
+        """Загруженные модели"""
+        return list(self._pools)
+
+    def get(self, name=None):
+        """Пул модели name (по умолчанию - DEFAULT_MODEL или единственной загруженной)"""
+        pools = self._pools
+        if name is None:
+            name = next(iter(pools)) if len(pools) == 1 else self.default
+        pool = pools.get(name)
+        if pool is None:
+            raise ModelNotFound(name)
+        return pool
+
+    def load_all(self):
+        """Загрузить все модели синхронно - при старте"""
+        for name, path in self.paths().items():
+            self._load(name, path)
+
+    def reload(self, name=None):
+        """Перезагрузить модель (или все, включая новые каталоги) в фоне; вернуть имена"""
+        paths = self.paths()
+        if name is not None:
+            if name not in paths:
+                raise ModelNotFound(name)
+            paths = {name: paths[name]}
+        for model_name, path in paths.items():
+            threading.Thread(target=self._load, args=(model_name, path),
+                             name=f"model-load-{model_name}", daemon=True).start()
+        return list(paths)
+
+    def _load(self, name, path):
+        with self._lock:
+            if name in self._loading:
+                return
+            self._loading.add(name)
+        try:
+            pool = RecognizerPool(name, path)
+        except Exception as e:
+            try:
+                signature = _signature(path)
+            except OSError:
+                signature = 0
+            with self._lock:
+                self.errors[name] = str(e)
+                self._failed[name] = signature
+            print(f"Model {name} failed to load from {path}: {e}", flush=True)
+            return
+        finally:
+            with self._lock:
+                self._loading.discard(name)
+        # Swap under the lock so concurrent loads of different models don't drop each other's pools;
+        # readers see the old or the new dict, and requests that took the old pool finish on it
+        with self._lock:
+            self.errors.pop(name, None)
+            self._failed.pop(name, None)
+            old = self._pools.get(name)
+            self._pools = {**self._pools, name: pool}
+            if old is not None:
+                old.retired = True
+        print(f"Model {name} loaded from {path} in {pool.load_s}s", flush=True)
+
+    def start_watcher(self, interval=MODEL_WATCH_INTERVAL):
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            for name, path in self.paths().items():
+                try:
+                    pool = self._pools.get(name)
+                    known = self._failed.get(name, pool.signature if pool is not None else None)
+                    if known is None or _signature(path) > known:
+                        self._load(name, path)
+                except OSError:
+                    continue  # the directory is being replaced; next pass picks it up
+
+    def stats(self):
+        return {
+            "default": self.default,
+            "models": {name: pool.stats() for name, pool in self._pools.items()},
+            "loading": sorted(self._loading),
+            "errors": self.errors,
+        }
@@ -0,0 +1,67 @@
+import io
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+import audio
+
+
+def _wav(samples, rate, channels=1, width=2):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(width)
+        out.setframerate(rate)
+        out.writeframes(samples.tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+def _tone(seconds, rate, amplitude=8000):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype("<i2")
+
+
+def _pcm(chunks):
+    return np.frombuffer(b"".join(chunks), "<i2")
+
+
+def test_wav_is_resampled_to_16k_mono():
+    stereo = np.repeat(_tone(1.0, 44100), 2)
+    pcm = _pcm(audio.decode(_wav(stereo, 44100, channels=2), "audio/wav"))
+    assert abs(len(pcm) - audio.TARGET_RATE) <= 2
+    assert 7000 < np.abs(pcm).max() <= 8200
+
+
+def test_raw_pcm_params():
+    samples = _tone(0.5, 8000).astype(">i2")
+    pcm = _pcm(audio.decode(io.BytesIO(samples.tobytes()), "audio/l16", {"rate": "8000"}))
+    assert abs(len(pcm) - audio.TARGET_RATE // 2) <= 2
+
+
+def test_wav_without_data_chunk():
+    header = b"RIFF" + struct.pack("<I", 4) + b"WAVE"
+    with pytest.raises(audio.AudioError):
+        list(audio.decode(io.BytesIO(header), "audio/wav"))
+
+
+def test_trim_silence_keeps_speech_with_padding():
+    rate = audio.TARGET_RATE
+    silence = np.zeros(rate, dtype="<i2")
+    samples = np.concatenate([silence, _tone(1.0, rate), silence, silence])
+    stats = audio.AudioStats()
+    kept = _pcm(audio.trim_silence([samples.tobytes()], stats))
+    assert stats.audio_s == 4.0
+    # Речь целиком и не больше VAD_PADDING_MS тишины с каждой стороны
+    padding = audio.VAD_PADDING_MS / 1000
+    assert 1.0 <= stats.speech_s <= 1.0 + 2 * padding + 2 * audio.VAD_FRAME_MS / 1000
+    assert len(kept) == stats.speech_samples
+
+
+def test_trim_silence_drops_silent_recording():
+    stats = audio.AudioStats()
+    noise = np.random.default_rng(0).normal(0, 20, audio.TARGET_RATE * 2).astype("<i2")
+    assert list(audio.trim_silence([noise.tobytes()], stats)) == []
+    assert stats.speech_samples == 0
@@ -0,0 +1,156 @@
+"""
+Request ID, спаны и JSON-журнал доступа сервиса распознавания.
+
+Формат тот же, что у бэкенда (backend/app/services/tracing.py): trace id и
+родительский спан берутся из traceparent/X-Request-ID от nginx, спаны
+пишутся в TRACE_FILE (JSON Lines) или TRACE_COLLECTOR_URL (OTLP/HTTP JSON).
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import g, request
+
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "holst-voice-stt")
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "1") == "1"
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_HEX32 = re.compile(r"^[0-9a-f]{32}$")
+_export_lock = threading.Lock()
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+def _export(spans):
+    """Спаны одного запроса; выгрузка синхронная - запросов к сервису немного"""
+    try:
+        with _export_lock:
+            if TRACE_FILE:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    for span in spans:
+                        f.write(json.dumps(span, ensure_ascii=False) + "\n")
+        if TRACE_COLLECTOR_URL:
+            payload = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "holst"}, "spans": [_otlp(span) for span in spans]}],
+            }]}
+            req = urllib.request.Request(TRACE_COLLECTOR_URL, data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+            urllib.request.urlopen(req, timeout=5).close()
+    except Exception as e:
+        print(f"Span export failed: {e}", file=sys.stderr)
+
+
+def _otlp(span):
+    otlp = {
+        "traceId": span["trace_id"],
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": 2 if span["kind"] == "server" else 1,
+        "startTimeUnixNano": str(span["start"]),
+        "endTimeUnixNano": str(span["start"] + int(span["duration_ms"] * 1e6)),
+        "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in span["attributes"].items()],
+        "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+    }
+    if span["parent_id"]:
+        otlp["parentSpanId"] = span["parent_id"]
+    return otlp
+
+
+def _span(name, parent_id, kind="internal", **attributes):
+    return {"service": SERVICE_NAME, "name": name, "trace_id": g.trace_id, "span_id": _new_id(8),
+            "parent_id": parent_id, "kind": kind, "start": time.time_ns(), "duration_ms": 0.0,
+            "attributes": attributes, "error": None}
+
+
+def _end(span):
+    span["duration_ms"] = round((time.time_ns() - span["start"]) / 1e6, 3)
+    g.spans.append(span)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Дочерний спан текущего на время блока (например, распознавание)"""
+    if not g.get("sampled"):
+        yield None
+        return
+    child = _span(name, g.span_stack[-1], **attributes)
+    g.span_stack.append(child["span_id"])
+    try:
+        yield child
+    except Exception as e:
+        child["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        g.span_stack.pop()
+        _end(child)
+
+
+def init_app(app):
+    """Request ID, корневой спан и строка журнала доступа на каждый запрос"""
+
+    @app.before_request
+    def _start():
+        g.started = time.perf_counter()
+        request_id = (request.headers.get("X-Request-ID") or "")[:64]
+        match = _TRACEPARENT.match(request.headers.get("traceparent") or "")
+        if match:
+            g.trace_id, parent_id, flags = match.groups()
+            sampled = int(flags, 16) & 1 == 1
+        else:
+            g.trace_id = request_id if _HEX32.match(request_id) else _new_id(16)
+            parent_id = None
+            sampled = random.random() < TRACE_SAMPLE_RATE
+        g.request_id = request_id or g.trace_id
+        g.sampled = sampled and bool(TRACE_FILE or TRACE_COLLECTOR_URL)
+        g.spans = []
+        g.root = _span(f"{request.method} {request.path}", parent_id, kind="server")
+        g.span_stack = [g.root["span_id"]]
+
+    @app.after_request
+    def _finish(response):
+        if "started" not in g:
+            return response
+        response.headers["X-Request-ID"] = g.request_id
+        duration = time.perf_counter() - g.started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        if ACCESS_LOG:
+            print(json.dumps({
+                "ts": datetime.now(timezone.utc).isoformat(),
+                "service": SERVICE_NAME,
+                "request_id": g.request_id,
+                "trace_id": g.trace_id,
+                "method": request.method,
+                "path": request.path,
+                "route": route,
+                "status": response.status_code,
+                "duration_ms": round(duration * 1000, 2),
+                "request_bytes": request.content_length or 0,
+                "response_bytes": response.calculate_content_length() or 0,
+                **g.get("log_fields", {}),
+            }, ensure_ascii=False), flush=True)
+        if g.sampled:
+            g.root["name"] = f"{request.method} {route}"
+            g.root["attributes"].update({"http.method": request.method, "http.route": route,
+                                         "http.status_code": response.status_code, "request_id": g.request_id,
+                                         "http.request_content_length": request.content_length or 0})
+            _end(g.root)
+            _export(g.spans)
+        return response
+
+
+def log_fields(**fields):
+    """Добавить поля в строку журнала доступа текущего запроса"""
+    g.setdefault("log_fields", {}).update(fields)
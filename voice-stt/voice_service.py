@@ -1,59 +1,94 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import vosk
+import hmac
 import json
 import os
-from pathlib import Path
+import time
+
+import audio
+import recognizers
+import tracing
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Request-ID"])
+# Request IDs, spans and JSON access log lines (see tracing.py)
+tracing.init_app(app)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-# Initialize Vosk model (assuming model is downloaded locally)
-MODEL_PATH = "model"
-if not os.path.exists(MODEL_PATH):
+# Vosk models (model/ and models/<name>/) with warm recognizer pools, see recognizers.py
+registry = recognizers.ModelRegistry()
+registry.load_all()
+if not registry.names():
     print("Vosk model not found. Please download a Russian model.")
-    model = None
-else:
-    model = vosk.Model(MODEL_PATH)
+# Changed model directories are reloaded in the background
+registry.start_watcher()
+
+def recognize(pool, chunks):
+    """Распознать куски PCM 16 кГц моно распознавателем из пула"""
+    rec = pool.acquire()
+    parts = []
+    for chunk in chunks:
+        if rec.AcceptWaveform(chunk):
+            parts.append(json.loads(rec.Result()).get("text", ""))
+    parts.append(json.loads(rec.FinalResult()).get("text", ""))
+    # After a failure (bad audio) the recognizer is dropped; the pool makes a fresh one when needed
+    pool.release(rec)
+    return " ".join(part for part in parts if part)
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
-    if not model:
-        return jsonify({"error": "Vosk model not loaded"}), 500
-
-    if 'audio' not in request.files:
+    # multipart с полем audio (браузер) или аудио телом запроса (бэкенд, /api/voice)
+    model_name = request.args.get("model")
+    if 'audio' in request.files:
+        upload = request.files['audio']
+        stream, mimetype, params = upload.stream, upload.mimetype, upload.mimetype_params
+        model_name = model_name or request.form.get("model")
+    elif request.content_length and not request.mimetype.startswith("multipart/"):
+        stream, mimetype, params = request.stream, request.mimetype, request.mimetype_params
+    else:
         return jsonify({"error": "No audio file provided"}), 400
 
-    audio_file = request.files['audio']
-
-    # Save audio temporarily
-    temp_path = f"temp_{os.getpid()}.wav"
-    audio_file.save(temp_path)
-
     try:
-        # Initialize recognizer
-        rec = vosk.KaldiRecognizer(model, 16000)
-
-        # Read and process audio
-        with open(temp_path, "rb") as f:
-            data = f.read()
+        pool = registry.get(model_name or None)
+    except recognizers.ModelNotFound:
+        if not registry.names():
+            return jsonify({"error": "Vosk model not loaded"}), 500
+        return jsonify({"error": f"Unknown model: {model_name}", "models": registry.names()}), 404
 
-        if rec.AcceptWaveform(data):
-            result = json.loads(rec.Result())
-            text = result.get("text", "")
-        else:
-            result = json.loads(rec.PartialResult())
-            text = result.get("partial", "")
+    stats = audio.AudioStats()
+    started = time.perf_counter()
+    try:
+        # Decoding, resampling and VAD run lazily as the recognizer pulls chunks
+        with tracing.span("recognize", mimetype=mimetype, model=pool.name) as active:
+            text = recognize(pool, audio.trim_silence(audio.decode(stream, mimetype, params), stats))
+            if active is not None:
+                active["attributes"].update(audio_s=stats.audio_s, speech_s=stats.speech_s)
+    except audio.AudioError as e:
+        return jsonify({"error": str(e)}), 415
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Clean up
-        os.remove(temp_path)
+    elapsed = time.perf_counter() - started
+    tracing.log_fields(model=pool.name, audio_s=stats.audio_s, speech_s=stats.speech_s, text_chars=len(text),
+                       rtf=round(elapsed / stats.audio_s, 3) if stats.audio_s else None)
+    return jsonify({"text": text, "model": pool.name, "duration": stats.audio_s, "speech": stats.speech_s})
 
-        return jsonify({"text": text})
+@app.route('/models', methods=['GET'])
+def list_models():
+    return jsonify(registry.stats())
 
-    except Exception as e:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        return jsonify({"error": str(e)}), 500
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    """Перезагрузить модель ?name= (или все) в фоне; запросы продолжают идти на старой"""
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        names = registry.reload(request.args.get("name"))
+    except recognizers.ModelNotFound as e:
+        return jsonify({"error": f"Unknown model: {e}"}), 404
+    return jsonify({"reloading": names}), 202
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file